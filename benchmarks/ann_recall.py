@@ -0,0 +1,112 @@
+"""
+Recall vs latency benchmark: IVF approximate search against exact search.
+
+Builds a synthetic gallery of L2-normalized 512-d embeddings (identities drawn
+around a set of cluster centres, like faces sharing demographics/pose), then
+queries it with noisy copies of enrolled identities. Exact brute-force search
+is the ground truth; recall@1 is the fraction of probes for which the IVF
+index returns the same enrollment.
+
+Usage:
+    python -m benchmarks.ann_recall --size 200000 --queries 500
+    python -m benchmarks.ann_recall --size 50000 --nprobe 4 8 16 32 --output ann.json
+"""
+
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+
+from benchmarks.common import emit
+from services.ann import IVFIndex, auto_nlist, train_centroids
+from services.gallery import EMBEDDING_DIM, GalleryIndex
+
+
+def _normalize(x: np.ndarray) -> np.ndarray:
+    return (x / np.linalg.norm(x, axis=-1, keepdims=True)).astype(np.float32)
+
+
+def synthetic_gallery(size: int, clusters: int, spread: float, rng: np.random.Generator) -> np.ndarray:
+    """Unit embeddings scattered around random cluster centres."""
+    centres = _normalize(rng.standard_normal((clusters, EMBEDDING_DIM)))
+    owner = rng.integers(0, clusters, size=size)
+    noise = rng.standard_normal((size, EMBEDDING_DIM)).astype(np.float32) * spread / np.sqrt(EMBEDDING_DIM)
+    return _normalize(centres[owner] + noise)
+
+
+def noisy_probes(gallery: np.ndarray, count: int, noise: float, rng: np.random.Generator):
+    """Probes that are perturbed copies of random gallery rows (cosine sim ~0.7)."""
+    targets = rng.integers(0, gallery.shape[0], size=count)
+    jitter = rng.standard_normal((count, EMBEDDING_DIM)).astype(np.float32) * noise / np.sqrt(EMBEDDING_DIM)
+    return _normalize(gallery[targets] + jitter), targets
+
+
+def _time_queries(search, probes: np.ndarray):
+    results = []
+    start = time.perf_counter()
+    for probe in probes:
+        results.append(search(probe))
+    elapsed = time.perf_counter() - start
+    return results, elapsed / len(probes) * 1000.0
+
+
+def run(size: int, queries: int, nlist: int, nprobes, clusters: int, spread: float, noise: float, seed: int):
+    rng = np.random.default_rng(seed)
+    matrix = synthetic_gallery(size, clusters, spread, rng)
+    probes, _ = noisy_probes(matrix, queries, noise, rng)
+
+    gallery = GalleryIndex(capacity=size)
+    for i, vector in enumerate(matrix):
+        gallery.upsert(i, i, f"user{i}", vector, replace_user=False)
+
+    exact, exact_ms = _time_queries(gallery.search, probes)
+    truth = np.array([m["id"] for m in exact])
+
+    nlist = nlist or auto_nlist(size)
+    start = time.perf_counter()
+    centroids = train_centroids(gallery.matrix, nlist)
+    train_s = time.perf_counter() - start
+
+    report = {
+        "size": size,
+        "queries": queries,
+        "nlist": int(centroids.shape[0]),
+        "train_seconds": round(train_s, 3),
+        "exact": {"latency_ms": round(exact_ms, 4)},
+        "ivf": [],
+    }
+    for nprobe in nprobes:
+        gallery.attach_ann(IVFIndex(centroids, nprobe, size))
+        approx, ivf_ms = _time_queries(gallery.search, probes)
+        found = np.array([m["id"] for m in approx])
+        report["ivf"].append({
+            "nprobe": nprobe,
+            "latency_ms": round(ivf_ms, 4),
+            "speedup": round(exact_ms / ivf_ms, 2) if ivf_ms else None,
+            "recall_at_1": round(float(np.mean(found == truth)), 4),
+        })
+        gallery.ann = None
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=100000, help="gallery size (default: 100000)")
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--nlist", type=int, default=0, help="inverted lists (0 = sqrt(size))")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 8, 16, 32, 64])
+    parser.add_argument("--clusters", type=int, default=256)
+    parser.add_argument("--spread", type=float, default=1.5, help="identity spread around cluster centres")
+    parser.add_argument("--noise", type=float, default=1.0, help="probe noise (1.0 ~ cosine 0.7 to its identity)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="write JSON report to this file")
+    args = parser.parse_args()
+
+    results = run(args.size, args.queries, args.nlist, args.nprobe, args.clusters, args.spread, args.noise, args.seed)
+    parameters = {key: value for key, value in vars(args).items() if key != "output"}
+    emit("ann_recall", results, parameters, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Embedding decode cost: legacy JSON versus the binary formats.
+
+Times what a cache read pays to turn stored bytes back into float32 vectors:
+- single embeddings (the per-user verify cache): JSON array text versus
+  float32/float16 blobs via decode_embedding
+- enrollment lists of N records: legacy JSON documents, packed blobs
+  (pack_enrollments, float32/float16) and per-enrollment hash fields
+  (pack_enrollment, one value per record)
+
+Usage:
+    python -m benchmarks.codec_decode
+    python -m benchmarks.codec_decode --records 100 10000 --output codec.json
+"""
+
+import argparse
+import json
+from pathlib import Path
+
+import numpy as np
+
+from benchmarks.common import emit, measure
+from services.codec import (
+    decode_embedding,
+    encode_embedding,
+    pack_enrollment,
+    pack_enrollments,
+    unpack_enrollment,
+    unpack_enrollments,
+)
+from services.gallery import EMBEDDING_DIM
+
+
+def synthetic_records(count: int, rng: np.random.Generator):
+    vectors = rng.standard_normal((count, EMBEDDING_DIM), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return [
+        {
+            "id": i + 1,
+            "user_id": i + 1,
+            "label": f"user {i + 1}",
+            "encoding": vectors[i],
+            "status": "active",
+            "created_at": "2024-01-01 08:00:00",
+        }
+        for i in range(count)
+    ]
+
+
+def _legacy_json(records) -> bytes:
+    return json.dumps([dict(rec, encoding=rec["encoding"].tolist()) for rec in records]).encode()
+
+
+def single(rng: np.random.Generator, repeat: int):
+    vector = synthetic_records(1, rng)[0]["encoding"]
+    formats = {
+        "json": json.dumps(vector.tolist()),
+        "float32": encode_embedding(vector, "float32"),
+        "float16": encode_embedding(vector, "float16"),
+    }
+    return {
+        name: dict(measure(lambda value=value: decode_embedding(value), repeat, min_time=0.2), bytes=len(value))
+        for name, value in formats.items()
+    }
+
+
+def lists(counts, rng: np.random.Generator, repeat: int):
+    results = []
+    for count in counts:
+        records = synthetic_records(count, rng)
+        blobs = {
+            "json": _legacy_json(records),
+            "packed_float32": pack_enrollments(records, "float32"),
+            "packed_float16": pack_enrollments(records, "float16"),
+        }
+        fields = {rec["id"]: pack_enrollment(rec, "float32") for rec in records}
+        runs = max(3, repeat // count)
+        entry = {"records": count}
+        for name, blob in blobs.items():
+            entry[name] = dict(measure(lambda blob=blob: unpack_enrollments(blob), runs, min_time=0.2), bytes=len(blob))
+        entry["hash_float32"] = dict(
+            measure(lambda: [unpack_enrollment(i, value) for i, value in fields.items()], runs, min_time=0.2),
+            bytes=sum(len(value) for value in fields.values()),
+        )
+        results.append(entry)
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, nargs="+", default=[1, 100, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=2000, help="timed decodes (divided by the record count for lists)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="write JSON report to this file")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    results = {
+        "embedding": single(rng, args.repeat),
+        "enrollment_list": lists(args.records, rng, args.repeat),
+    }
+    parameters = {key: value for key, value in vars(args).items() if key != "output"}
+    emit("codec_decode", results, parameters, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Shared helpers for the benchmark scripts: timing, environment and JSON output.
+
+Every benchmark prints one JSON report (and optionally writes it to --output)
+with an "environment" block, so results from two commits can be diffed or
+compared with benchmarks.compare.
+"""
+
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+
+def environment() -> Dict[str, Any]:
+    """Commit, interpreter and machine the report was produced on."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, timeout=10
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def summarize(samples_s: List[float]) -> Dict[str, float]:
+    """Latency statistics in milliseconds."""
+    ms = np.asarray(samples_s, dtype=np.float64) * 1000.0
+    return {
+        "n": int(ms.size),
+        "mean_ms": round(float(ms.mean()), 4),
+        "p50_ms": round(float(np.percentile(ms, 50)), 4),
+        "p95_ms": round(float(np.percentile(ms, 95)), 4),
+        "p99_ms": round(float(np.percentile(ms, 99)), 4),
+        "min_ms": round(float(ms.min()), 4),
+    }
+
+
+def measure(func: Callable[[], Any], repeat: int, warmup: int = 3, min_time: float = 0.0) -> Dict[str, float]:
+    """
+    Call func() repeatedly and summarize per-call latency.
+
+    Runs at least `repeat` timed calls, continuing until `min_time` seconds
+    have elapsed so very fast operations still get stable percentiles.
+    """
+    for _ in range(warmup):
+        func()
+    samples: List[float] = []
+    started = time.perf_counter()
+    while len(samples) < repeat or time.perf_counter() - started < min_time:
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def emit(name: str, results: Any, parameters: Dict[str, Any], output: Optional[Path]) -> Dict[str, Any]:
+    """Print (and optionally save) a benchmark report."""
+    report = {
+        "benchmark": name,
+        "environment": environment(),
+        "parameters": parameters,
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if output:
+        output.write_text(text)
+    print(text)
+    return report
@@ -0,0 +1,90 @@
+"""
+Compare two benchmark reports (e.g. from two commits).
+
+Matches results by their identifying fields (gallery size, record count,
+resolution, concurrency, ...), compares one latency statistic (p50 by
+default) and throughput, and prints the changes as JSON. Exits with status
+1 when anything got slower than --threshold, so it can gate CI.
+
+Usage:
+    python -m benchmarks.compare before.json after.json
+    python -m benchmarks.compare before.json after.json --metric p95_ms --threshold 0.2
+"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+from typing import Any, Dict, Iterator, Tuple
+
+# Fields that identify a result row inside a list
+_ID_FIELDS = ("size", "records", "resolution", "format", "reduced", "concurrency", "rerank")
+
+# Statistics where larger is better
+_HIGHER_IS_BETTER = {"throughput_rps"}
+
+
+def _flatten(node: Any, path: str = "") -> Iterator[Tuple[str, float]]:
+    if isinstance(node, dict):
+        for key, value in node.items():
+            if key in ("environment", "parameters"):
+                continue
+            yield from _flatten(value, f"{path}.{key}" if path else key)
+    elif isinstance(node, list):
+        for i, item in enumerate(node):
+            if isinstance(item, dict) and any(field in item for field in _ID_FIELDS):
+                label = ",".join(f"{field}={item[field]}" for field in _ID_FIELDS if field in item)
+            else:
+                label = str(i)
+            yield from _flatten(item, f"{path}[{label}]")
+    elif isinstance(node, (int, float)) and not isinstance(node, bool):
+        yield path, float(node)
+
+
+def compare(before: Dict[str, Any], after: Dict[str, Any], metric: str, threshold: float) -> Dict[str, Any]:
+    old = dict(_flatten(before))
+    new = dict(_flatten(after))
+    changes = []
+    for path, value in new.items():
+        stat = path.rsplit(".", 1)[-1]
+        if stat != metric and stat not in _HIGHER_IS_BETTER:
+            continue
+        previous = old.get(path)
+        if not previous:
+            continue
+        ratio = value / previous
+        slower = ratio < 1 - threshold if stat in _HIGHER_IS_BETTER else ratio > 1 + threshold
+        faster = ratio > 1 + threshold if stat in _HIGHER_IS_BETTER else ratio < 1 - threshold
+        changes.append({
+            "path": path,
+            "before": previous,
+            "after": value,
+            "ratio": round(ratio, 3),
+            "verdict": "regression" if slower else "improvement" if faster else "unchanged",
+        })
+    return {
+        "before": before.get("environment", {}).get("commit"),
+        "after": after.get("environment", {}).get("commit"),
+        "metric": metric,
+        "threshold": threshold,
+        "regressions": sum(change["verdict"] == "regression" for change in changes),
+        "improvements": sum(change["verdict"] == "improvement" for change in changes),
+        "changes": changes,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("before", type=Path)
+    parser.add_argument("after", type=Path)
+    parser.add_argument("--metric", default="p50_ms", help="latency statistic to compare (default: p50_ms)")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative change counted as a regression")
+    args = parser.parse_args()
+
+    result = compare(json.loads(args.before.read_text()), json.loads(args.after.read_text()), args.metric, args.threshold)
+    print(json.dumps(result, indent=2))
+    sys.exit(1 if result["regressions"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Accuracy and memory of compressed galleries against exact float32 search.
+
+Builds the same synthetic gallery (identities around cluster centres, as in
+benchmarks.ann_recall) once per GALLERY_COMPRESSION format and queries it
+with noisy copies of enrolled identities. Exact float32 cosine search, as
+run by identify_face, is the ground truth. For every format it reports:
+
+    bytes_per_face      codes (and codebooks) per enrollment, vs 2048 for float32
+    approximate         recall@1 and distance error of the compressed scan alone
+    rescored            recall@1, recall@k, agreement of the match decision at
+                        --threshold and error of the reported distance after
+                        re-scoring the GALLERY_RERANK shortlist exactly
+
+Re-scoring uses the original vectors, i.e. what the service reads back from
+the Redis enrollment hash with EMBEDDING_FORMAT=float32. With float16
+storage both the re-scored and the uncompressed distances carry float16
+rounding.
+
+Usage:
+    python -m benchmarks.compression_recall
+    python -m benchmarks.compression_recall --size 200000 --rerank 16 64 256 --output compression.json
+"""
+
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+
+from benchmarks.ann_recall import noisy_probes, synthetic_gallery
+from benchmarks.common import emit, measure
+from services.gallery import GalleryIndex, rescore
+from services.recognition import DEFAULT_THRESHOLD
+from services.similarity import COMPRESSION_FORMATS, EMBEDDING_DIM
+
+
+def _report_format(fmt, enrollments, vectors, probes, truth, rerank_values, top_k, threshold, subspaces):
+    start = time.perf_counter()
+    gallery = GalleryIndex.from_enrollments(
+        enrollments, compression=fmt, rerank=max(rerank_values), keep_float32=False, pq_subspaces=subspaces
+    )
+    build_s = time.perf_counter() - start
+    size = len(gallery)
+    exact_best = np.array([ranked[0]["id"] for ranked in truth])
+    exact_distance = np.array([ranked[0]["distance"] for ranked in truth])
+
+    approx_best, approx_error = [], []
+    for probe, ranked in zip(probes, truth):
+        approx = gallery.distances(probe)
+        approx_best.append(int(gallery.ids[int(np.argmin(approx))]))
+        # Approximation error of the true nearest enrollment's distance
+        row = int(np.flatnonzero(gallery.ids == ranked[0]["id"])[0])
+        approx_error.append(abs(float(approx[row]) - ranked[0]["distance"]))
+
+    report = {
+        "format": fmt,
+        "codes": type(gallery.codes).__name__,
+        "bytes_per_face": round(gallery.codes.nbytes / size, 1),
+        "compression_ratio": round(EMBEDDING_DIM * 4 / (gallery.codes.nbytes / size), 1),
+        "build_seconds": round(build_s, 3),
+        "approximate": {
+            "recall_at_1": round(float(np.mean(np.array(approx_best) == exact_best)), 4),
+            "mean_abs_distance_error": round(float(np.mean(approx_error)), 5),
+            "max_abs_distance_error": round(float(np.max(approx_error)), 5),
+        },
+        "rescored": [],
+    }
+
+    cycle = iter(np.resize(np.arange(len(probes)), 10_000))
+    for rerank in rerank_values:
+        gallery.rerank = rerank
+        ranked = [rescore(probe, gallery.shortlist(probe, top_k), vectors, top_k) for probe in probes]
+        best = np.array([r[0]["id"] for r in ranked])
+        distance = np.array([r[0]["distance"] for r in ranked])
+        recall_k = np.mean([
+            len({c["id"] for c in found} & {c["id"] for c in expected}) / len(expected)
+            for found, expected in zip(ranked, truth)
+        ])
+        report["rescored"].append({
+            "rerank": rerank,
+            "recall_at_1": round(float(np.mean(best == exact_best)), 4),
+            f"recall_at_{top_k}": round(float(recall_k), 4),
+            "decision_agreement": round(float(np.mean((distance <= threshold) == (exact_distance <= threshold))), 4),
+            "max_abs_distance_error": round(float(np.max(np.abs(distance - exact_distance))), 6),
+            "shortlist": measure(lambda: gallery.shortlist(probes[next(cycle)], top_k), 50),
+        })
+    return report
+
+
+def run(size, queries, formats, rerank_values, top_k, threshold, subspaces, clusters, spread, noise, seed):
+    rng = np.random.default_rng(seed)
+    matrix = synthetic_gallery(size, clusters, spread, rng)
+    probes, _ = noisy_probes(matrix, queries, noise, rng)
+    enrollments = [
+        {"id": i, "user_id": i, "label": f"user{i}", "encoding": vector}
+        for i, vector in enumerate(matrix)
+    ]
+    vectors = {i: vector for i, vector in enumerate(matrix)}
+
+    exact = GalleryIndex.from_enrollments(enrollments)
+    truth = [exact.search_top_k(probe, top_k) for probe in probes]
+    exact_distance = np.array([ranked[0]["distance"] for ranked in truth])
+    results = {
+        "size": size,
+        "queries": queries,
+        "float32_bytes_per_face": EMBEDDING_DIM * 4,
+        "exact": {
+            "search": measure(lambda: exact.search(probes[0]), 50),
+            "matches_at_threshold": round(float(np.mean(exact_distance <= threshold)), 4),
+        },
+        "formats": [],
+    }
+    del exact
+    for fmt in formats:
+        results["formats"].append(
+            _report_format(fmt, enrollments, vectors, probes, truth, rerank_values, top_k, threshold, subspaces)
+        )
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=100000, help="gallery size (default: 100000)")
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--formats", nargs="+", choices=COMPRESSION_FORMATS, default=list(COMPRESSION_FORMATS))
+    parser.add_argument("--rerank", type=int, nargs="+", default=[0, 16, 64, 256], help="shortlist sizes re-scored")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="match threshold for decisions")
+    parser.add_argument("--pq-subspaces", type=int, default=128)
+    parser.add_argument("--clusters", type=int, default=256)
+    parser.add_argument("--spread", type=float, default=1.5, help="identity spread around cluster centres")
+    parser.add_argument(
+        "--noise", type=float, default=1.2, help="probe noise (1.2 ~ cosine 0.64, around the default threshold)"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="write JSON report to this file")
+    args = parser.parse_args()
+
+    results = run(
+        args.size, args.queries, args.formats, args.rerank, args.top_k, args.threshold,
+        args.pq_subspaces, args.clusters, args.spread, args.noise, args.seed,
+    )
+    parameters = {key: value for key, value in vars(args).items() if key != "output"}
+    emit("compression_recall", results, parameters, args.output)
+
+
+if __name__ == "__main__":
+    main()
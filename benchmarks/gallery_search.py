@@ -0,0 +1,109 @@
+"""
+Gallery search latency at increasing gallery sizes.
+
+Fills a GalleryIndex with synthetic L2-normalized 512-d embeddings and times
+the three search paths used by the API: best match (/identify), top-k
+(/identify with top_k > 1) and batched best match (/identify/batch).
+Exact search by default (--compression scans float16/int8/PQ codes and
+keeps the --rerank best rows, without re-scoring them); see
+benchmarks.ann_recall for the IVF index and benchmarks.compression_recall
+for the accuracy of compressed galleries.
+
+A 1M-row gallery needs about 2 GB for the float32 matrix.
+
+Usage:
+    python -m benchmarks.gallery_search
+    python -m benchmarks.gallery_search --sizes 1000 10000 --output search.json
+"""
+
+import argparse
+import itertools
+import time
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from benchmarks.ann_recall import noisy_probes
+from benchmarks.common import emit, measure
+from services.gallery import EMBEDDING_DIM, GalleryIndex
+from services.similarity import COMPRESSION_FORMATS, make_codes
+
+# Rows generated per step; keeps the float temporaries small at 1M rows
+_CHUNK = 65536
+
+
+def build_gallery(
+    size: int,
+    rng: np.random.Generator,
+    clusters: int = 256,
+    spread: float = 1.5,
+    compression: Optional[str] = None,
+    rerank: int = 0,
+) -> GalleryIndex:
+    """Gallery of unit embeddings scattered around random cluster centres (codes trained on the first chunk)."""
+    centres = rng.standard_normal((clusters, EMBEDDING_DIM), dtype=np.float32)
+    centres /= np.linalg.norm(centres, axis=1, keepdims=True)
+    gallery = None
+    for offset in range(0, size, _CHUNK):
+        n = min(_CHUNK, size - offset)
+        rows = centres[rng.integers(0, clusters, size=n)]
+        rows += rng.standard_normal((n, EMBEDDING_DIM), dtype=np.float32) * (spread / np.sqrt(EMBEDDING_DIM))
+        rows /= np.linalg.norm(rows, axis=1, keepdims=True)
+        if gallery is None:
+            codes = make_codes(compression, EMBEDDING_DIM, size, rows) if compression else None
+            gallery = GalleryIndex(capacity=size, codes=codes, rerank=rerank, keep_float32=False)
+        gallery.extend([
+            {"id": i, "user_id": i, "label": f"user{i}", "encoding": vector}
+            for i, vector in enumerate(rows, start=offset)
+        ])
+    return gallery
+
+
+def run(sizes, queries: int, top_k: int, batch: int, seed: int, compression: Optional[str] = None, rerank: int = 0):
+    rng = np.random.default_rng(seed)
+    results = []
+    for size in sizes:
+        start = time.perf_counter()
+        gallery = build_gallery(size, rng, compression=compression, rerank=rerank)
+        build_s = time.perf_counter() - start
+        # Decoded rows for a compressed gallery; the first chunk is enough to draw probes from
+        source = gallery.codes.decode(np.arange(min(size, _CHUNK))) if gallery.approximate else gallery.matrix
+        probes, _ = noisy_probes(source, max(queries, batch), noise=1.0, rng=rng)
+
+        cycle = itertools.cycle(probes)
+        repeat = max(10, min(queries, 20_000_000 // size))
+        results.append({
+            "size": size,
+            "build_seconds": round(build_s, 3),
+            "gallery_bytes": gallery.nbytes,
+            "search": measure(lambda: gallery.search(next(cycle)), repeat),
+            "search_top_k": dict(measure(lambda: gallery.search_top_k(next(cycle), top_k), repeat), k=top_k),
+            "search_batch": dict(
+                measure(lambda: gallery.search_batch(probes[:batch]), max(5, repeat // batch)),
+                probes=batch,
+            ),
+        })
+        del gallery
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000, 1000000])
+    parser.add_argument("--queries", type=int, default=200, help="timed searches per size (fewer for huge galleries)")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--batch", type=int, default=32, help="probes per search_batch call")
+    parser.add_argument("--compression", choices=COMPRESSION_FORMATS, help="scan compressed codes instead of float32")
+    parser.add_argument("--rerank", type=int, default=64, help="shortlist kept from a compressed scan")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="write JSON report to this file")
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.queries, args.top_k, args.batch, args.seed, args.compression, args.rerank)
+    parameters = {key: value for key, value in vars(args).items() if key != "output"}
+    emit("gallery_search", results, parameters, args.output)
+
+
+if __name__ == "__main__":
+    main()
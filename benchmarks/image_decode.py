@@ -0,0 +1,92 @@
+"""
+Upload decode latency (recognition._decode_image) across resolutions.
+
+Encodes a synthetic photo-like frame (smooth gradients plus sensor noise)
+at each resolution as JPEG and PNG and times _decode_image on it, with the
+reduced-resolution JPEG decode (DECODE_REDUCED) both on and off.
+
+Usage:
+    python -m benchmarks.image_decode
+    python -m benchmarks.image_decode --resolutions 1280x720 3840x2160 --output decode.json
+"""
+
+import argparse
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from benchmarks.common import emit, measure
+from services.config import settings
+from services.recognition import _decode_image
+
+
+def synthetic_frame(width: int, height: int, rng: np.random.Generator) -> np.ndarray:
+    """BGR frame that compresses roughly like a camera photo."""
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    base = np.stack([
+        127 + 100 * np.sin(x / 97.0) * np.cos(y / 131.0),
+        127 + 100 * np.sin((x + y) / 173.0),
+        127 + 100 * np.cos(x / 59.0 - y / 211.0),
+    ], axis=-1)
+    noise = rng.normal(0, 6, size=base.shape).astype(np.float32)
+    return np.clip(base + noise, 0, 255).astype(np.uint8)
+
+
+def _parse_resolution(value: str):
+    width, _, height = value.lower().partition("x")
+    return int(width), int(height)
+
+
+def run(resolutions, formats, repeat: int, quality: int, seed: int):
+    rng = np.random.default_rng(seed)
+    reduced_default = settings.DECODE_REDUCED
+    results = []
+    try:
+        for width, height in resolutions:
+            frame = synthetic_frame(width, height, rng)
+            for fmt in formats:
+                params = [cv2.IMWRITE_JPEG_QUALITY, quality] if fmt == "jpeg" else []
+                ok, encoded = cv2.imencode(".jpg" if fmt == "jpeg" else ".png", frame, params)
+                if not ok:
+                    raise RuntimeError(f"Could not encode {fmt} at {width}x{height}")
+                data = encoded.tobytes()
+                for reduced in ([True, False] if fmt == "jpeg" else [False]):
+                    settings.DECODE_REDUCED = reduced
+                    image, scale, _ = _decode_image(data)
+                    results.append(dict(
+                        measure(lambda: _decode_image(data), repeat, min_time=0.2),
+                        resolution=f"{width}x{height}",
+                        format=fmt,
+                        reduced=reduced,
+                        bytes=len(data),
+                        scale=scale,
+                        decoded=f"{image.shape[1]}x{image.shape[0]}",
+                    ))
+    finally:
+        settings.DECODE_REDUCED = reduced_default
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--resolutions",
+        nargs="+",
+        default=["640x480", "1280x720", "1920x1080", "2560x1440", "3840x2160", "4000x3000"],
+    )
+    parser.add_argument("--formats", nargs="+", choices=["jpeg", "png"], default=["jpeg", "png"])
+    parser.add_argument("--repeat", type=int, default=30)
+    parser.add_argument("--quality", type=int, default=90, help="JPEG quality")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="write JSON report to this file")
+    args = parser.parse_args()
+
+    resolutions = [_parse_resolution(value) for value in args.resolutions]
+    results = run(resolutions, args.formats, args.repeat, args.quality, args.seed)
+    parameters = {key: value for key, value in vars(args).items() if key != "output"}
+    emit("image_decode", results, parameters, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+"""
+End-to-end load test of /verify and /identify without MySQL or Redis.
+
+The FastAPI app is driven in-process through httpx's ASGI transport, with
+services.database.tenant_manager replaced by InMemoryTenantManager: one
+tenant whose gallery holds the probe's own embedding (user 1) plus
+synthetic enrollments. Everything else (upload ingestion, decode, the
+inference scheduler, the model, gallery search, middleware) is the real
+code path.
+
+--model real uses the InsightFace model and needs --image, a photo with one
+face. --model fake (the default) swaps in a deterministic stand-in detector
+and recognizer so the suite runs without model weights; it measures the
+service overhead around the model, with --model-delay-ms simulating the
+model's compute time.
+
+The load generator shares the event loop with the app, so absolute numbers
+include client overhead; compare reports from the same machine.
+
+Usage:
+    python -m benchmarks.load
+    python -m benchmarks.load --model real --image face.jpg --concurrency 1 8 32 --requests 500
+"""
+
+import argparse
+import asyncio
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import cv2
+import numpy as np
+
+from benchmarks.common import emit, summarize
+
+TENANT_ID = 1
+USER_ID = 1
+
+
+class InMemoryTenantManager:
+    """TenantManager stand-in: one tenant, a prebuilt gallery, no network."""
+
+    def __init__(self, probe_encoding: np.ndarray, gallery_size: int, seed: int = 0):
+        from services.database import TenantConfig
+        from services.gallery import EMBEDDING_DIM, GalleryIndex
+
+        self.config = TenantConfig(
+            id=TENANT_ID,
+            name="benchmark",
+            db_host="localhost",
+            db_port=3306,
+            db_name="benchmark",
+            db_user="benchmark",
+            db_pass=None,
+            status="active",
+        )
+        self.enrollment = {
+            "id": USER_ID,
+            "user_id": USER_ID,
+            "label": "probe",
+            "encoding": np.asarray(probe_encoding, dtype=np.float32),
+            "status": "active",
+            "created_at": None,
+        }
+        rng = np.random.default_rng(seed)
+        others = rng.standard_normal((max(gallery_size - 1, 0), EMBEDDING_DIM), dtype=np.float32)
+        others /= np.linalg.norm(others, axis=1, keepdims=True)
+        self.gallery = GalleryIndex(capacity=max(gallery_size, 1))
+        self.gallery.upsert(USER_ID, USER_ID, "probe", self.enrollment["encoding"], replace_user=False)
+        for i, vector in enumerate(others, start=USER_ID + 1):
+            self.gallery.upsert(i, i, f"user{i}", vector, replace_user=False)
+
+    async def initialize(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    async def get_tenant_config(self, tenant_id: int):
+        return self.config if tenant_id == TENANT_ID else None
+
+    async def get_gallery(self, tenant_id: int):
+        return self.gallery
+
+    async def get_enrollments(self, tenant_id: int) -> List[Dict[str, Any]]:
+        return [self.enrollment]
+
+    async def get_user_enrollment(self, tenant_id: int, user_id: int) -> Optional[Dict[str, Any]]:
+        return self.enrollment if (tenant_id, user_id) == (TENANT_ID, USER_ID) else None
+
+    def get_l1_stats(self) -> Dict[str, Any]:
+        return {"pools": {"pools": 0, "tenants": 0, "connections": 0, "in_use": 0, "max_connections": 0}}
+
+
+class _FakeDetector:
+    input_size = (640, 640)
+
+    def __init__(self, delay: float):
+        self.delay = delay
+
+    def detect(self, image, input_size=None, max_num=0, metric="default"):
+        if self.delay:
+            time.sleep(self.delay / 2)
+        h, w = image.shape[:2]
+        bboxes = np.array([[w * 0.25, h * 0.2, w * 0.75, h * 0.8, 0.95]], dtype=np.float32)
+        kpss = np.array([[
+            [w * 0.40, h * 0.40], [w * 0.60, h * 0.40], [w * 0.50, h * 0.52],
+            [w * 0.42, h * 0.64], [w * 0.58, h * 0.64],
+        ]], dtype=np.float32)
+        return bboxes, kpss
+
+
+class _FakeRecognizer:
+    input_size = (112, 112)
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.projection = np.random.default_rng(0).standard_normal((16 * 16 * 3, 512)).astype(np.float32)
+
+    def get_feat(self, crops):
+        if self.delay:
+            time.sleep(self.delay / 2)
+        small = np.stack([cv2.resize(crop, (16, 16)).reshape(-1) for crop in crops]).astype(np.float32)
+        return small @ self.projection
+
+
+class FakeFaceModel:
+    """Deterministic stand-in for the InsightFace model (same embedding for the same image)."""
+
+    def __init__(self, delay: float = 0.0):
+        self.det_model = _FakeDetector(delay)
+        self.models = {"detection": self.det_model, "recognition": _FakeRecognizer(delay)}
+
+
+async def _worker(client, path: str, data: Dict[str, str], image: bytes, take, samples, statuses):
+    while take():
+        start = time.perf_counter()
+        response = await client.post(path, data=data, files={"file": ("probe.jpg", image, "image/jpeg")})
+        samples.append(time.perf_counter() - start)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+
+async def _run_level(client, path: str, data: Dict[str, str], image: bytes, concurrency: int, requests: int):
+    remaining = [requests]
+
+    def take() -> bool:
+        if remaining[0] <= 0:
+            return False
+        remaining[0] -= 1
+        return True
+
+    samples: List[float] = []
+    statuses: Dict[int, int] = {}
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        _worker(client, path, data, image, take, samples, statuses) for _ in range(concurrency)
+    ))
+    elapsed = time.perf_counter() - start
+    return dict(
+        summarize(samples),
+        concurrency=concurrency,
+        seconds=round(elapsed, 3),
+        throughput_rps=round(len(samples) / elapsed, 2),
+        status={str(code): count for code, count in sorted(statuses.items())},
+    )
+
+
+async def run(args) -> Dict[str, Any]:
+    # Imported here so INFERENCE_MODE set by main() is seen by services.config
+    import httpx
+
+    import main as app_module
+    from benchmarks.image_decode import synthetic_frame
+    from services import enrollment, inference, insight
+
+    if args.model == "fake":
+        insight._model = FakeFaceModel(args.model_delay_ms / 1000.0)
+        image = cv2.imencode(".jpg", synthetic_frame(640, 480, np.random.default_rng(args.seed)))[1].tobytes()
+    else:
+        image = args.image.read_bytes()
+
+    await inference.warm_up()
+    try:
+        decoded = cv2.imdecode(np.frombuffer(image, np.uint8), cv2.IMREAD_COLOR)
+        probe_encoding, _ = await inference.encode(decoded)
+        manager = InMemoryTenantManager(probe_encoding, args.gallery_size, args.seed)
+        enrollment.tenant_manager = manager
+        app_module.tenant_manager = manager
+
+        transport = httpx.ASGITransport(app=app_module.app)
+        results: Dict[str, Any] = {}
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+            endpoints = {
+                "verify": ("/verify", {"tenant_id": str(TENANT_ID), "user_id": str(USER_ID)}),
+                "identify": ("/identify", {"tenant_id": str(TENANT_ID)}),
+            }
+            for name in args.endpoints:
+                path, data = endpoints[name]
+                # Warm-up requests (scheduler threads, first-call allocations)
+                await _run_level(client, path, data, image, 1, 3)
+                results[name] = [
+                    await _run_level(client, path, data, image, concurrency, args.requests)
+                    for concurrency in args.concurrency
+                ]
+        return results
+    finally:
+        inference.shutdown()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoints", nargs="+", choices=["verify", "identify"], default=["verify", "identify"])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--requests", type=int, default=200, help="requests per endpoint and concurrency level")
+    parser.add_argument("--gallery-size", type=int, default=10000, help="enrollments in the tenant gallery")
+    parser.add_argument("--model", choices=["fake", "real"], default="fake")
+    parser.add_argument("--model-delay-ms", type=float, default=0.0, help="simulated compute per image (fake model)")
+    parser.add_argument("--image", type=Path, help="probe photo with one face (required with --model real)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="write JSON report to this file")
+    args = parser.parse_args()
+    if args.model == "real" and args.image is None:
+        parser.error("--model real needs --image")
+    if args.model == "fake":
+        # The stand-in model only exists in this process
+        os.environ["INFERENCE_MODE"] = "thread"
+
+    results = asyncio.run(run(args))
+    parameters = {key: str(value) if isinstance(value, Path) else value for key, value in vars(args).items() if key != "output"}
+    emit("load", results, parameters, args.output)
+
+
+if __name__ == "__main__":
+    main()
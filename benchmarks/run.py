@@ -0,0 +1,73 @@
+"""
+Run the whole benchmark suite and write one combined JSON report.
+
+Each benchmark runs in its own interpreter (so settings and the model are
+not shared between them). --quick uses small sizes for a smoke run; the
+default matches the individual scripts' defaults, including the 1M-row
+gallery (about 2 GB of RAM).
+
+Usage:
+    python -m benchmarks.run --output bench.json
+    python -m benchmarks.run --quick --only gallery_search codec_decode
+    python -m benchmarks.compare before.json after.json
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+from benchmarks.common import ROOT, environment
+
+SUITE = {
+    "gallery_search": [],
+    "codec_decode": [],
+    "image_decode": [],
+    "load": [],
+    "ann_recall": [],
+    "compression_recall": [],
+}
+
+QUICK = {
+    "gallery_search": ["--sizes", "1000", "10000", "100000", "--queries", "50"],
+    "codec_decode": ["--records", "1", "100", "1000", "--repeat", "500"],
+    "image_decode": ["--resolutions", "640x480", "1920x1080", "3840x2160", "--repeat", "10"],
+    "load": ["--concurrency", "1", "8", "--requests", "50", "--gallery-size", "1000"],
+    "ann_recall": ["--size", "20000", "--queries", "100", "--nprobe", "8", "32"],
+    "compression_recall": ["--size", "20000", "--queries", "100", "--rerank", "0", "64"],
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", nargs="+", choices=list(SUITE), help="run only these benchmarks")
+    parser.add_argument("--quick", action="store_true", help="small sizes for a smoke run")
+    parser.add_argument("--output", type=Path, help="write the combined JSON report to this file")
+    args = parser.parse_args()
+
+    reports = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in args.only or SUITE:
+            output = Path(tmp) / f"{name}.json"
+            extra = QUICK[name] if args.quick else SUITE[name]
+            print(f"running {name} ...", file=sys.stderr)
+            subprocess.run(
+                [sys.executable, "-m", f"benchmarks.{name}", *extra, "--output", str(output)],
+                cwd=ROOT,
+                check=True,
+                stdout=subprocess.DEVNULL,
+            )
+            report = json.loads(output.read_text())
+            report.pop("environment", None)
+            reports[name] = report
+
+    text = json.dumps({"environment": environment(), "quick": args.quick, "reports": reports}, indent=2)
+    if args.output:
+        args.output.write_text(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,19 @@
+-- =========================================
+-- Binary face embedding storage
+-- =========================================
+-- Adds a compact `face_embedding` column (little-endian float32 = 2048 bytes,
+-- or float16 = 1024 bytes, see EMBEDDING_FORMAT) next to the legacy JSON
+-- `face_encoding` column, and makes the JSON column optional.
+--
+-- Existing rows do not need to be converted up front: the service rewrites
+-- legacy JSON rows into `face_embedding` lazily the first time they are read.
+-- Tables that have not been migrated keep working with JSON storage.
+--
+-- Run once per tenant table (contoh: enrollment_1 untuk tenant_id=1).
+
+ALTER TABLE `enrollment_1`
+    ADD COLUMN `face_embedding` VARBINARY(2048) NULL
+        COMMENT 'Face embedding 512-d, little-endian float32/float16'
+        AFTER `face_encoding`,
+    MODIFY `face_encoding` JSON NULL
+        COMMENT 'Legacy face embedding as JSON array (superseded by face_embedding)';
@@ -26,7 +26,8 @@ CREATE TABLE IF NOT EXISTS `enrollment_1` (
     `id` BIGINT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
     `user_id` BIGINT UNSIGNED NOT NULL,
     `label` VARCHAR(255) NOT NULL COMMENT 'Nama/identitas untuk enrollment',
-    `face_encoding` JSON NOT NULL COMMENT 'Face embedding 512-dimensional vector',
+    `face_encoding` JSON NULL COMMENT 'Legacy face embedding as JSON array (superseded by face_embedding)',
+    `face_embedding` VARBINARY(2048) NULL COMMENT 'Face embedding 512-d, little-endian float32/float16',
     `status` ENUM('active', 'inactive') NOT NULL DEFAULT 'active',
     `created_at` TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     `updated_at` TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
@@ -4,15 +4,48 @@ Face Recognition Service - Multi-Tenant API
 FastAPI application for face recognition with multi-tenant database support.
 """
 
+import asyncio
+import logging
+import time
 from contextlib import asynccontextmanager
+from typing import List, Optional
 
-from fastapi import Depends, FastAPI, File, Form, UploadFile
+from fastapi import Depends, FastAPI, File, Form, HTTPException, Query, Request, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse
+from starlette.routing import Match
 
-from models.recognition_request import FaceCompareRequest
+from models.recognition_request import EmbeddingCompareRequest, EmbeddingIdentifyRequest, FaceCompareRequest
 from services import recognition
 from services import enrollment
 from services.database import tenant_manager
+from services import inference
+from services import metrics
+from services import profiling
+from services.config import settings
+from services.pools import PoolBudgetExhausted
+
+
+logger = logging.getLogger(__name__)
+
+
+async def _prewarm_pools() -> None:
+    """Background pool pre-creation for the busiest/configured tenants."""
+    try:
+        ready = await tenant_manager.prewarm_pools()
+        if ready:
+            logger.info("Pre-created database pools for tenants %s", ready)
+    except Exception:
+        logger.exception("Pool pre-warming failed")
+
+
+async def _warm_up_model(app: FastAPI) -> None:
+    """Background model warm-up; failures are reported by /ready."""
+    try:
+        await inference.warm_up()
+    except Exception as exc:
+        logger.exception("Model warm-up failed")
+        app.state.warmup_error = str(exc)
 
 
 @asynccontextmanager
@@ -20,8 +53,18 @@ async def lifespan(app: FastAPI):
     """Application lifespan handler - initialize and cleanup resources."""
     # Startup: Initialize database connections
     await tenant_manager.initialize()
+    app.state.pool_prewarm_task = None
+    if settings.DB_POOL_PREWARM_TENANTS or settings.DB_POOL_PREWARM_TOP > 0:
+        app.state.pool_prewarm_task = asyncio.create_task(_prewarm_pools())
+    # Warm the model in the background so /health answers immediately while
+    # /ready keeps the load balancer away until the first inference is done
+    app.state.warmup_error = None
+    app.state.warmup_task = None
+    if settings.WARMUP_ON_STARTUP:
+        app.state.warmup_task = asyncio.create_task(_warm_up_model(app))
     yield
-    # Shutdown: Close all connections
+    # Shutdown: Stop inference workers and close all connections
+    inference.shutdown()
     await tenant_manager.close()
 
 
@@ -32,7 +75,95 @@ app = FastAPI(
     lifespan=lifespan,
 )
 
-# Allow all origins (CORS)
+
+@app.exception_handler(PoolBudgetExhausted)
+async def pool_budget_exhausted(request: Request, exc: PoolBudgetExhausted):
+    """Shed load when no tenant database pool fits the connection budget."""
+    logger.warning("Tenant pool not created: %s", exc)
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Database connection budget exhausted, retry later"},
+    )
+
+
+@app.middleware("http")
+async def limit_request_size(request: Request, call_next):
+    """Reject oversized bodies from Content-Length before multipart parsing."""
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > settings.MAX_REQUEST_BYTES:
+        return JSONResponse(
+            status_code=413,
+            content={"detail": f"Request too large; maximum is {settings.MAX_REQUEST_BYTES} bytes"},
+        )
+    return await call_next(request)
+
+
+def _route_labels(request: Request):
+    """(route template, tenant_id path parameter) of a request, for metrics."""
+    for route in request.app.router.routes:
+        match, child = route.matches(request.scope)
+        if match == Match.FULL:
+            return getattr(route, "path", ""), child.get("path_params", {}).get("tenant_id")
+    return "unmatched", None
+
+
+@app.middleware("http")
+async def instrument_request(request: Request, call_next):
+    """
+    Label the request for per-stage metrics, time it end to end, add the
+    Server-Timing header and, when selected, profile it.
+    """
+    if not (settings.METRICS_ENABLED or settings.SERVER_TIMING_ENABLED or settings.PROFILING_ENABLED):
+        return await call_next(request)
+    endpoint, tenant_id = _route_labels(request)
+    labels = metrics.start_request(endpoint)
+    if tenant_id is not None:
+        metrics.set_tenant(tenant_id)
+    capture = profiling.profiler.begin() if profiling.should_profile(request.headers) else None
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.observe_request(elapsed)
+        if capture is not None:
+            profiling.profiler.end(capture)
+    if capture is not None:
+        try:
+            name = await asyncio.to_thread(profiling.save, capture, endpoint, labels.tenant, elapsed)
+        except OSError:
+            logger.exception("Could not save request profile")
+            name = None
+        if name:
+            response.headers["X-Profile"] = name
+    if settings.SERVER_TIMING_ENABLED:
+        response.headers["Server-Timing"] = metrics.server_timing(labels, elapsed)
+    return response
+
+
+metrics.gauge(
+    "face_inference_queue_depth",
+    "Images waiting for an inference worker.",
+    lambda: inference.scheduler.queue_depth,
+)
+metrics.gauge(
+    "face_tenant_pools",
+    "Open tenant database pools.",
+    lambda: tenant_manager.get_l1_stats()["pools"]["pools"],
+)
+metrics.gauge(
+    "face_tenant_pool_connections",
+    "Open tenant database connections.",
+    lambda: tenant_manager.get_l1_stats()["pools"]["connections"],
+)
+metrics.gauge(
+    "face_tenant_pool_connections_in_use",
+    "Tenant database connections currently checked out.",
+    lambda: tenant_manager.get_l1_stats()["pools"]["in_use"],
+)
+
+
+# Allow all origins (CORS); added last so it also wraps the 413 responses above
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -48,26 +179,42 @@ app.add_middleware(
 # =========================================
 
 @app.post("/encode")
-async def encode(file: UploadFile = File(...)):
+async def encode(file: UploadFile = File(...), det_size: Optional[int] = Form(None)):
     """Encode a face image to a 512-dimensional vector."""
-    encoding = await recognition.encode_image(file)
-    return {"encoding": encoding}
+    encoding, bbox = await recognition.encode_image_with_box(file, det_size)
+    return {"encoding": encoding, "det_size": bbox.get("det_size")}
 
 
 @app.post("/compare")
 async def compare(
     file: UploadFile = File(...),
     payload: FaceCompareRequest = Depends(FaceCompareRequest.as_form),
+    det_size: Optional[int] = Form(None),
 ):
     """Compare a face against a provided encoding."""
-    return await recognition.compare_face(file, payload.encoding, payload.threshold)
+    return await recognition.compare_face(file, payload.encoding, payload.threshold, det_size)
+
+
+@app.post("/compare-embedding")
+async def compare_embedding(
+    request: Request,
+    threshold: float = Query(recognition.DEFAULT_THRESHOLD),
+):
+    """
+    Compare two precomputed embeddings (no image, no model).
+    
+    - JSON body: {"embedding_a": base64, "embedding_b": base64, "threshold": 0.35}
+    - or application/octet-stream body: both vectors back to back
+      (512 little-endian float32 or float16 each), threshold as query parameter
+    """
+    payload = await EmbeddingCompareRequest.from_request(request, threshold)
+    return recognition.compare_embeddings(payload.embedding_a, payload.embedding_b, payload.threshold)
 
 
 @app.post("/detect")
-async def detect(file: UploadFile = File(...)):
+async def detect(file: UploadFile = File(...), det_size: Optional[int] = Form(None)):
     """Detect faces in an image and return bounding boxes."""
-    faces = await recognition.detect_faces(file)
-    return {"faces": faces}
+    return await recognition.detect_faces(file, det_size)
 
 
 # =========================================
@@ -80,6 +227,7 @@ async def enroll(
     user_id: int = Form(...),
     name: str = Form(...),
     file: UploadFile = File(...),
+    det_size: Optional[int] = Form(None),
 ):
     """
     Enroll a new face for a user in a tenant database.
@@ -88,8 +236,9 @@ async def enroll(
     - **user_id**: User ID in tenant database (references user_{tenant_id}.id)
     - **name**: Label/name for this enrollment
     - **file**: Image file containing the face
+    - **det_size**: Optional detector input size (multiple of 32, e.g. 320 or 640)
     """
-    return await enrollment.enroll_face(tenant_id, user_id, name, file)
+    return await enrollment.enroll_face(tenant_id, user_id, name, file, det_size)
 
 
 @app.post("/identify")
@@ -97,6 +246,8 @@ async def identify(
     tenant_id: int = Form(...),
     file: UploadFile = File(...),
     threshold: float = Form(recognition.DEFAULT_THRESHOLD),
+    top_k: int = Form(1),
+    det_size: Optional[int] = Form(None),
 ):
     """
     Identify a face against all enrollments in a tenant database.
@@ -104,8 +255,52 @@ async def identify(
     - **tenant_id**: Tenant identifier
     - **file**: Image file containing the face to identify
     - **threshold**: Maximum distance threshold for a match (default: 0.6)
+    - **top_k**: Number of ranked candidates within threshold to return (default: 1)
+    - **det_size**: Optional detector input size (multiple of 32, e.g. 320 or 640)
+    """
+    return await enrollment.identify_face(tenant_id, file, threshold, top_k, det_size)
+
+
+@app.post("/identify-embedding")
+async def identify_embedding(
+    request: Request,
+    tenant_id: Optional[int] = Query(None),
+    threshold: float = Query(recognition.DEFAULT_THRESHOLD),
+    top_k: int = Query(1),
+):
+    """
+    Identify a precomputed embedding against a tenant's enrollments.
+    
+    Skips image decoding and the model; only the gallery search runs.
+    
+    - JSON body: {"tenant_id": 1, "embedding": base64, "threshold": 0.35, "top_k": 1}
+    - or application/octet-stream body: 512 little-endian float32 (or float16)
+      values, with tenant_id/threshold/top_k as query parameters
     """
-    return await enrollment.identify_face(tenant_id, file, threshold)
+    payload = await EmbeddingIdentifyRequest.from_request(request, tenant_id, threshold, top_k)
+    return await enrollment.identify_embedding(
+        payload.tenant_id, payload.embedding, payload.threshold, payload.top_k
+    )
+
+
+@app.post("/identify/batch")
+async def identify_batch(
+    tenant_id: int = Form(...),
+    files: List[UploadFile] = File(...),
+    threshold: float = Form(recognition.DEFAULT_THRESHOLD),
+    det_size: Optional[int] = Form(None),
+):
+    """
+    Identify many faces (e.g. consecutive gate frames) in one request.
+    
+    - **tenant_id**: Tenant identifier
+    - **files**: Image files, each containing a face to identify
+    - **threshold**: Maximum distance threshold for a match (default: 0.35)
+    - **det_size**: Optional detector input size (multiple of 32, e.g. 320 or 640)
+    
+    Results are returned per image in the order the files were sent.
+    """
+    return await enrollment.identify_faces_batch(tenant_id, files, threshold, det_size)
 
 
 @app.post("/verify")
@@ -114,6 +309,7 @@ async def verify(
     user_id: int = Form(...),
     file: UploadFile = File(...),
     threshold: float = Form(recognition.DEFAULT_THRESHOLD),
+    det_size: Optional[int] = Form(None),
 ):
     """
     Verify a face against a specific user's enrollment (for attendance).
@@ -128,8 +324,9 @@ async def verify(
     - **user_id**: User ID to verify against
     - **file**: Image file containing the face
     - **threshold**: Maximum distance threshold (default: 0.35)
+    - **det_size**: Optional detector input size (multiple of 32, e.g. 320 or 640)
     """
-    return await enrollment.verify_user(tenant_id, user_id, file, threshold)
+    return await enrollment.verify_user(tenant_id, user_id, file, threshold, det_size=det_size)
 
 
 @app.get("/enrollments/{tenant_id}")
@@ -209,6 +406,51 @@ async def cache_status(tenant_id: int):
     return await tenant_manager.get_cache_status(tenant_id)
 
 
+@app.get("/cache/stats")
+async def cache_stats():
+    """
+    Hit/miss/eviction counters of the in-process (L1) caches.
+    """
+    return tenant_manager.get_l1_stats()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """
+    Prometheus metrics: per-stage latency histograms and pool/queue gauges.
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+def _require_profiling_access(request: Request) -> None:
+    """Profiles are only served while profiling is on, and always need the secret."""
+    if not settings.PROFILING_ENABLED:
+        raise HTTPException(status_code=404, detail="Profiling is disabled")
+    if not settings.PROFILING_SECRET:
+        raise HTTPException(status_code=403, detail="Set PROFILING_SECRET to download profiles")
+    if not profiling.authorized(request.headers):
+        raise HTTPException(status_code=403, detail="Missing or invalid X-Debug-Profile header")
+
+
+@app.get("/admin/profiles", dependencies=[Depends(_require_profiling_access)])
+async def list_profiles():
+    """
+    Saved request profiles (collapsed-stack files), newest first.
+    """
+    return {"profiles": await asyncio.to_thread(profiling.list_profiles)}
+
+
+@app.get("/admin/profiles/{name}", dependencies=[Depends(_require_profiling_access)])
+async def get_profile(name: str):
+    """
+    Download one profile; feed it to flamegraph.pl or speedscope.
+    """
+    path = profiling.profile_path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"Profile {name} not found")
+    return FileResponse(path, media_type="text/plain", filename=name)
+
+
 # =========================================
 # Health Check
 # =========================================
@@ -217,3 +459,19 @@ async def cache_status(tenant_id: int):
 async def health():
     """Health check endpoint."""
     return {"status": "ok", "version": "2.0.0"}
+
+
+@app.get("/ready")
+async def ready():
+    """
+    Readiness check for load balancers.
+    
+    Returns 503 until the model has been loaded and warmed up. With
+    WARMUP_ON_STARTUP disabled the model loads lazily and this is always ready.
+    """
+    if inference.is_ready() or not settings.WARMUP_ON_STARTUP:
+        return {"status": "ready", "version": "2.0.0"}
+    error = getattr(app.state, "warmup_error", None)
+    if error:
+        return JSONResponse(status_code=503, content={"status": "warmup_failed", "detail": error})
+    return JSONResponse(status_code=503, content={"status": "warming_up"})
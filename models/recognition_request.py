@@ -1,7 +1,10 @@
+import base64
+import binascii
 import json
+from typing import Optional
 
-from fastapi import Form, HTTPException
-from pydantic import BaseModel, conlist
+from fastapi import Form, HTTPException, Request
+from pydantic import BaseModel, ValidationError, conlist, field_validator
 
 
 class FaceCompareRequest(BaseModel):
@@ -23,3 +26,88 @@ class FaceCompareRequest(BaseModel):
             raise HTTPException(status_code=400, detail="encoding must be a JSON array")
 
         return cls(encoding=parsed, threshold=threshold)
+
+
+def _b64(value):
+    """Decode base64 text from JSON bodies; raw bytes pass through."""
+    if isinstance(value, str):
+        try:
+            return base64.b64decode(value, validate=True)
+        except (binascii.Error, ValueError) as exc:
+            raise ValueError("must be base64 encoded") from exc
+    return value
+
+
+def _is_octet_stream(request: Request) -> bool:
+    return request.headers.get("content-type", "").split(";")[0].strip() == "application/octet-stream"
+
+
+def _validate(cls, data):
+    try:
+        return cls.model_validate(data)
+    except ValidationError as exc:
+        raise HTTPException(status_code=422, detail=json.loads(exc.json())) from exc
+
+
+async def _json_body(request: Request) -> dict:
+    try:
+        body = await request.json()
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail="Body must be JSON or application/octet-stream") from exc
+    if not isinstance(body, dict):
+        raise HTTPException(status_code=400, detail="JSON body must be an object")
+    return body
+
+
+class EmbeddingIdentifyRequest(BaseModel):
+    """Identify a precomputed embedding (512 little-endian float32 or float16)."""
+    tenant_id: int
+    embedding: bytes
+    threshold: float = 0.35
+    top_k: int = 1
+
+    _decode_embedding = field_validator("embedding", mode="before")(_b64)
+
+    @classmethod
+    async def from_request(
+        cls,
+        request: Request,
+        tenant_id: Optional[int] = None,
+        threshold: float = 0.35,
+        top_k: int = 1,
+    ) -> "EmbeddingIdentifyRequest":
+        """
+        JSON body {"tenant_id", "embedding": base64, "threshold", "top_k"}, or
+        a raw application/octet-stream body with the other fields as query
+        parameters.
+        """
+        if _is_octet_stream(request):
+            if tenant_id is None:
+                raise HTTPException(status_code=400, detail="tenant_id query parameter is required")
+            data = {"tenant_id": tenant_id, "embedding": await request.body(), "threshold": threshold, "top_k": top_k}
+            return _validate(cls, data)
+        return _validate(cls, await _json_body(request))
+
+
+class EmbeddingCompareRequest(BaseModel):
+    """Compare two precomputed embeddings."""
+    embedding_a: bytes
+    embedding_b: bytes
+    threshold: float = 0.35
+
+    _decode_embeddings = field_validator("embedding_a", "embedding_b", mode="before")(_b64)
+
+    @classmethod
+    async def from_request(cls, request: Request, threshold: float = 0.35) -> "EmbeddingCompareRequest":
+        """
+        JSON body {"embedding_a", "embedding_b" (base64), "threshold"}, or a
+        raw application/octet-stream body holding both vectors back to back
+        (same dtype) with threshold as a query parameter.
+        """
+        if _is_octet_stream(request):
+            body = await request.body()
+            half = len(body) // 2
+            if len(body) % 2:
+                raise HTTPException(status_code=400, detail="Body must hold two embeddings of equal size")
+            return _validate(cls, {"embedding_a": body[:half], "embedding_b": body[half:], "threshold": threshold})
+        return _validate(cls, await _json_body(request))
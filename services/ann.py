@@ -0,0 +1,238 @@
+"""
+Approximate nearest-neighbour (IVF) index for large tenant galleries.
+
+An inverted-file index partitions the gallery with spherical k-means. A query
+only scores the rows in the nprobe lists whose centroids are closest to the
+probe, so search cost grows with N * nprobe / nlist instead of N.
+
+The index stores row numbers of a GalleryIndex and is kept in sync with it
+through add/remove hooks; the embeddings themselves stay in the gallery
+matrix. Centroids and per-enrollment list assignments are persisted to local
+disk so a restart (or a gallery rebuild) does not retrain.
+"""
+
+import math
+import os
+import time
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+
+def auto_nlist(size: int) -> int:
+    """Default number of inverted lists for a gallery of the given size."""
+    return max(8, int(math.sqrt(size)))
+
+
+def train_centroids(
+    matrix: np.ndarray,
+    nlist: int,
+    iterations: int = 8,
+    max_samples: int = 32768,
+    seed: int = 0,
+) -> np.ndarray:
+    """
+    Spherical k-means over (a sample of) L2-normalized embeddings.
+
+    Returns an (nlist x dim) float32 matrix of unit-length centroids.
+    """
+    rng = np.random.default_rng(seed)
+    n = matrix.shape[0]
+    nlist = min(nlist, n)
+    sample = matrix[rng.choice(n, size=min(n, max_samples), replace=False)] if n > max_samples else matrix
+    sample = np.ascontiguousarray(sample, dtype=np.float32)
+    centroids = sample[rng.choice(sample.shape[0], size=nlist, replace=False)].copy()
+
+    for _ in range(iterations):
+        assign = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, sample)
+        counts = np.bincount(assign, minlength=nlist)
+        empty = counts == 0
+        if empty.any():
+            # Re-seed empty lists with random samples
+            sums[empty] = sample[rng.choice(sample.shape[0], size=int(empty.sum()), replace=False)]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        centroids = sums / np.maximum(norms, 1e-12)
+
+    return centroids.astype(np.float32)
+
+
+class _RowList:
+    """Growable int array holding the gallery rows of one inverted list."""
+
+    __slots__ = ("rows", "size")
+
+    def __init__(self):
+        self.rows = np.empty(16, dtype=np.int64)
+        self.size = 0
+
+    def append(self, row: int) -> int:
+        if self.size == self.rows.shape[0]:
+            rows = np.empty(self.rows.shape[0] * 2, dtype=np.int64)
+            rows[: self.size] = self.rows[: self.size]
+            self.rows = rows
+        self.rows[self.size] = row
+        self.size += 1
+        return self.size - 1
+
+    def view(self) -> np.ndarray:
+        return self.rows[: self.size]
+
+
+class IVFIndex:
+    """
+    Inverted-file index over the rows of a GalleryIndex.
+
+    assign[row] is the list a gallery row belongs to and pos[row] its slot
+    within that list, so rows can be added, removed and moved (the gallery
+    swap-removes) in O(1).
+    """
+
+    def __init__(self, centroids: np.ndarray, nprobe: int, trained_size: int):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.nlist = self.centroids.shape[0]
+        self.nprobe = max(1, min(nprobe, self.nlist))
+        self.trained_size = trained_size
+        self.trained_at = time.time()
+        self._lists = [_RowList() for _ in range(self.nlist)]
+        self._assign = np.empty(0, dtype=np.int64)
+        self._pos = np.empty(0, dtype=np.int64)
+        self._size = 0
+        # Enrollment id -> list, remembered across gallery rebuilds
+        self._known_ids = np.empty(0, dtype=np.int64)
+        self._known_lists = np.empty(0, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _reserve(self, size: int) -> None:
+        if size <= self._assign.shape[0]:
+            return
+        capacity = max(size, self._assign.shape[0] * 2, 64)
+        assign = np.empty(capacity, dtype=np.int64)
+        assign[: self._size] = self._assign[: self._size]
+        pos = np.empty(capacity, dtype=np.int64)
+        pos[: self._size] = self._pos[: self._size]
+        self._assign, self._pos = assign, pos
+
+    def _place(self, row: int, list_no: int) -> None:
+        self._assign[row] = list_no
+        self._pos[row] = self._lists[list_no].append(row)
+
+    def nearest_lists(self, vectors: np.ndarray) -> np.ndarray:
+        """Closest centroid for each row of vectors."""
+        return np.argmax(np.asarray(vectors, dtype=np.float32) @ self.centroids.T, axis=1)
+
+    def attach(self, matrix: np.ndarray, ids: np.ndarray) -> None:
+        """
+        (Re)build the lists for a gallery's current rows.
+
+        Rows whose enrollment id was seen before keep their list; only new
+        rows are assigned against the centroids.
+        """
+        n = matrix.shape[0]
+        self._lists = [_RowList() for _ in range(self.nlist)]
+        self._size = 0
+        self._reserve(n)
+
+        lists = np.full(n, -1, dtype=np.int64)
+        if self._known_ids.shape[0]:
+            order = np.argsort(self._known_ids)
+            sorted_ids = self._known_ids[order]
+            idx = np.clip(np.searchsorted(sorted_ids, ids), 0, sorted_ids.shape[0] - 1)
+            hit = sorted_ids[idx] == ids
+            lists[hit] = self._known_lists[order][idx[hit]]
+        missing = np.flatnonzero(lists < 0)
+        if missing.shape[0]:
+            lists[missing] = self.nearest_lists(matrix[missing])
+
+        for row in range(n):
+            self._place(row, int(lists[row]))
+        self._size = n
+        self._known_ids = np.array(ids, dtype=np.int64)
+        self._known_lists = lists
+
+    def add(self, row: int, vector: np.ndarray) -> None:
+        """Hook: the gallery appended a row."""
+        self._reserve(row + 1)
+        self._place(row, int(self.nearest_lists(vector.reshape(1, -1))[0]))
+        self._size = row + 1
+
+    def remove(self, row: int, last: int) -> None:
+        """Hook: the gallery removes row and moves its last row into it."""
+        # Drop row from its list (swap with that list's last element)
+        rows = self._lists[self._assign[row]]
+        slot = self._pos[row]
+        moved = rows.rows[rows.size - 1]
+        rows.rows[slot] = moved
+        self._pos[moved] = slot
+        rows.size -= 1
+
+        if row != last:
+            # Gallery row `last` now lives at `row`
+            list_no = self._assign[last]
+            slot = self._pos[last]
+            self._lists[list_no].rows[slot] = row
+            self._assign[row] = list_no
+            self._pos[row] = slot
+        self._size = last
+
+    def candidates(self, probe: np.ndarray, nprobe: Optional[int] = None) -> np.ndarray:
+        """Gallery rows in the nprobe lists closest to the probe."""
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        scores = self.centroids @ probe
+        if nprobe < self.nlist:
+            chosen = np.argpartition(-scores, nprobe - 1)[:nprobe]
+        else:
+            chosen = np.arange(self.nlist)
+        parts = [self._lists[c].view() for c in chosen if self._lists[c].size]
+        if not parts:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(parts)
+
+    def fork(self, ids: Optional[np.ndarray] = None) -> "IVFIndex":
+        """
+        New unattached index sharing the trained centroids.
+
+        Pass the attached gallery's ids to carry the current row assignments
+        over; the fork can then be attached to a rebuilt gallery (or saved)
+        without touching the gallery this index serves.
+        """
+        index = IVFIndex(self.centroids, self.nprobe, self.trained_size)
+        index.trained_at = self.trained_at
+        if ids is not None:
+            index._known_ids = np.array(ids, dtype=np.int64)
+            index._known_lists = self._assign[: self._size].copy()
+        else:
+            index._known_ids = self._known_ids
+            index._known_lists = self._known_lists
+        return index
+
+    def save(self, path: Path) -> None:
+        """Persist centroids and id -> list assignments atomically."""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp.npz")
+        np.savez(
+            tmp,
+            centroids=self.centroids,
+            ids=self._known_ids,
+            lists=self._known_lists,
+            meta=np.array([self.nprobe, self.trained_size, self.trained_at], dtype=np.float64),
+        )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: Path) -> Optional["IVFIndex"]:
+        """Load a persisted index, or None if missing/unreadable."""
+        try:
+            with np.load(path) as data:
+                nprobe, trained_size, trained_at = data["meta"]
+                index = cls(data["centroids"], int(nprobe), int(trained_size))
+                index.trained_at = float(trained_at)
+                index._known_ids = data["ids"].astype(np.int64)
+                index._known_lists = data["lists"].astype(np.int64)
+        except (OSError, KeyError, ValueError):
+            return None
+        return index
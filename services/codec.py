@@ -0,0 +1,161 @@
+"""
+Binary codec for face embeddings.
+
+Embeddings are stored as raw little-endian float32 (2 KB per 512-d face) or
+float16 (1 KB) instead of JSON arrays (~10 KB of text). The dtype is implied
+by the blob length, so blobs carry no header and decode zero-copy with
+np.frombuffer. Legacy JSON arrays are still accepted on read.
+"""
+
+import json
+import struct
+from typing import Any, Dict, List, Union
+
+import numpy as np
+
+from services.similarity import EMBEDDING_DIM
+
+EMBEDDING_DTYPES = {
+    "float32": np.dtype("<f4"),
+    "float16": np.dtype("<f2"),
+}
+
+# Header for packed enrollment lists cached in Redis
+PACK_MAGIC = b"FEP1"
+_PACK_HEADER = struct.Struct("<4sI")
+
+
+def _dtype(fmt: str) -> np.dtype:
+    try:
+        return EMBEDDING_DTYPES[fmt]
+    except KeyError:
+        raise ValueError(f"Unknown embedding format {fmt!r}; expected one of {list(EMBEDDING_DTYPES)}")
+
+
+def is_legacy_json(value: Union[bytes, bytearray, memoryview, str]) -> bool:
+    """True if a stored value is a legacy JSON document rather than binary."""
+    if isinstance(value, str):
+        return True
+    head = bytes(value[:1])
+    return head in (b"[", b"{")
+
+
+def encode_embedding(encoding, fmt: str = "float32") -> bytes:
+    """Serialize an embedding to a little-endian float32/float16 blob."""
+    vector = np.asarray(encoding, dtype=np.float32).reshape(-1)
+    return vector.astype(_dtype(fmt), copy=False).tobytes()
+
+
+def decode_embedding(value: Union[bytes, bytearray, memoryview, str, list], dim: int = EMBEDDING_DIM) -> np.ndarray:
+    """
+    Deserialize an embedding to a float32 vector.
+
+    Accepts binary blobs (float32 or float16, inferred from length), legacy
+    JSON array strings and already-parsed lists. float32 blobs are returned
+    as a read-only view over the input buffer.
+    
+    Binary blobs are recognised by length before any JSON sniffing: a raw
+    float32 vector may well start with the byte "[" or "{".
+    """
+    if isinstance(value, list):
+        return np.asarray(value, dtype=np.float32)
+    if isinstance(value, str):
+        return np.asarray(json.loads(value), dtype=np.float32)
+
+    nbytes = len(value)
+    if nbytes == dim * 4:
+        return np.frombuffer(value, dtype=EMBEDDING_DTYPES["float32"])
+    if nbytes == dim * 2:
+        return np.frombuffer(value, dtype=EMBEDDING_DTYPES["float16"]).astype(np.float32)
+    if is_legacy_json(value):
+        return np.asarray(json.loads(value), dtype=np.float32)
+    raise ValueError(f"Embedding blob has {nbytes} bytes; expected {dim * 4} (float32) or {dim * 2} (float16)")
+
+
+def pack_enrollments(records: List[Dict[str, Any]], fmt: str = "float32", dim: int = EMBEDDING_DIM) -> bytes:
+    """
+    Pack enrollment records into a single binary blob for Redis.
+
+    Layout: magic, header length, JSON header with record metadata, then one
+    contiguous (N x dim) embedding matrix in the chosen format.
+    """
+    dtype = _dtype(fmt)
+    matrix = np.empty((len(records), dim), dtype=dtype)
+    meta = []
+    for i, rec in enumerate(records):
+        matrix[i] = np.asarray(rec["encoding"], dtype=np.float32).reshape(-1)
+        meta.append({key: value for key, value in rec.items() if key != "encoding"})
+    header = json.dumps({"format": fmt, "dim": dim, "records": meta}).encode()
+    return _PACK_HEADER.pack(PACK_MAGIC, len(header)) + header + matrix.tobytes()
+
+
+def unpack_enrollments(value: Union[bytes, str]) -> List[Dict[str, Any]]:
+    """
+    Unpack a blob produced by pack_enrollments().
+
+    Legacy JSON lists/objects (cached before the binary format) are also
+    accepted. Each record's "encoding" is a float32 row view of one shared
+    matrix.
+    """
+    if isinstance(value, str) or is_legacy_json(value):
+        records = json.loads(value)
+        if isinstance(records, dict):
+            records = [records]
+        for rec in records:
+            rec["encoding"] = decode_embedding(rec["encoding"])
+        return records
+
+    magic, header_len = _PACK_HEADER.unpack_from(value)
+    if magic != PACK_MAGIC:
+        raise ValueError("Unrecognized packed enrollment blob")
+    offset = _PACK_HEADER.size
+    header = json.loads(value[offset:offset + header_len])
+    offset += header_len
+
+    records = header["records"]
+    matrix = np.frombuffer(
+        value,
+        dtype=_dtype(header["format"]),
+        count=len(records) * header["dim"],
+        offset=offset,
+    ).reshape(len(records), header["dim"])
+    if matrix.dtype != np.float32:
+        matrix = matrix.astype(np.float32)
+    for i, rec in enumerate(records):
+        rec["encoding"] = matrix[i]
+    return records
+
+
+# Per-enrollment hash value: user_id, label length, created_at length, then
+# the label and created_at (UTF-8) followed by the embedding blob
+_RECORD_HEADER = struct.Struct("<qHH")
+
+
+def pack_enrollment(record: Dict[str, Any], fmt: str = "float32") -> bytes:
+    """Pack one enrollment record (without its id) for a Redis hash field."""
+    label = record["label"].encode()
+    created_at = (record.get("created_at") or "").encode()
+    return (
+        _RECORD_HEADER.pack(record["user_id"], len(label), len(created_at))
+        + label
+        + created_at
+        + encode_embedding(record["encoding"], fmt)
+    )
+
+
+def unpack_enrollment(enrollment_id: int, value: bytes) -> Dict[str, Any]:
+    """Inverse of pack_enrollment(); the encoding is a float32 vector."""
+    user_id, label_len, created_len = _RECORD_HEADER.unpack_from(value)
+    offset = _RECORD_HEADER.size
+    label = value[offset:offset + label_len].decode()
+    offset += label_len
+    created_at = value[offset:offset + created_len].decode() or None
+    offset += created_len
+    return {
+        "id": enrollment_id,
+        "user_id": user_id,
+        "label": label,
+        "encoding": decode_embedding(memoryview(value)[offset:]),
+        "status": "active",
+        "created_at": created_at,
+    }
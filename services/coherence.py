@@ -0,0 +1,160 @@
+"""
+Cross-replica cache coherence over Redis pub/sub.
+
+Every mutation bumps a per-tenant, per-scope version counter in Redis
+(INCR tenant:{id}:version:{scope}) and publishes the new version on a
+shared channel. Each replica remembers the highest version it has seen for
+every tenant/scope and the version its in-memory state (gallery index,
+tenant config) was built from; state older than the latest version is
+rebuilt on next use, so replicas can keep hot state in memory and only the
+changed tenant is refreshed.
+
+Pub/sub is fire-and-forget, so after every (re)subscribe and every
+COHERENCE_RECONCILE_INTERVAL seconds the versions of resident tenants are
+re-read with MGET; a missed message therefore delays a refresh instead of
+leaving a replica stale forever.
+"""
+
+import asyncio
+import json
+import logging
+import uuid
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+import redis.asyncio as redis
+
+logger = logging.getLogger(__name__)
+
+SCOPE_ENROLLMENTS = "enrollments"
+SCOPE_CONFIG = "config"
+SCOPES = (SCOPE_ENROLLMENTS, SCOPE_CONFIG)
+
+# Called with (tenant_id, scope) when another replica changed that state
+InvalidateHandler = Callable[[int, str], Awaitable[None]]
+
+
+class InvalidationBus:
+    """Per-tenant version counters plus a pub/sub channel announcing bumps."""
+
+    def __init__(self, channel: str, reconcile_interval: float):
+        self.channel = channel
+        self.reconcile_interval = reconcile_interval
+        self.replica_id = uuid.uuid4().hex
+        self._latest: Dict[Tuple[int, str], int] = {}
+        self._redis: Optional[redis.Redis] = None
+        self._handler: Optional[InvalidateHandler] = None
+        self._resident: Optional[Callable[[], Iterable[int]]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def version_key(tenant_id: int, scope: str) -> str:
+        return f"tenant:{tenant_id}:version:{scope}"
+
+    def latest(self, tenant_id: int, scope: str) -> int:
+        """Highest version seen for a tenant's scope (0 if never changed)."""
+        return self._latest.get((tenant_id, scope), 0)
+
+    def _observe(self, tenant_id: int, scope: str, version: int) -> bool:
+        """Record a version; True if it is newer than what was known."""
+        key = (tenant_id, scope)
+        if version > self._latest.get(key, 0):
+            self._latest[key] = version
+            return True
+        return False
+
+    async def current(self, tenant_id: int, scope: str) -> int:
+        """Read a tenant's version from Redis (call before loading state)."""
+        value = await self._redis.get(self.version_key(tenant_id, scope))
+        version = int(value) if value else 0
+        self._observe(tenant_id, scope, version)
+        return version
+
+    async def publish(self, tenant_id: int, scopes: Iterable[str]) -> Dict[str, int]:
+        """Bump versions for a local mutation and announce them; returns the new versions."""
+        versions: Dict[str, int] = {}
+        for scope in scopes:
+            version = await self._redis.incr(self.version_key(tenant_id, scope))
+            self._observe(tenant_id, scope, version)
+            versions[scope] = version
+        message = {"tenant_id": tenant_id, "versions": versions, "origin": self.replica_id}
+        await self._redis.publish(self.channel, json.dumps(message))
+        return versions
+
+    def start(
+        self,
+        client: redis.Redis,
+        handler: InvalidateHandler,
+        resident: Callable[[], Iterable[int]],
+    ) -> None:
+        """Start the subscriber task (idempotent)."""
+        self._redis = client
+        self._handler = handler
+        self._resident = resident
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="invalidation-bus")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _apply(self, tenant_id: int, versions: Dict[str, int]) -> None:
+        for scope, version in versions.items():
+            if scope in SCOPES and self._observe(tenant_id, scope, int(version)):
+                await self._handler(tenant_id, scope)
+
+    async def reconcile(self) -> None:
+        """Re-read versions of resident tenants; catches up on missed messages."""
+        tenants: List[int] = sorted(set(self._resident()))
+        if not tenants:
+            return
+        keys = [(tenant_id, scope) for tenant_id in tenants for scope in SCOPES]
+        values = await self._redis.mget([self.version_key(t, s) for t, s in keys])
+        for (tenant_id, scope), value in zip(keys, values):
+            await self._apply(tenant_id, {scope: int(value) if value else 0})
+
+    async def _on_message(self, data: bytes) -> None:
+        try:
+            message = json.loads(data)
+            tenant_id = int(message["tenant_id"])
+            versions = dict(message["versions"])
+        except (ValueError, KeyError, TypeError):
+            logger.warning("Ignoring malformed invalidation message: %r", data)
+            return
+        if message.get("origin") == self.replica_id:
+            return
+        await self._apply(tenant_id, versions)
+
+    async def _run(self) -> None:
+        backoff = 1.0
+        while True:
+            pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(self.channel)
+                await self.reconcile()
+                backoff = 1.0
+                loop = asyncio.get_running_loop()
+                next_reconcile = loop.time() + self.reconcile_interval
+                while True:
+                    timeout = max(0.0, next_reconcile - loop.time())
+                    message = await pubsub.get_message(timeout=timeout)
+                    if message is not None and message.get("type") == "message":
+                        await self._on_message(message["data"])
+                    if loop.time() >= next_reconcile:
+                        await self.reconcile()
+                        next_reconcile = loop.time() + self.reconcile_interval
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Invalidation subscriber failed; reconnecting in %.0fs", backoff)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30.0)
+            finally:
+                try:
+                    await pubsub.reset()
+                except Exception:
+                    pass
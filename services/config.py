@@ -6,7 +6,7 @@ Loads environment variables from .env file.
 
 import os
 from pathlib import Path
-from typing import Optional
+from typing import List, Optional
 
 from dotenv import load_dotenv
 
@@ -44,9 +44,161 @@ class Settings:
     REDIS_DB: int = int(os.getenv("REDIS_DB", "0"))
     REDIS_PASSWORD: Optional[str] = os.getenv("REDIS_PASSWORD") or None
     
+    # Tenant DB pools: one pool of DB_SERVER_POOL_SIZE connections per server
+    # login (host, port, user), shared by the tenant databases on it; each
+    # tenant may hold at most DB_POOL_SIZE of them at once (the size of the
+    # former per-tenant pools). DB_POOL_MAX_CONNECTIONS caps the sum of
+    # server pool sizes; idle pools are closed after DB_POOL_IDLE_TIMEOUT
+    # seconds and every pool is pinged each DB_POOL_HEALTH_INTERVAL seconds.
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "5"))
+    DB_SERVER_POOL_SIZE: int = int(os.getenv("DB_SERVER_POOL_SIZE", "25"))
+    DB_POOL_MAX_CONNECTIONS: int = int(os.getenv("DB_POOL_MAX_CONNECTIONS", "100"))
+    DB_POOL_IDLE_TIMEOUT: float = float(os.getenv("DB_POOL_IDLE_TIMEOUT", "300"))
+    DB_POOL_HEALTH_INTERVAL: float = float(os.getenv("DB_POOL_HEALTH_INTERVAL", "60"))
+    DB_POOL_RECYCLE: int = int(os.getenv("DB_POOL_RECYCLE", "3600"))
+    # Pools created at startup: listed tenant ids plus the N tenants with the
+    # most connections today/yesterday (counts are flushed to Redis every
+    # DB_POOL_TRAFFIC_FLUSH_INTERVAL seconds)
+    DB_POOL_PREWARM_TENANTS: List[int] = [int(x) for x in os.getenv("DB_POOL_PREWARM_TENANTS", "").split(",") if x.strip()]
+    DB_POOL_PREWARM_TOP: int = int(os.getenv("DB_POOL_PREWARM_TOP", "0"))
+    DB_POOL_TRAFFIC_FLUSH_INTERVAL: float = float(os.getenv("DB_POOL_TRAFFIC_FLUSH_INTERVAL", "60"))
+    
     # Cache TTL (seconds)
     TENANT_CACHE_TTL: int = int(os.getenv("TENANT_CACHE_TTL", "300"))  # 5 minutes
     ENCODING_CACHE_TTL: int = int(os.getenv("ENCODING_CACHE_TTL", "60"))  # 1 minute
+    # Per-tenant enrollment hash; kept up to date field by field on enroll and
+    # delete, so the TTL only bounds staleness from edits made outside the API
+    ENROLLMENT_CACHE_TTL: int = int(os.getenv("ENROLLMENT_CACHE_TTL", "3600"))  # 1 hour
+    # In-process L1 caches in front of Redis, bounded by memory (bytes):
+    # tenant configs and per-user enrollments, and gallery indexes
+    L1_CACHE_BYTES: int = int(os.getenv("L1_CACHE_BYTES", str(64 * 1024 * 1024)))
+    GALLERY_CACHE_BYTES: int = int(os.getenv("GALLERY_CACHE_BYTES", str(4 * 1024 * 1024 * 1024)))
+    # Stale-while-revalidate: expired config/enrollment caches are still
+    # served for this many seconds while one background task reloads them
+    CACHE_STALE_TTL: int = int(os.getenv("CACHE_STALE_TTL", "60"))
+    # Take a Redis lock around cache fills so only one replica queries MySQL
+    # per miss; the others wait up to CACHE_LOAD_LOCK_TIMEOUT for the fill
+    CACHE_LOAD_LOCK: bool = os.getenv("CACHE_LOAD_LOCK", "false").lower() in ("1", "true", "yes")
+    CACHE_LOAD_LOCK_TIMEOUT: float = float(os.getenv("CACHE_LOAD_LOCK_TIMEOUT", "10"))
+    # Hashes with more fields than this are read with HSCAN in batches of
+    # this size instead of one HGETALL
+    ENROLLMENT_CACHE_SCAN_COUNT: int = int(os.getenv("ENROLLMENT_CACHE_SCAN_COUNT", "1000"))
+    
+    # Binary embedding storage format: "float32" (2 KB/face) or "float16" (1 KB/face)
+    EMBEDDING_FORMAT: str = os.getenv("EMBEDDING_FORMAT", "float32")
+    
+    # Upload limits: per image (checked before the bytes are buffered) and per
+    # request (Content-Length, checked before the multipart body is parsed)
+    MAX_UPLOAD_BYTES: int = int(os.getenv("MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+    MAX_REQUEST_BYTES: int = int(os.getenv("MAX_REQUEST_BYTES", str(64 * 1024 * 1024)))
+    # Idle upload buffers kept for reuse
+    UPLOAD_BUFFER_POOL_BYTES: int = int(os.getenv("UPLOAD_BUFFER_POOL_BYTES", str(64 * 1024 * 1024)))
+    
+    # Maximum number of images accepted by /identify/batch
+    IDENTIFY_BATCH_MAX_IMAGES: int = int(os.getenv("IDENTIFY_BATCH_MAX_IMAGES", "32"))
+    
+    # Upper bound for the top_k parameter of /identify
+    IDENTIFY_MAX_TOP_K: int = int(os.getenv("IDENTIFY_MAX_TOP_K", "50"))
+    
+    # Inference scheduler: fixed worker threads fed by a bounded queue; each
+    # worker batches requests arriving within the window (up to max batch)
+    INFERENCE_WORKERS: int = int(os.getenv("INFERENCE_WORKERS", "2"))
+    INFERENCE_QUEUE_SIZE: int = int(os.getenv("INFERENCE_QUEUE_SIZE", "64"))
+    INFERENCE_MAX_BATCH: int = int(os.getenv("INFERENCE_MAX_BATCH", "8"))
+    INFERENCE_BATCH_WINDOW_MS: float = float(os.getenv("INFERENCE_BATCH_WINDOW_MS", "5"))
+    # Load and warm the model at startup (/ready reports not-ready until done)
+    WARMUP_ON_STARTUP: bool = os.getenv("WARMUP_ON_STARTUP", "true").lower() in ("1", "true", "yes")
+    
+    # InsightFace modules to load from the buffalo_l pack (detection is required).
+    # /detect only runs detection; encode/identify/verify run detection + recognition.
+    INSIGHTFACE_MODULES: List[str] = [
+        m.strip()
+        for m in os.getenv("INSIGHTFACE_MODULES", "detection,recognition").split(",")
+        if m.strip()
+    ]
+    
+    # Detector input sizes (square). "adaptive" tries the smallest first and
+    # falls back to larger sizes when no face scores DET_ADAPTIVE_MIN_SCORE;
+    # "fixed" always uses the largest. Endpoints accept a det_size override.
+    DET_SIZES: List[int] = [int(x) for x in os.getenv("DET_SIZES", "320,640").split(",") if x.strip()]
+    DET_SIZE_STRATEGY: str = os.getenv("DET_SIZE_STRATEGY", "adaptive")
+    DET_ADAPTIVE_MIN_SCORE: float = float(os.getenv("DET_ADAPTIVE_MIN_SCORE", "0.6"))
+    DET_SIZE_MAX: int = int(os.getenv("DET_SIZE_MAX", "1280"))
+    
+    # Decode large JPEGs at 1/2, 1/4 or 1/8 scale (libjpeg DCT scaling) as
+    # long as the longer side stays >= max(DECODE_MIN_SIDE, detector size).
+    # 960 keeps a face at verify's 15% minimum ratio above the 112 px
+    # ArcFace crop.
+    DECODE_REDUCED: bool = os.getenv("DECODE_REDUCED", "true").lower() in ("1", "true", "yes")
+    DECODE_MIN_SIDE: int = int(os.getenv("DECODE_MIN_SIDE", "960"))
+    
+    # "thread": workers run the model in-process; "process": workers dispatch
+    # to INFERENCE_PROCESSES model processes (0 = one per CPU core)
+    INFERENCE_MODE: str = os.getenv("INFERENCE_MODE", "thread")
+    INFERENCE_PROCESSES: int = int(os.getenv("INFERENCE_PROCESSES", "0"))
+    # ONNX Runtime intra-op threads per session on CPU (0 = cores / workers)
+    ORT_INTRA_OP_THREADS: int = int(os.getenv("ORT_INTRA_OP_THREADS", "0"))
+    
+    # Cross-replica invalidation: mutations bump per-tenant versions in Redis
+    # and publish them on COHERENCE_CHANNEL; replicas refresh only the changed
+    # tenant. Versions of resident tenants are re-checked every
+    # COHERENCE_RECONCILE_INTERVAL seconds in case a message was missed.
+    COHERENCE_ENABLED: bool = os.getenv("COHERENCE_ENABLED", "true").lower() in ("1", "true", "yes")
+    COHERENCE_CHANNEL: str = os.getenv("COHERENCE_CHANNEL", "face:invalidate")
+    COHERENCE_RECONCILE_INTERVAL: float = float(os.getenv("COHERENCE_RECONCILE_INTERVAL", "30"))
+    
+    # In-process gallery index: rebuilt from Redis/MySQL after this many
+    # seconds (0 = never). Only a fallback for rows edited directly in the
+    # database, which publish nothing: with coherence, changes made through
+    # any replica already refresh it, so the default is an hour rather than
+    # the minute used without it.
+    GALLERY_INDEX_TTL: int = int(os.getenv("GALLERY_INDEX_TTL", "3600" if COHERENCE_ENABLED else "60"))
+    
+    # Prometheus metrics at GET /metrics; at most METRICS_MAX_TENANTS distinct
+    # tenant label values, further tenants are reported as "other"
+    METRICS_ENABLED: bool = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+    METRICS_MAX_TENANTS: int = int(os.getenv("METRICS_MAX_TENANTS", "100"))
+    
+    # Server-Timing response header with the per-stage durations of a request
+    SERVER_TIMING_ENABLED: bool = os.getenv("SERVER_TIMING_ENABLED", "true").lower() in ("1", "true", "yes")
+    
+    # Request profiling (off by default): a PROFILING_SAMPLE_RATE fraction of
+    # requests, and requests whose X-Debug-Profile header equals
+    # PROFILING_SECRET, are sampled every PROFILING_INTERVAL_MS and saved as
+    # collapsed-stack (flame graph) files; the newest PROFILING_MAX_FILES are kept.
+    # /admin/profiles requires the same header: without a secret it is closed
+    PROFILING_ENABLED: bool = os.getenv("PROFILING_ENABLED", "false").lower() in ("1", "true", "yes")
+    PROFILING_SAMPLE_RATE: float = float(os.getenv("PROFILING_SAMPLE_RATE", "0"))
+    PROFILING_SECRET: str = os.getenv("PROFILING_SECRET", "")
+    PROFILING_INTERVAL_MS: float = float(os.getenv("PROFILING_INTERVAL_MS", "5"))
+    PROFILING_MAX_FILES: int = int(os.getenv("PROFILING_MAX_FILES", "200"))
+    PROFILING_DIR: str = os.getenv(
+        "PROFILING_DIR", str(Path(__file__).resolve().parent.parent / "storage" / "profiles")
+    )
+    
+    # Compressed in-process galleries: "float16" (2x smaller), "int8" (4x)
+    # or "pq" (product quantization, 512 / GALLERY_PQ_SUBSPACES dims per
+    # byte); empty keeps plain float32. Searches scan the codes and re-score
+    # the GALLERY_RERANK best rows against the stored embeddings before any
+    # threshold decision: a resident float32 copy with GALLERY_KEEP_FLOAT32
+    # (less memory traffic, no memory saving), otherwise the Redis
+    # enrollment hash (HMGET, MySQL for expired fields). Re-scored distances
+    # have the EMBEDDING_FORMAT precision, the same as an uncompressed
+    # gallery's (with float16 storage, not float32-exact)
+    GALLERY_COMPRESSION: str = os.getenv("GALLERY_COMPRESSION", "").lower()
+    GALLERY_RERANK: int = int(os.getenv("GALLERY_RERANK", "64"))
+    GALLERY_KEEP_FLOAT32: bool = os.getenv("GALLERY_KEEP_FLOAT32", "false").lower() in ("1", "true", "yes")
+    GALLERY_PQ_SUBSPACES: int = int(os.getenv("GALLERY_PQ_SUBSPACES", "128"))
+    
+    # Approximate (IVF) search for large galleries; 0 disables
+    ANN_MIN_GALLERY_SIZE: int = int(os.getenv("ANN_MIN_GALLERY_SIZE", "50000"))
+    ANN_NLIST: int = int(os.getenv("ANN_NLIST", "0"))  # 0 = sqrt(gallery size)
+    ANN_NPROBE: int = int(os.getenv("ANN_NPROBE", "16"))
+    # Retrain centroids once the gallery grows past this multiple of the trained size
+    ANN_RETRAIN_GROWTH: float = float(os.getenv("ANN_RETRAIN_GROWTH", "4"))
+    ANN_INDEX_DIR: str = os.getenv(
+        "ANN_INDEX_DIR", str(Path(__file__).resolve().parent.parent / "storage" / "ann")
+    )
 
 
 settings = Settings()
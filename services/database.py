@@ -4,15 +4,44 @@ Multi-Tenant Database Manager with Redis Caching.
 Handles dynamic database connections for multi-tenant architecture.
 """
 
+import asyncio
 import json
+import logging
+import time
+from collections import Counter
 from contextlib import asynccontextmanager
 from dataclasses import dataclass
-from typing import Any, Dict, List, Optional
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 
 import aiomysql
+import numpy as np
 import redis.asyncio as redis
 
+from services import metrics
+from services.ann import IVFIndex, auto_nlist, train_centroids
+from services.coherence import SCOPE_CONFIG, SCOPE_ENROLLMENTS, InvalidationBus
+from services.codec import (
+    decode_embedding,
+    encode_embedding,
+    pack_enrollment,
+    pack_enrollments,
+    unpack_enrollment,
+    unpack_enrollments,
+)
 from services.config import settings
+from services.gallery import EMBEDDING_DIM, GalleryIndex
+from services.l1cache import L1Cache
+from services.pools import TenantPoolRegistry
+from services.similarity import PQCodes
+from services.singleflight import SingleFlight, fill_once
+
+logger = logging.getLogger(__name__)
+
+# Approximate L1 footprint of a config or enrollment record (excluding the
+# embedding itself)
+_L1_RECORD_BYTES = 1024
 
 
 @dataclass
@@ -29,6 +58,13 @@ class TenantConfig:
     db_server_port: int = 0  # SSH tunnel/server port if db_host contains port
 
 
+@dataclass
+class EnrollmentSchema:
+    """Embedding storage columns available in a tenant's enrollment table."""
+    binary: bool         # `face_embedding` VARBINARY column exists (migrated)
+    json_required: bool  # legacy `face_encoding` JSON column is still NOT NULL
+
+
 class TenantManager:
     """
     Manages multi-tenant database connections with Redis caching.
@@ -37,12 +73,44 @@ class TenantManager:
     - Gateway DB connection for tenant lookup
     - Dynamic tenant DB connections
     - Redis caching for tenant configs and face encodings
+    - In-process gallery index (embedding matrix) per tenant for identification,
+      with an IVF approximate index for galleries above ANN_MIN_GALLERY_SIZE
+    - In-process L1 cache (services.l1cache) of tenant configs, per-user
+      enrollments and galleries in front of Redis, bounded by memory budget
+    - Cross-replica invalidation (services.coherence): in-process galleries and
+      tenant configs are tagged with the tenant version they were built from
+      and rebuilt once another replica publishes a newer one
+    - Stampede protection (services.singleflight): one load per key per
+      process, optionally one per cluster, and stale-while-revalidate for
+      expired config/enrollment caches
     """
     
     _instance: Optional["TenantManager"] = None
     _gateway_pool: Optional[aiomysql.Pool] = None
-    _tenant_pools: Dict[int, aiomysql.Pool] = {}
+    _pools = TenantPoolRegistry(
+        pool_size=settings.DB_SERVER_POOL_SIZE,
+        max_connections=settings.DB_POOL_MAX_CONNECTIONS,
+        idle_timeout=settings.DB_POOL_IDLE_TIMEOUT,
+        health_interval=settings.DB_POOL_HEALTH_INTERVAL,
+        recycle=settings.DB_POOL_RECYCLE,
+        tenant_size=settings.DB_POOL_SIZE,
+    )
+    # In-process L1 caches: tenant configs and per-user enrollments in
+    # _l1, gallery indexes (much larger) under their own budget
+    _l1 = L1Cache(settings.L1_CACHE_BYTES)
+    _galleries = L1Cache(settings.GALLERY_CACHE_BYTES)
+    _schemas: Dict[int, EnrollmentSchema] = {}
+    _gallery_versions: Dict[int, int] = {}
+    # Deltas applied locally while a tenant's gallery is being rebuilt,
+    # replayed onto the new gallery before it is installed
+    _pending_deltas: Dict[int, List[Callable[[GalleryIndex], Any]]] = {}
     _redis: Optional[redis.Redis] = None
+    _bus = InvalidationBus(settings.COHERENCE_CHANNEL, settings.COHERENCE_RECONCILE_INTERVAL)
+    # Coalesces concurrent cache-miss loads and runs background refreshes
+    _flight = SingleFlight()
+    # Tenant connection counts not yet flushed to Redis (see _record_traffic)
+    _traffic: Counter = Counter()
+    _traffic_flushed_at = time.monotonic()
     
     def __new__(cls) -> "TenantManager":
         if cls._instance is None:
@@ -71,48 +139,148 @@ class TenantManager:
                 port=settings.REDIS_PORT,
                 db=settings.REDIS_DB,
                 password=settings.REDIS_PASSWORD,
-                decode_responses=True,
+                decode_responses=False,  # enrollment caches hold binary blobs
             )
+        
+        if settings.COHERENCE_ENABLED:
+            self._bus.start(self._redis, self._on_invalidate, self._resident_tenants)
+        self._pools.start()
     
     async def close(self) -> None:
         """Close all connections."""
+        await self._bus.stop()
+        
+        # Persist IVF list assignments so restarts skip re-assignment
+        for tenant_id, gallery in self._galleries.items():
+            if gallery.ann is not None:
+                await asyncio.to_thread(gallery.ann.fork(gallery.ids).save, self._ann_path(tenant_id))
+        
         if self._gateway_pool:
             self._gateway_pool.close()
             await self._gateway_pool.wait_closed()
             self._gateway_pool = None
         
-        for pool in self._tenant_pools.values():
-            pool.close()
-            await pool.wait_closed()
-        self._tenant_pools.clear()
+        await self._pools.close()
+        self._galleries.clear()
+        self._gallery_versions.clear()
+        self._pending_deltas.clear()
+        self._schemas.clear()
+        self._l1.clear()
         
         if self._redis:
             await self._redis.close()
             self._redis = None
     
+    # =========================================
+    # Cross-replica coherence
+    # =========================================
+    
+    def _resident_tenants(self) -> Set[int]:
+        """Tenants with in-process state that may need refreshing."""
+        return {key[1] for key in self._l1.keys()} | set(self._galleries.keys()) | self._pools.tenants()
+    
+    async def _current_version(self, tenant_id: int, scope: str) -> int:
+        """Tenant version to tag freshly loaded state with (0 without coherence)."""
+        if not settings.COHERENCE_ENABLED:
+            return 0
+        return await self._bus.current(tenant_id, scope)
+    
+    async def _publish(self, tenant_id: int, *scopes: str) -> None:
+        """Announce a local mutation to the other replicas."""
+        if not settings.COHERENCE_ENABLED:
+            return
+        before = self._bus.latest(tenant_id, SCOPE_ENROLLMENTS)
+        versions = await self._bus.publish(tenant_id, scopes)
+        # The local gallery already has the delta applied; it stays current
+        # unless another replica's change slipped in between
+        version = versions.get(SCOPE_ENROLLMENTS)
+        if (
+            version is not None
+            and tenant_id in self._galleries
+            and self._gallery_versions.get(tenant_id, 0) == before == version - 1
+        ):
+            self._gallery_versions[tenant_id] = version
+    
+    async def _on_invalidate(self, tenant_id: int, scope: str) -> None:
+        """
+        Another replica changed a tenant.
+        
+        Stale galleries and L1 entries are detected by version on next use
+        (the old index is kept so its IVF assignments can be reused by the
+        rebuild). Config changes may carry new credentials, so the tenant's
+        pool mapping is dropped right away.
+        """
+        if scope == SCOPE_CONFIG:
+            self._l1.pop(("config", tenant_id))
+            self._schemas.pop(tenant_id, None)
+            await self._pools.forget(tenant_id)
+    
+    @metrics.timed("tenant_config")
     async def get_tenant_config(self, tenant_id: int) -> Optional[TenantConfig]:
         """
         Get tenant configuration by ID.
         
-        First checks Redis cache, then falls back to gateway database.
+        Checks the in-process L1 cache first, then the Redis cache, then
+        falls back to gateway database. An expired Redis entry is still
+        served for CACHE_STALE_TTL seconds while one background task reloads
+        it; concurrent misses share one query.
         """
         await self.initialize()
         
-        cache_key = f"tenant:config:{tenant_id}"
+        entry = self._l1.get(("config", tenant_id))
+        if entry is not None:
+            config, version = entry
+            if version >= self._bus.latest(tenant_id, SCOPE_CONFIG):
+                return config
+        version = await self._current_version(tenant_id, SCOPE_CONFIG)
         
-        # Check Redis cache
-        cached = await self._redis.get(cache_key)
-        if cached:
-            data = json.loads(cached)
-            # Handle old cached data that may have host:port format in db_host
-            if ":" in data.get("db_host", ""):
-                host_parts = data["db_host"].split(":", 1)
-                data["db_host"] = host_parts[0]
-                data["db_server_port"] = int(host_parts[1])
-            # Ensure db_server_port exists for old cache entries
-            if "db_server_port" not in data:
-                data["db_server_port"] = 0
-            return TenantConfig(**data)
+        cached = await self._read_cached_config(tenant_id)
+        if cached is not None:
+            config, fresh_until = cached
+            if fresh_until > time.time():
+                return self._remember_config(config, version)
+            # Stale: serve it and refresh once in the background
+            self._flight.spawn(("config", tenant_id), lambda: self._load_tenant_config(tenant_id))
+            return config
+        
+        return await self._flight.do(("config", tenant_id), lambda: self._load_tenant_config(tenant_id))
+    
+    # The cached config JSON keeps the layout every release reads
+    # (TenantConfig fields only); the time it stays fresh until is stored
+    # beside it under its own key
+    
+    def _config_cache_key(self, tenant_id: int) -> str:
+        return f"tenant:config:{tenant_id}"
+    
+    def _config_fresh_key(self, tenant_id: int) -> str:
+        return f"tenant:config:{tenant_id}:fresh_until"
+    
+    @metrics.timed("redis_read")
+    async def _read_cached_config(self, tenant_id: int) -> Optional[Tuple[TenantConfig, float]]:
+        """Cached config and the time (epoch) it stays fresh until."""
+        cached, fresh_until = await self._redis.mget(
+            self._config_cache_key(tenant_id), self._config_fresh_key(tenant_id)
+        )
+        if not cached:
+            return None
+        data = json.loads(cached)
+        # Entries written without a stamp (before stale-while-revalidate)
+        # count as fresh: their own TTL bounds them
+        fresh_until = float(fresh_until) if fresh_until is not None else float("inf")
+        # Handle old cached data that may have host:port format in db_host
+        if ":" in data.get("db_host", ""):
+            host_parts = data["db_host"].split(":", 1)
+            data["db_host"] = host_parts[0]
+            data["db_server_port"] = int(host_parts[1])
+        # Ensure db_server_port exists for old cache entries
+        if "db_server_port" not in data:
+            data["db_server_port"] = 0
+        return TenantConfig(**data), fresh_until
+    
+    @metrics.timed("mysql_load")
+    async def _load_tenant_config(self, tenant_id: int) -> Optional[TenantConfig]:
+        """Query the gateway database and refill the Redis cache."""
+        version = await self._current_version(tenant_id, SCOPE_CONFIG)
         
         # Query gateway database
         # Note: tenants table uses 'port' not 'db_port'
@@ -151,50 +319,122 @@ class TenantManager:
             db_server_port=parsed_server_port,  # SSH tunnel/server port
         )
         
-        # Cache in Redis
-        await self._redis.setex(
-            cache_key,
-            settings.TENANT_CACHE_TTL,
-            json.dumps(config.__dict__),
-        )
+        # Cache in Redis; kept CACHE_STALE_TTL past its freshness so it can
+        # be served while being refreshed
+        ttl = settings.TENANT_CACHE_TTL + settings.CACHE_STALE_TTL
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.setex(self._config_cache_key(tenant_id), ttl, json.dumps(config.__dict__))
+            pipe.setex(self._config_fresh_key(tenant_id), ttl, str(time.time() + settings.TENANT_CACHE_TTL))
+            await pipe.execute()
         
+        return self._remember_config(config, version)
+    
+    def _remember_config(self, config: TenantConfig, version: int) -> TenantConfig:
+        self._l1.put(("config", config.id), (config, version), _L1_RECORD_BYTES, settings.TENANT_CACHE_TTL)
         return config
     
-    async def get_tenant_pool(self, tenant_id: int) -> Optional[aiomysql.Pool]:
-        """Get or create connection pool for a tenant database."""
-        if tenant_id in self._tenant_pools:
-            return self._tenant_pools[tenant_id]
+    async def ensure_tenant_pool(self, tenant_id: int) -> bool:
+        """
+        Map a tenant to its (shared) server pool; False if the tenant is unknown.
+        
+        Pools are shared by tenants on the same server login and managed by
+        the pool registry (services.pools).
+        """
+        if self._pools.has_tenant(tenant_id):
+            return True
         
         config = await self.get_tenant_config(tenant_id)
         if not config:
-            return None
+            return False
         
         # Use server port (SSH tunnel) if specified, otherwise use MySQL port
         connect_port = config.db_server_port if config.db_server_port > 0 else config.db_port
-        pool = await aiomysql.create_pool(
+        await self._pools.register(
+            tenant_id,
             host=config.db_host,
             port=connect_port,
             user=config.db_user,
             password=config.db_pass or "",
-            db=config.db_name,
-            autocommit=True,
-            minsize=1,
-            maxsize=5,
+            database=config.db_name,
         )
-        
-        self._tenant_pools[tenant_id] = pool
-        return pool
+        return True
     
     @asynccontextmanager
     async def get_tenant_connection(self, tenant_id: int):
         """Context manager for tenant database connection."""
-        pool = await self.get_tenant_pool(tenant_id)
-        if not pool:
+        start = time.perf_counter()
+        # Concurrent first requests share one config lookup and pool creation
+        ready = self._pools.has_tenant(tenant_id) or await self._flight.do(
+            ("pool", tenant_id), lambda: self.ensure_tenant_pool(tenant_id)
+        )
+        if not ready:
             raise ValueError(f"Tenant {tenant_id} not found or inactive")
+        self._record_traffic(tenant_id)
         
-        async with pool.acquire() as conn:
+        async with self._pools.connection(tenant_id) as conn:
+            metrics.observe_stage("db_acquire", time.perf_counter() - start)
             yield conn
     
+    # =========================================
+    # Pool pre-warming
+    # =========================================
+    
+    def _traffic_key(self, day: date) -> str:
+        return f"tenant:traffic:{day:%Y%m%d}"
+    
+    def _record_traffic(self, tenant_id: int) -> None:
+        """Count a tenant connection; flushed to Redis in the background."""
+        self._traffic[tenant_id] += 1
+        if time.monotonic() - self._traffic_flushed_at >= settings.DB_POOL_TRAFFIC_FLUSH_INTERVAL:
+            TenantManager._traffic_flushed_at = time.monotonic()
+            self._flight.spawn(("traffic",), self._flush_traffic)
+    
+    async def _flush_traffic(self) -> None:
+        """ZINCRBY the day's per-tenant connection counts."""
+        counts, TenantManager._traffic = self._traffic, Counter()
+        if not counts or self._redis is None:
+            return
+        key = self._traffic_key(date.today())
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for tenant_id, count in counts.items():
+                pipe.zincrby(key, count, str(tenant_id))
+            pipe.expire(key, 3 * 24 * 3600)
+            await pipe.execute()
+    
+    async def busiest_tenants(self, limit: int) -> List[int]:
+        """Tenants with the most connections today and yesterday (all replicas)."""
+        await self.initialize()
+        totals: Counter = Counter()
+        today = date.today()
+        for day in (today, today - timedelta(days=1)):
+            for member, score in await self._redis.zrevrange(self._traffic_key(day), 0, limit - 1, withscores=True):
+                totals[int(member)] += score
+        return [tenant_id for tenant_id, _ in totals.most_common(limit)]
+    
+    async def prewarm_pools(self) -> List[int]:
+        """
+        Create pools for DB_POOL_PREWARM_TENANTS and the DB_POOL_PREWARM_TOP
+        busiest tenants so their first requests do not pay for connecting.
+        
+        Returns the tenants whose pools are ready; failures are logged.
+        """
+        tenant_ids = list(settings.DB_POOL_PREWARM_TENANTS)
+        if settings.DB_POOL_PREWARM_TOP > 0:
+            tenant_ids += await self.busiest_tenants(settings.DB_POOL_PREWARM_TOP)
+        tenant_ids = list(dict.fromkeys(tenant_ids))
+        
+        results = await asyncio.gather(
+            *(self.ensure_tenant_pool(tenant_id) for tenant_id in tenant_ids),
+            return_exceptions=True,
+        )
+        ready = []
+        for tenant_id, result in zip(tenant_ids, results):
+            if isinstance(result, BaseException):
+                logger.warning("Could not pre-create pool for tenant %s: %s", tenant_id, result)
+            elif result:
+                ready.append(tenant_id)
+        return ready
+    
     # =========================================
     # Enrollment-specific methods with caching
     # =========================================
@@ -207,51 +447,417 @@ class TenantManager:
         """Get user table name for tenant."""
         return f"user_{tenant_id}"
     
+    async def _get_enrollment_schema(self, tenant_id: int, conn) -> EnrollmentSchema:
+        """Detect (once per tenant) whether the binary embedding column exists."""
+        schema = self._schemas.get(tenant_id)
+        if schema is not None:
+            return schema
+        
+        table = self._enrollment_table(tenant_id)
+        async with conn.cursor(aiomysql.DictCursor) as cursor:
+            await cursor.execute(f"SHOW COLUMNS FROM `{table}`")
+            columns = {row["Field"]: row for row in await cursor.fetchall()}
+        
+        legacy = columns.get("face_encoding")
+        schema = EnrollmentSchema(
+            binary="face_embedding" in columns,
+            json_required=legacy is not None and legacy["Null"] == "NO",
+        )
+        self._schemas[tenant_id] = schema
+        return schema
+    
+    def _enrollment_columns(self, schema: EnrollmentSchema) -> str:
+        """SELECT column list for enrollment rows."""
+        if schema.binary:
+            return "id, user_id, label, face_encoding, face_embedding, status, created_at"
+        return "id, user_id, label, face_encoding, status, created_at"
+    
+    def _row_to_enrollment(self, row: Dict[str, Any]) -> Dict[str, Any]:
+        """Convert a DB row to an enrollment record with a float32 encoding."""
+        blob = row.get("face_embedding")
+        return {
+            "id": row["id"],
+            "user_id": row["user_id"],
+            "label": row["label"],
+            "encoding": decode_embedding(blob if blob is not None else row["face_encoding"]),
+            "status": row["status"],
+            "created_at": str(row["created_at"]) if row["created_at"] else None,
+        }
+    
+    async def _migrate_legacy_rows(
+        self,
+        tenant_id: int,
+        conn,
+        schema: EnrollmentSchema,
+        rows: List[Dict[str, Any]],
+        enrollments: List[Dict[str, Any]],
+    ) -> None:
+        """Lazily rewrite rows that only have a JSON encoding into the binary column."""
+        if not schema.binary:
+            return
+        updates = [
+            (encode_embedding(enrollment["encoding"], settings.EMBEDDING_FORMAT), row["id"])
+            for row, enrollment in zip(rows, enrollments)
+            if row.get("face_embedding") is None and len(enrollment["encoding"]) == EMBEDDING_DIM
+        ]
+        if not updates:
+            return
+        table = self._enrollment_table(tenant_id)
+        async with conn.cursor() as cursor:
+            await cursor.executemany(
+                f"UPDATE `{table}` SET face_embedding = %s WHERE id = %s",
+                updates,
+            )
+    
+    # =========================================
+    # Enrollment hash cache
+    # =========================================
+    #
+    # tenant:{id}:enrollments:h is a Redis hash: field = enrollment id,
+    # value = pack_enrollment() blob. Enroll/delete HSET/HDEL single fields;
+    # only a missing (or expired) hash is reloaded from MySQL. The sentinel
+    # field marks a hash that holds the full set; a hash without it (e.g.
+    # created by a mutation after expiry) is treated as a miss.
+    #
+    # Earlier releases cached the whole set as one string under
+    # tenant:{id}:enrollments. That key is left to them (a hash under the
+    # same name would fail their GET with WRONGTYPE, and theirs our HGET),
+    # but mutations still delete it so replicas not yet upgraded reload.
+    
+    _COMPLETE_FIELD = b"_complete"
+    
+    def _enrollment_cache_key(self, tenant_id: int) -> str:
+        return f"tenant:{tenant_id}:enrollments:h"
+    
+    def _legacy_enrollment_cache_key(self, tenant_id: int) -> str:
+        return f"tenant:{tenant_id}:enrollments"
+    
+    @metrics.timed("redis_read")
+    async def _read_enrollment_hash(self, tenant_id: int) -> Optional[Tuple[List[Dict[str, Any]], float]]:
+        """
+        Cached enrollments and the time (epoch) they stay fresh until, or
+        None if the hash is missing or incomplete.
+        """
+        key = self._enrollment_cache_key(tenant_id)
+        size = await self._redis.hlen(key)
+        if not size:
+            return None
+        if size <= settings.ENROLLMENT_CACHE_SCAN_COUNT:
+            fields = await self._redis.hgetall(key)
+        else:
+            # Avoid one huge reply blocking Redis for large tenants
+            fields = {}
+            async for field, value in self._redis.hscan_iter(key, count=settings.ENROLLMENT_CACHE_SCAN_COUNT):
+                fields[field] = value
+        fresh_until = fields.pop(self._COMPLETE_FIELD, None)
+        if fresh_until is None:
+            return None
+        enrollments = [
+            unpack_enrollment(int(field), value)
+            for field, value in sorted(fields.items(), key=lambda kv: int(kv[0]))
+        ]
+        return enrollments, float(fresh_until)
+    
+    async def _update_enrollment_hash(
+        self,
+        tenant_id: int,
+        upsert: Optional[Dict[str, Any]] = None,
+        remove: Optional[List[int]] = None,
+    ) -> None:
+        """Apply one mutation to the cached hash: O(1) per changed enrollment."""
+        key = self._enrollment_cache_key(tenant_id)
+        async with self._redis.pipeline(transaction=True) as pipe:
+            if remove:
+                pipe.hdel(key, *[str(enrollment_id) for enrollment_id in remove])
+            if upsert is not None:
+                pipe.hset(key, str(upsert["id"]), pack_enrollment(upsert, settings.EMBEDDING_FORMAT))
+            pipe.delete(self._legacy_enrollment_cache_key(tenant_id))
+            pipe.ttl(key)
+            *_, ttl = await pipe.execute()
+        if ttl == -1:
+            # The hash had expired and was recreated by this write: bound the
+            # lifetime of the (incomplete) hash
+            await self._redis.expire(key, settings.ENROLLMENT_CACHE_TTL)
+    
+    @metrics.timed("mysql_load")
+    async def _load_enrollments(self, tenant_id: int) -> List[Dict[str, Any]]:
+        """Query active enrollments from the tenant database."""
+        table = self._enrollment_table(tenant_id)
+        async with self.get_tenant_connection(tenant_id) as conn:
+            schema = await self._get_enrollment_schema(tenant_id, conn)
+            async with conn.cursor(aiomysql.DictCursor) as cursor:
+                await cursor.execute(
+                    f"SELECT {self._enrollment_columns(schema)} "
+                    f"FROM `{table}` WHERE status = 'active'"
+                )
+                rows = await cursor.fetchall()
+            
+            enrollments = [self._row_to_enrollment(row) for row in rows]
+            await self._migrate_legacy_rows(tenant_id, conn, schema, rows, enrollments)
+        return enrollments
+    
+    @metrics.timed("enrollments")
     async def get_enrollments(self, tenant_id: int) -> List[Dict[str, Any]]:
         """
         Get all active enrollments for a tenant.
         
-        Uses Redis caching for performance.
+        Served from the Redis enrollment hash; a miss loads the table once
+        and fills the hash. Concurrent misses share one load (and, with
+        CACHE_LOAD_LOCK, one load across replicas); an expired hash is
+        served for CACHE_STALE_TTL seconds while one background task
+        reloads it.
         """
         await self.initialize()
         
-        cache_key = f"tenant:{tenant_id}:enrollments"
+        cached = await self._read_enrollment_hash(tenant_id)
+        if cached is not None:
+            enrollments, fresh_until = cached
+            if fresh_until <= time.time():
+                self._flight.spawn(("enrollments", tenant_id), lambda: self._refresh_enrollments(tenant_id))
+            return enrollments
         
-        # Check cache
-        cached = await self._redis.get(cache_key)
-        if cached:
-            return json.loads(cached)
+        return await self._flight.do(("enrollments", tenant_id), lambda: self._refresh_enrollments(tenant_id))
+    
+    async def get_enrollment_count(self, tenant_id: int) -> int:
+        """
+        Number of active enrollments for a tenant, without reading them.
         
-        # Query tenant database
+        Taken from the resident gallery when it is current, else from the
+        size of a complete enrollment hash (HLEN minus the sentinel), else
+        from a COUNT(*) on the table.
+        """
+        await self.initialize()
+        
+        gallery = self._galleries.peek(tenant_id)
+        if (
+            gallery is not None
+            and self._gallery_versions.get(tenant_id, 0) >= self._bus.latest(tenant_id, SCOPE_ENROLLMENTS)
+        ):
+            return len(gallery)
+        
+        key = self._enrollment_cache_key(tenant_id)
+        async with self._redis.pipeline(transaction=False) as pipe:
+            pipe.hlen(key)
+            pipe.hexists(key, self._COMPLETE_FIELD)
+            size, complete = await pipe.execute()
+        if complete:
+            return size - 1
+        
+        table = self._enrollment_table(tenant_id)
+        async with self.get_tenant_connection(tenant_id) as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(f"SELECT COUNT(*) FROM `{table}` WHERE status = 'active'")
+                return int((await cursor.fetchone())[0])
+    
+    async def _refresh_enrollments(self, tenant_id: int) -> List[Dict[str, Any]]:
+        """Reload the enrollment hash, holding the cross-replica lock if enabled."""
+        async def read_fresh() -> Optional[List[Dict[str, Any]]]:
+            # Polled while another replica fills: check the sentinel alone
+            # and read the whole hash only once it is fresh
+            fresh_until = await self._redis.hget(self._enrollment_cache_key(tenant_id), self._COMPLETE_FIELD)
+            if fresh_until is None or float(fresh_until) <= time.time():
+                return None
+            cached = await self._read_enrollment_hash(tenant_id)
+            if cached is not None and cached[1] > time.time():
+                return cached[0]
+            return None
+        
+        return await fill_once(
+            self._redis if settings.CACHE_LOAD_LOCK else None,
+            self._enrollment_cache_key(tenant_id),
+            settings.CACHE_LOAD_LOCK_TIMEOUT,
+            read_fresh,
+            lambda: self._fill_enrollments(tenant_id),
+        )
+    
+    async def _fill_enrollments(self, tenant_id: int) -> List[Dict[str, Any]]:
+        """Load enrollments from MySQL and replace the cached hash."""
+        key = self._enrollment_cache_key(tenant_id)
+        async with self._redis.pipeline(transaction=True) as pipe:
+            # A mutation touching the hash while the table is read aborts the
+            # fill, so a stale snapshot never overwrites a newer change
+            await pipe.watch(key)
+            enrollments = await self._load_enrollments(tenant_id)
+            
+            pipe.multi()
+            pipe.delete(key)
+            batch = settings.ENROLLMENT_CACHE_SCAN_COUNT
+            for start in range(0, len(enrollments), batch):
+                pipe.hset(key, mapping={
+                    str(enrollment["id"]): pack_enrollment(enrollment, settings.EMBEDDING_FORMAT)
+                    for enrollment in enrollments[start:start + batch]
+                })
+            pipe.hset(key, self._COMPLETE_FIELD, str(time.time() + settings.ENROLLMENT_CACHE_TTL))
+            pipe.expire(key, settings.ENROLLMENT_CACHE_TTL + settings.CACHE_STALE_TTL)
+            try:
+                await pipe.execute()
+            except redis.WatchError:
+                pass
+        
+        return enrollments
+    
+    async def get_gallery(self, tenant_id: int) -> GalleryIndex:
+        """
+        Get the in-process gallery index for a tenant.
+        
+        Built once from get_enrollments() and kept resident; enroll/delete
+        apply their deltas in place. Rebuilt when another replica published
+        a newer enrollment version, and (a fallback for rows edited directly
+        in the database) after GALLERY_INDEX_TTL.
+        """
+        gallery = self._galleries.get(tenant_id)
+        if (
+            gallery is not None
+            and (not settings.GALLERY_INDEX_TTL or gallery.age() < settings.GALLERY_INDEX_TTL)
+            and self._gallery_versions.get(tenant_id, 0) >= self._bus.latest(tenant_id, SCOPE_ENROLLMENTS)
+        ):
+            return gallery
+        
+        # Concurrent requests share one rebuild
+        return await self._flight.do(("gallery", tenant_id), lambda: self._build_gallery(tenant_id))
+    
+    @metrics.timed("gallery_build")
+    async def _build_gallery(self, tenant_id: int) -> GalleryIndex:
+        # Local deltas from here on may be missing from the enrollments
+        # read below; they are replayed before the gallery is installed
+        pending = self._pending_deltas[tenant_id] = []
+        try:
+            return await self._build_gallery_from(tenant_id, pending)
+        finally:
+            del self._pending_deltas[tenant_id]
+    
+    async def _build_gallery_from(self, tenant_id: int, pending: List[Callable[[GalleryIndex], Any]]) -> GalleryIndex:
+        # Read the version before loading: a change published meanwhile
+        # leaves this gallery tagged older, so it is rebuilt on next use
+        version = await self._current_version(tenant_id, SCOPE_ENROLLMENTS)
+        enrollments = await self.get_enrollments(tenant_id)
+        previous = self._galleries.peek(tenant_id)
+        if settings.GALLERY_COMPRESSION:
+            # Encoding (and PQ training) is CPU-bound: keep it off the event loop
+            gallery = await asyncio.to_thread(
+                GalleryIndex.from_enrollments,
+                enrollments,
+                compression=settings.GALLERY_COMPRESSION,
+                rerank=settings.GALLERY_RERANK,
+                keep_float32=settings.GALLERY_KEEP_FLOAT32,
+                pq_subspaces=settings.GALLERY_PQ_SUBSPACES,
+                reuse=self._reusable_codes(previous, len(enrollments)),
+            )
+        else:
+            gallery = GalleryIndex.from_enrollments(enrollments)
+        if 0 < settings.ANN_MIN_GALLERY_SIZE <= len(gallery):
+            await self._attach_ann(tenant_id, gallery, previous)
+        # Deltas are idempotent (upserts replace the user's rows), so those
+        # already in the enrollments read can be applied again
+        for apply in pending:
+            apply(gallery)
+        # No TTL here: age is checked in get_gallery so an expired index can
+        # still hand its IVF assignments to the rebuild
+        self._galleries.put(tenant_id, gallery, gallery.nbytes)
+        self._gallery_versions[tenant_id] = version
+        return gallery
+    
+    def _reusable_codes(self, previous: Optional[GalleryIndex], size: int) -> Optional[Tuple[PQCodes, np.ndarray]]:
+        """
+        PQ codes and enrollment ids of the previous gallery, if its codebooks
+        can be kept (same retrain rule as the IVF centroids).
+        
+        Copied here, on the event loop: the previous gallery keeps applying
+        enrollment deltas while the new one is built in a worker thread.
+        """
+        if previous is None or not isinstance(previous.codes, PQCodes):
+            return None
+        codes = previous.codes
+        if codes.subspaces != settings.GALLERY_PQ_SUBSPACES or size >= codes.trained_size * settings.ANN_RETRAIN_GROWTH:
+            return None
+        return codes.fork(len(previous)), previous.ids.copy()
+    
+    async def get_exact_embeddings(self, tenant_id: int, enrollment_ids: List[int]) -> Dict[int, np.ndarray]:
+        """
+        Stored embeddings of some enrollments, to re-score the shortlist of a
+        compressed gallery.
+        
+        Read from the Redis enrollment hash (one HMGET); enrollments missing
+        there (expired hash) are read from the table and a background refill
+        of the hash is started. Vectors have the stored precision
+        (EMBEDDING_FORMAT), i.e. they are the vectors an uncompressed gallery
+        is built from. Enrollments deleted meanwhile are left out.
+        """
+        if not enrollment_ids:
+            return {}
+        await self.initialize()
+        vectors = await self._read_hash_embeddings(tenant_id, enrollment_ids)
+        missing = [enrollment_id for enrollment_id in enrollment_ids if enrollment_id not in vectors]
+        if missing:
+            self._flight.spawn(("enrollments", tenant_id), lambda: self._refresh_enrollments(tenant_id))
+            vectors.update(await self._load_embeddings(tenant_id, missing))
+        return vectors
+    
+    @metrics.timed("redis_read")
+    async def _read_hash_embeddings(self, tenant_id: int, enrollment_ids: List[int]) -> Dict[int, np.ndarray]:
+        values = await self._redis.hmget(
+            self._enrollment_cache_key(tenant_id), [str(enrollment_id) for enrollment_id in enrollment_ids]
+        )
+        return {
+            enrollment_id: unpack_enrollment(enrollment_id, value)["encoding"]
+            for enrollment_id, value in zip(enrollment_ids, values)
+            if value is not None
+        }
+    
+    @metrics.timed("mysql_load")
+    async def _load_embeddings(self, tenant_id: int, enrollment_ids: List[int]) -> Dict[int, np.ndarray]:
+        """Active enrollments with the given ids, from the tenant database."""
         table = self._enrollment_table(tenant_id)
         async with self.get_tenant_connection(tenant_id) as conn:
+            schema = await self._get_enrollment_schema(tenant_id, conn)
             async with conn.cursor(aiomysql.DictCursor) as cursor:
                 await cursor.execute(
-                    f"SELECT id, user_id, label, face_encoding, status, created_at "
-                    f"FROM `{table}` WHERE status = 'active'"
+                    f"SELECT {self._enrollment_columns(schema)} FROM `{table}` "
+                    f"WHERE status = 'active' AND id IN ({', '.join(['%s'] * len(enrollment_ids))})",
+                    enrollment_ids,
                 )
                 rows = await cursor.fetchall()
+        return {row["id"]: self._row_to_enrollment(row)["encoding"] for row in rows}
+    
+    def _ann_path(self, tenant_id: int) -> Path:
+        """Local file holding a tenant's persisted IVF index."""
+        return Path(settings.ANN_INDEX_DIR) / f"tenant_{tenant_id}.npz"
+    
+    async def _attach_ann(
+        self,
+        tenant_id: int,
+        gallery: GalleryIndex,
+        previous: Optional[GalleryIndex],
+    ) -> None:
+        """
+        Attach an IVF index to a freshly built gallery.
         
-        enrollments = []
-        for row in rows:
-            enrollments.append({
-                "id": row["id"],
-                "user_id": row["user_id"],
-                "label": row["label"],
-                "encoding": json.loads(row["face_encoding"]) if isinstance(row["face_encoding"], str) else row["face_encoding"],
-                "status": row["status"],
-                "created_at": str(row["created_at"]) if row["created_at"] else None,
-            })
-        
-        # Cache results
-        await self._redis.setex(
-            cache_key,
-            settings.ENCODING_CACHE_TTL,
-            json.dumps(enrollments),
+        Reuses the previous gallery's index or the one persisted on disk;
+        trains new centroids (in a worker thread) only when none exists or
+        the gallery outgrew the trained size.
+        """
+        path = self._ann_path(tenant_id)
+        if previous is not None and previous.ann is not None:
+            index = previous.ann.fork(previous.ids)
+        else:
+            index = await asyncio.to_thread(IVFIndex.load, path)
+        
+        stale = (
+            index is None
+            or index.centroids.shape[1] != gallery.dim
+            or len(gallery) >= index.trained_size * settings.ANN_RETRAIN_GROWTH
         )
+        if stale:
+            nlist = settings.ANN_NLIST or auto_nlist(len(gallery))
+            centroids = await asyncio.to_thread(train_centroids, gallery.matrix.copy(), nlist)
+            index = IVFIndex(centroids, settings.ANN_NPROBE, len(gallery))
         
-        return enrollments
+        index.nprobe = max(1, min(settings.ANN_NPROBE, index.nlist))
+        gallery.attach_ann(index)
+        if stale:
+            await asyncio.to_thread(gallery.ann.fork(gallery.ids).save, path)
     
+    @metrics.timed("user_enrollment")
     async def get_user_enrollment(self, tenant_id: int, user_id: int) -> Optional[Dict[str, Any]]:
         """
         Get enrollment for a specific user.
@@ -260,45 +866,54 @@ class TenantManager:
         """
         await self.initialize()
         
-        # Check cache first
+        # L1 first: a hit costs no network round trip
+        entry = self._l1.get(("user", tenant_id, user_id))
+        if entry is not None:
+            enrollment, version = entry
+            if version >= self._bus.latest(tenant_id, SCOPE_ENROLLMENTS):
+                return enrollment
+        version = await self._current_version(tenant_id, SCOPE_ENROLLMENTS)
+        
+        # Then Redis
         cache_key = f"tenant:{tenant_id}:user:{user_id}:enrollment"
         cached = await self._redis.get(cache_key)
         if cached:
-            return json.loads(cached)
+            return self._remember_user_enrollment(tenant_id, unpack_enrollments(cached)[0], version)
         
         # Query tenant database
         table = self._enrollment_table(tenant_id)
         async with self.get_tenant_connection(tenant_id) as conn:
+            schema = await self._get_enrollment_schema(tenant_id, conn)
             async with conn.cursor(aiomysql.DictCursor) as cursor:
                 await cursor.execute(
-                    f"SELECT id, user_id, label, face_encoding, status, created_at "
+                    f"SELECT {self._enrollment_columns(schema)} "
                     f"FROM `{table}` WHERE user_id = %s AND status = 'active' "
                     f"ORDER BY created_at DESC LIMIT 1",
                     (user_id,)
                 )
                 row = await cursor.fetchone()
-        
-        if not row:
-            return None
-        
-        enrollment = {
-            "id": row["id"],
-            "user_id": row["user_id"],
-            "label": row["label"],
-            "encoding": json.loads(row["face_encoding"]) if isinstance(row["face_encoding"], str) else row["face_encoding"],
-            "status": row["status"],
-            "created_at": str(row["created_at"]) if row["created_at"] else None,
-        }
+            
+            if not row:
+                return None
+            
+            enrollment = self._row_to_enrollment(row)
+            await self._migrate_legacy_rows(tenant_id, conn, schema, [row], [enrollment])
         
         # Cache for 60 seconds
         await self._redis.setex(
             cache_key,
             settings.ENCODING_CACHE_TTL,
-            json.dumps(enrollment),
+            pack_enrollments([enrollment], settings.EMBEDDING_FORMAT),
         )
         
+        return self._remember_user_enrollment(tenant_id, enrollment, version)
+    
+    def _remember_user_enrollment(self, tenant_id: int, enrollment: Dict[str, Any], version: int) -> Dict[str, Any]:
+        nbytes = _L1_RECORD_BYTES + enrollment["encoding"].nbytes
+        self._l1.put(("user", tenant_id, enrollment["user_id"]), (enrollment, version), nbytes, settings.ENCODING_CACHE_TTL)
         return enrollment
     
+    @metrics.timed("enrollment_write")
     async def add_enrollment(
         self,
         tenant_id: int,
@@ -315,10 +930,26 @@ class TenantManager:
         await self.initialize()
         
         table = self._enrollment_table(tenant_id)
-        encoding_json = json.dumps(face_encoding)
         
         async with self.get_tenant_connection(tenant_id) as conn:
+            schema = await self._get_enrollment_schema(tenant_id, conn)
+            columns = ["user_id", "label"]
+            values: List[Any] = [user_id, label]
+            if schema.binary:
+                columns.append("face_embedding")
+                values.append(encode_embedding(face_encoding, settings.EMBEDDING_FORMAT))
+            if schema.json_required or not schema.binary:
+                # Unmigrated table: the JSON column is still mandatory
+                columns.append("face_encoding")
+                values.append(json.dumps([float(x) for x in face_encoding]))
+            
             async with conn.cursor() as cursor:
+                await cursor.execute(
+                    f"SELECT id FROM `{table}` WHERE user_id = %s",
+                    (user_id,),
+                )
+                replaced = [row[0] for row in await cursor.fetchall()]
+                
                 # Delete existing enrollment for this user_id first (upsert behavior)
                 await cursor.execute(
                     f"DELETE FROM `{table}` WHERE user_id = %s",
@@ -327,17 +958,39 @@ class TenantManager:
                 
                 # Insert new enrollment
                 await cursor.execute(
-                    f"INSERT INTO `{table}` (user_id, label, face_encoding, status) "
-                    f"VALUES (%s, %s, %s, 'active')",
-                    (user_id, label, encoding_json),
+                    f"INSERT INTO `{table}` ({', '.join(columns)}, status) "
+                    f"VALUES ({', '.join(['%s'] * len(columns))}, 'active')",
+                    values,
                 )
                 enrollment_id = cursor.lastrowid
+                await cursor.execute(
+                    f"SELECT created_at FROM `{table}` WHERE id = %s",
+                    (enrollment_id,),
+                )
+                created_at = (await cursor.fetchone())[0]
         
-        # Invalidate cache
-        await self._redis.delete(f"tenant:{tenant_id}:enrollments")
+        # Update the enrollment hash in place
+        await self._update_enrollment_hash(
+            tenant_id,
+            upsert={
+                "id": enrollment_id,
+                "user_id": user_id,
+                "label": label,
+                "encoding": face_encoding,
+                "created_at": str(created_at) if created_at else None,
+            },
+            remove=replaced,
+        )
         # Also invalidate user-specific cache
         await self._redis.delete(f"tenant:{tenant_id}:user:{user_id}:enrollment")
         
+        # Apply delta to the resident gallery index
+        self._l1.pop(("user", tenant_id, user_id))
+        await self._apply_gallery_delta(
+            tenant_id, lambda gallery: gallery.upsert(enrollment_id, user_id, label, face_encoding)
+        )
+        await self._publish(tenant_id, SCOPE_ENROLLMENTS)
+        
         return {
             "id": enrollment_id,
             "user_id": user_id,
@@ -345,6 +998,26 @@ class TenantManager:
             "tenant_id": tenant_id,
         }
     
+    async def _apply_gallery_delta(self, tenant_id: int, apply: Callable[[GalleryIndex], Any]) -> None:
+        """
+        Apply an enrollment delta to the resident gallery in place, once no
+        search thread is reading it (see GalleryIndex.guard), and to the
+        gallery being rebuilt, if any.
+        """
+        if tenant_id in self._pending_deltas:
+            self._pending_deltas[tenant_id].append(apply)
+        gallery = self._galleries.peek(tenant_id)
+        while gallery is not None:
+            await gallery.guard.idle()
+            current = self._galleries.peek(tenant_id)
+            if current is gallery:
+                apply(gallery)
+                self._galleries.resize(tenant_id, gallery.nbytes)
+                return
+            # Replaced by a rebuild while waiting
+            gallery = current
+    
+    @metrics.timed("enrollment_write")
     async def delete_enrollment(self, tenant_id: int, enrollment_id: int) -> bool:
         """Delete an enrollment by ID."""
         await self.initialize()
@@ -353,17 +1026,28 @@ class TenantManager:
         
         async with self.get_tenant_connection(tenant_id) as conn:
             async with conn.cursor() as cursor:
+                await cursor.execute(
+                    f"SELECT user_id FROM `{table}` WHERE id = %s",
+                    (enrollment_id,),
+                )
+                user_ids = [row[0] for row in await cursor.fetchall()]
                 await cursor.execute(
                     f"DELETE FROM `{table}` WHERE id = %s",
                     (enrollment_id,),
                 )
                 affected = cursor.rowcount
         
-        # Invalidate cache
-        await self._redis.delete(f"tenant:{tenant_id}:enrollments")
+        await self._update_enrollment_hash(tenant_id, remove=[enrollment_id])
+        for user_id in user_ids:
+            self._l1.pop(("user", tenant_id, user_id))
+            await self._redis.delete(f"tenant:{tenant_id}:user:{user_id}:enrollment")
+        
+        await self._apply_gallery_delta(tenant_id, lambda gallery: gallery.remove_id(enrollment_id))
+        await self._publish(tenant_id, SCOPE_ENROLLMENTS)
         
         return affected > 0
     
+    @metrics.timed("enrollment_write")
     async def delete_enrollment_by_label(self, tenant_id: int, label: str) -> bool:
         """Delete an enrollment by label."""
         await self.initialize()
@@ -372,14 +1056,25 @@ class TenantManager:
         
         async with self.get_tenant_connection(tenant_id) as conn:
             async with conn.cursor() as cursor:
+                await cursor.execute(
+                    f"SELECT id, user_id FROM `{table}` WHERE label = %s",
+                    (label,),
+                )
+                removed = await cursor.fetchall()
                 await cursor.execute(
                     f"DELETE FROM `{table}` WHERE label = %s",
                     (label,),
                 )
                 affected = cursor.rowcount
         
-        # Invalidate cache
-        await self._redis.delete(f"tenant:{tenant_id}:enrollments")
+        if removed:
+            await self._update_enrollment_hash(tenant_id, remove=[row[0] for row in removed])
+        for _, user_id in removed:
+            self._l1.pop(("user", tenant_id, user_id))
+            await self._redis.delete(f"tenant:{tenant_id}:user:{user_id}:enrollment")
+        
+        await self._apply_gallery_delta(tenant_id, lambda gallery: gallery.remove_label(label))
+        await self._publish(tenant_id, SCOPE_ENROLLMENTS)
         
         return affected > 0
     
@@ -390,50 +1085,78 @@ class TenantManager:
     async def invalidate_enrollment_cache(self, tenant_id: int) -> bool:
         """Invalidate enrollment cache for a specific tenant."""
         await self.initialize()
-        result = await self._redis.delete(f"tenant:{tenant_id}:enrollments")
+        self._galleries.pop(tenant_id)
+        self._l1.discard_where(lambda key: key[:2] == ("user", tenant_id))
+        result = await self._redis.delete(
+            self._enrollment_cache_key(tenant_id), self._legacy_enrollment_cache_key(tenant_id)
+        )
+        await self._publish(tenant_id, SCOPE_ENROLLMENTS)
         return result > 0
     
     async def invalidate_tenant_config_cache(self, tenant_id: int) -> bool:
         """Invalidate tenant config cache."""
         await self.initialize()
-        result = await self._redis.delete(f"tenant:config:{tenant_id}")
-        # Also remove from connection pool to force reconnect
-        if tenant_id in self._tenant_pools:
-            pool = self._tenant_pools.pop(tenant_id)
-            pool.close()
-            await pool.wait_closed()
+        self._schemas.pop(tenant_id, None)
+        self._l1.pop(("config", tenant_id))
+        result = await self._redis.delete(self._config_cache_key(tenant_id), self._config_fresh_key(tenant_id))
+        # Also drop the pool mapping to force reconnect
+        await self._pools.forget(tenant_id)
+        await self._publish(tenant_id, SCOPE_CONFIG)
         return result > 0
     
     async def invalidate_all_tenant_cache(self, tenant_id: int) -> Dict[str, bool]:
         """Invalidate all caches for a specific tenant."""
         await self.initialize()
-        enrollment_result = await self._redis.delete(f"tenant:{tenant_id}:enrollments")
-        config_result = await self._redis.delete(f"tenant:config:{tenant_id}")
+        self._galleries.pop(tenant_id)
+        self._schemas.pop(tenant_id, None)
+        self._l1.discard_where(lambda key: key[1] == tenant_id)
+        enrollment_result = await self._redis.delete(
+            self._enrollment_cache_key(tenant_id), self._legacy_enrollment_cache_key(tenant_id)
+        )
+        config_result = await self._redis.delete(
+            self._config_cache_key(tenant_id), self._config_fresh_key(tenant_id)
+        )
         # Remove from connection pool
-        if tenant_id in self._tenant_pools:
-            pool = self._tenant_pools.pop(tenant_id)
-            pool.close()
-            await pool.wait_closed()
+        await self._pools.forget(tenant_id)
+        await self._publish(tenant_id, SCOPE_ENROLLMENTS, SCOPE_CONFIG)
         return {
             "enrollment_cache_cleared": enrollment_result > 0,
             "config_cache_cleared": config_result > 0,
             "tenant_id": tenant_id,
         }
     
+    def get_l1_stats(self) -> Dict[str, Any]:
+        """Hit/miss/eviction counters of the in-process caches, plus pool usage."""
+        return {
+            "records": self._l1.stats(),
+            "galleries": self._galleries.stats(),
+            "pools": self._pools.stats(),
+        }
+    
     async def get_cache_status(self, tenant_id: int) -> Dict[str, Any]:
         """Get cache status for a tenant."""
         await self.initialize()
-        enrollment_cache = await self._redis.get(f"tenant:{tenant_id}:enrollments")
-        config_cache = await self._redis.get(f"tenant:config:{tenant_id}")
-        enrollment_ttl = await self._redis.ttl(f"tenant:{tenant_id}:enrollments")
-        config_ttl = await self._redis.ttl(f"tenant:config:{tenant_id}")
+        enrollment_key = self._enrollment_cache_key(tenant_id)
+        enrollment_cache = await self._redis.hexists(enrollment_key, self._COMPLETE_FIELD)
+        enrollment_cache_size = await self._redis.hlen(enrollment_key)
+        config_cache = await self._redis.get(self._config_cache_key(tenant_id))
+        enrollment_ttl = await self._redis.ttl(enrollment_key)
+        config_ttl = await self._redis.ttl(self._config_cache_key(tenant_id))
         return {
             "tenant_id": tenant_id,
-            "enrollment_cache_exists": enrollment_cache is not None,
+            "enrollment_cache_exists": bool(enrollment_cache),
+            "enrollment_cache_size": max(enrollment_cache_size - 1, 0) if enrollment_cache else 0,
             "enrollment_cache_ttl": enrollment_ttl if enrollment_ttl > 0 else None,
             "config_cache_exists": config_cache is not None,
             "config_cache_ttl": config_ttl if config_ttl > 0 else None,
-            "connection_pool_active": tenant_id in self._tenant_pools,
+            "connection_pool_active": self._pools.has_tenant(tenant_id),
+            "gallery_index_loaded": tenant_id in self._galleries,
+            "gallery_index_size": len(self._galleries.peek(tenant_id)) if tenant_id in self._galleries else 0,
+            "gallery_ann_active": tenant_id in self._galleries and self._galleries.peek(tenant_id).ann is not None,
+            "gallery_index_bytes": self._galleries.peek(tenant_id).nbytes if tenant_id in self._galleries else 0,
+            "gallery_index_version": self._gallery_versions.get(tenant_id),
+            "enrollment_version": self._bus.latest(tenant_id, SCOPE_ENROLLMENTS),
+            "config_version": self._bus.latest(tenant_id, SCOPE_CONFIG),
         }
 
 
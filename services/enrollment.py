@@ -6,11 +6,12 @@ Handles face enrollment and identification using dynamic tenant database connect
 
 from typing import Dict, List, Optional
 
-import numpy as np
 from fastapi import HTTPException, UploadFile
 
-from services import recognition
+from services import metrics, recognition, similarity
+from services.config import settings
 from services.database import tenant_manager
+from services.gallery import GalleryIndex, rescore
 
 
 def _ensure_single_face_encoding(encoding: List[float]) -> List[float]:
@@ -28,6 +29,7 @@ async def enroll_face(
     user_id: int,
     name: str,
     file: UploadFile,
+    det_size: Optional[int] = None,
 ) -> Dict[str, object]:
     """
     Enroll a new face for a user in a tenant database.
@@ -37,10 +39,12 @@ async def enroll_face(
         user_id: User ID in tenant database (references user_{tenant_id}.id)
         name: Label/name for this enrollment
         file: Image file containing the face
+        det_size: Optional detector input size override
         
     Returns:
         Dict with enrollment details and count
     """
+    metrics.set_tenant(tenant_id)
     if not name:
         raise HTTPException(status_code=400, detail="Name is required")
     
@@ -50,7 +54,8 @@ async def enroll_face(
         raise HTTPException(status_code=404, detail=f"Tenant {tenant_id} not found")
     
     # Encode face from image
-    encoding = await recognition.encode_image(file)
+    pipeline = await recognition.ImagePipeline.from_upload(file, det_size)
+    encoding = await pipeline.encode()
     validated_encoding = _ensure_single_face_encoding(encoding)
     
     # Store in tenant database
@@ -61,20 +66,117 @@ async def enroll_face(
         face_encoding=validated_encoding,
     )
     
-    # Get updated count
-    enrollments = await tenant_manager.get_enrollments(tenant_id)
-    
     return {
         "stored": result,
-        "count": len(enrollments),
+        "count": await tenant_manager.get_enrollment_count(tenant_id),
         "tenant_id": tenant_id,
     }
 
 
+def _validate_top_k(top_k: int) -> None:
+    if top_k < 1 or top_k > settings.IDENTIFY_MAX_TOP_K:
+        raise HTTPException(
+            status_code=400,
+            detail=f"top_k must be between 1 and {settings.IDENTIFY_MAX_TOP_K}",
+        )
+
+
+async def _searchable_gallery(tenant_id: int) -> GalleryIndex:
+    """Resident gallery index for a tenant; 400/404 if there is nothing to search."""
+    with metrics.stage("gallery_fetch"):
+        gallery = await tenant_manager.get_gallery(tenant_id)
+    
+    if len(gallery) == 0:
+        if gallery.skipped:
+            raise HTTPException(
+                status_code=400,
+                detail="No compatible enrollments. Re-enroll faces using current model (512-d).",
+            )
+        raise HTTPException(
+            status_code=404,
+            detail=f"No enrollments available for tenant {tenant_id}"
+        )
+    return gallery
+
+
+_SHORTLIST_GONE = "Enrollments changed during the search; retry"
+
+
+async def _rescored(
+    tenant_id: int,
+    gallery: GalleryIndex,
+    probes: List,
+    k: int,
+) -> List[List[Dict[str, object]]]:
+    """
+    The k closest enrollments per probe from a compressed gallery.
+    
+    The gallery only holds approximate codes: each probe's shortlist is
+    re-scored against the stored embeddings (enrollment hash, else the
+    table), fetched for all probes at once. Match decisions are only made
+    on these distances; a probe whose whole shortlist was deleted meanwhile
+    gets an empty list.
+    """
+    with metrics.stage("search"):
+        shortlists = await gallery.guard.run(lambda: [gallery.shortlist(probe, k) for probe in probes])
+    ids = sorted({candidate["id"] for shortlist in shortlists for candidate in shortlist})
+    with metrics.stage("rescore"):
+        vectors = await tenant_manager.get_exact_embeddings(tenant_id, ids)
+        return [rescore(probe, shortlist, vectors, k) for probe, shortlist in zip(probes, shortlists)]
+
+
+async def _identify_result(
+    tenant_id: int,
+    gallery: GalleryIndex,
+    encoding,
+    threshold: float,
+    top_k: int,
+) -> Dict[str, object]:
+    """Match one probe embedding against a gallery (scanned in a worker thread)."""
+    if gallery.approximate:
+        ranked = (await _rescored(tenant_id, gallery, [encoding], top_k))[0]
+        if not ranked:
+            raise HTTPException(status_code=503, detail=_SHORTLIST_GONE)
+        best_match = ranked[0]
+        candidates = [c for c in ranked if c["distance"] <= threshold]
+    # Single matrix-vector product over the whole gallery
+    elif top_k == 1:
+        with metrics.stage("search"):
+            best_match = await gallery.guard.run(gallery.search, encoding)
+        candidates = [best_match] if best_match["distance"] <= threshold else []
+    else:
+        with metrics.stage("search"):
+            ranked = await gallery.guard.run(gallery.search_top_k, encoding, top_k)
+        best_match = ranked[0]
+        candidates = [c for c in ranked if c["distance"] <= threshold]
+    best_distance = best_match["distance"]
+    
+    return {
+        "match": best_distance <= threshold,
+        "name": best_match["label"],
+        "user_id": best_match["user_id"],
+        "enrollment_id": best_match["id"],
+        "distance": best_distance,
+        "threshold": threshold,
+        "count": len(gallery),
+        "candidates": [
+            {
+                "name": c["label"],
+                "user_id": c["user_id"],
+                "enrollment_id": c["id"],
+                "distance": c["distance"],
+            }
+            for c in candidates
+        ],
+    }
+
+
 async def identify_face(
     tenant_id: int,
     file: UploadFile,
     threshold: float = recognition.DEFAULT_THRESHOLD,
+    top_k: int = 1,
+    det_size: Optional[int] = None,
 ) -> Dict[str, object]:
     """
     Identify a face against all enrollments in a tenant database.
@@ -83,61 +185,125 @@ async def identify_face(
         tenant_id: Tenant identifier
         file: Image file containing the face to identify
         threshold: Maximum distance threshold for a match
+        top_k: Number of ranked candidates to return
+        det_size: Optional detector input size override
         
     Returns:
-        Dict with match result, name, distance, and bounding box
+        Dict with match result, name, distance, bounding box and the ranked
+        candidates within threshold
     """
-    # Get enrollments from cache/database
-    enrollments = await tenant_manager.get_enrollments(tenant_id)
+    metrics.set_tenant(tenant_id)
+    _validate_top_k(top_k)
     
-    if not enrollments:
-        raise HTTPException(
-            status_code=404,
-            detail=f"No enrollments available for tenant {tenant_id}"
-        )
+    # Get resident gallery index (built from cache/database on first use)
+    gallery = await _searchable_gallery(tenant_id)
     
     # Encode the input face
-    encoding, bbox = await recognition.encode_image_with_box(file)
-    source = np.array(encoding, dtype=float)
+    pipeline = await recognition.ImagePipeline.from_upload(file, det_size)
+    encoding = await pipeline.encode()
     
-    best_match: Optional[Dict] = None
-    best_distance: float = float("inf")
-    skipped = 0
+    result = await _identify_result(tenant_id, gallery, encoding, threshold, top_k)
+    result["bbox"] = pipeline.bbox
+    result["tenant_id"] = tenant_id
+    return result
+
+
+async def identify_embedding(
+    tenant_id: int,
+    embedding: bytes,
+    threshold: float = recognition.DEFAULT_THRESHOLD,
+    top_k: int = 1,
+) -> Dict[str, object]:
+    """
+    Identify a precomputed embedding against a tenant's enrollments.
     
-    for enrollment in enrollments:
-        target = np.array(enrollment["encoding"], dtype=float)
-        
-        if len(target) != len(source):
-            skipped += 1
-            continue
-        
-        # Cosine distance
-        distance = float(1.0 - float(np.dot(source, target)))
+    Skips decoding and the model entirely; only the gallery search runs.
+    
+    Args:
+        tenant_id: Tenant identifier
+        embedding: 512 little-endian float32 (or float16) values
+        threshold: Maximum distance threshold for a match
+        top_k: Number of ranked candidates to return
         
-        if distance < best_distance:
-            best_distance = distance
-            best_match = enrollment
+    Returns:
+        Same fields as identify_face, without a bounding box
+    """
+    metrics.set_tenant(tenant_id)
+    _validate_top_k(top_k)
+    probe = recognition.parse_embedding(embedding)
+    gallery = await _searchable_gallery(tenant_id)
+    
+    result = await _identify_result(tenant_id, gallery, probe, threshold, top_k)
+    result["tenant_id"] = tenant_id
+    return result
+
+
+async def identify_faces_batch(
+    tenant_id: int,
+    files: List[UploadFile],
+    threshold: float = recognition.DEFAULT_THRESHOLD,
+    det_size: Optional[int] = None,
+) -> Dict[str, object]:
+    """
+    Identify many face images against a tenant's enrollments in one call.
     
-    if best_distance == float("inf"):
-        if skipped:
-            raise HTTPException(
-                status_code=400,
-                detail="No compatible enrollments. Re-enroll faces using current model (512-d).",
-            )
+    All probe embeddings are scored against the gallery with a single
+    N x M matrix multiply.
+    
+    Args:
+        tenant_id: Tenant identifier
+        files: Image files, each containing a face to identify
+        threshold: Maximum distance threshold for a match
+        det_size: Optional detector input size override
+        
+    Returns:
+        Dict with one result per image, in the order the images were sent
+    """
+    metrics.set_tenant(tenant_id)
+    if not files:
+        raise HTTPException(status_code=400, detail="At least one image is required")
+    if len(files) > settings.IDENTIFY_BATCH_MAX_IMAGES:
         raise HTTPException(
-            status_code=404,
-            detail=f"No enrollments available for tenant {tenant_id}"
+            status_code=400,
+            detail=f"Too many images; maximum is {settings.IDENTIFY_BATCH_MAX_IMAGES} per request",
         )
     
+    gallery = await _searchable_gallery(tenant_id)
+    
+    encoded = await recognition.encode_images_with_boxes(files, det_size)
+    probe_rows = [i for i, item in enumerate(encoded) if "encoding" in item]
+    probes = [encoded[i]["encoding"] for i in probe_rows]
+    if not probes:
+        matches = []
+    elif gallery.approximate:
+        matches = [ranked[0] if ranked else None for ranked in await _rescored(tenant_id, gallery, probes, 1)]
+    else:
+        with metrics.stage("search"):
+            matches = await gallery.guard.run(gallery.search_batch, probes)
+    
+    # Images without a usable face keep their error entry
+    results: List[Dict[str, object]] = [
+        {"index": i, "match": False, "error": item.get("error")}
+        for i, item in enumerate(encoded)
+    ]
+    for i, best_match in zip(probe_rows, matches):
+        if best_match is None:
+            results[i]["error"] = _SHORTLIST_GONE
+            continue
+        results[i] = {
+            "index": i,
+            "match": best_match["distance"] <= threshold,
+            "name": best_match["label"],
+            "user_id": best_match["user_id"],
+            "enrollment_id": best_match["id"],
+            "distance": best_match["distance"],
+            "bbox": encoded[i]["bbox"],
+        }
+    
     return {
-        "match": best_distance <= threshold,
-        "name": best_match["label"] if best_match else None,
-        "user_id": best_match["user_id"] if best_match else None,
-        "enrollment_id": best_match["id"] if best_match else None,
-        "distance": best_distance,
+        "results": results,
         "threshold": threshold,
-        "count": len(enrollments),
-        "bbox": bbox,
+        "count": len(gallery),
         "tenant_id": tenant_id,
     }
 
@@ -149,6 +315,7 @@ async def verify_user(
     threshold: float = recognition.DEFAULT_THRESHOLD,
     min_face_ratio: float = 0.15,  # Minimum face width as ratio of frame width
     min_det_score: float = 0.7,    # Minimum detection score
+    det_size: Optional[int] = None,
 ) -> Dict[str, object]:
     """
     Verify if the face in the image matches a specific user's enrollment.
@@ -164,10 +331,12 @@ async def verify_user(
         threshold: Maximum distance threshold for a match
         min_face_ratio: Minimum face width as ratio of frame (0.15 = 15%)
         min_det_score: Minimum face detection score (0.0-1.0)
+        det_size: Optional detector input size override
         
     Returns:
         Dict with verification result and liveness info
     """
+    metrics.set_tenant(tenant_id)
     # Validate tenant exists
     config = await tenant_manager.get_tenant_config(tenant_id)
     if not config:
@@ -186,9 +355,10 @@ async def verify_user(
             "liveness": None,
         }
     
-    # Read image data first to get dimensions
-    data = await file.read()
-    if not data:
+    # Read and decode the upload once; the frame size and the embedding
+    # both come from the same decoded image
+    pipeline = await recognition.ImagePipeline.from_upload(file, det_size)
+    if pipeline.empty:
         return {
             "success": False,
             "verified": False,
@@ -198,11 +368,7 @@ async def verify_user(
             "liveness": None,
         }
     
-    # Decode image to get frame dimensions
-    import cv2
-    arr = np.frombuffer(data, dtype=np.uint8)
-    image = cv2.imdecode(arr, cv2.IMREAD_COLOR)
-    if image is None:
+    if pipeline.try_decode() is None:
         return {
             "success": False,
             "verified": False,
@@ -212,12 +378,10 @@ async def verify_user(
             "liveness": None,
         }
     
-    frame_height, frame_width = image.shape[:2]
+    frame_height, frame_width = pipeline.height, pipeline.width
     
-    # Reset file position and encode face
-    await file.seek(0)
     try:
-        encoding, bbox = await recognition.encode_image_with_box(file)
+        encoding = await pipeline.encode()
     except HTTPException as e:
         return {
             "success": False,
@@ -227,6 +391,7 @@ async def verify_user(
             "user_id": user_id,
             "liveness": {"face_detected": False},
         }
+    bbox = pipeline.bbox
     
     # =========================================
     # Liveness Check #1: Face Size
@@ -287,11 +452,10 @@ async def verify_user(
     # =========================================
     # Face Matching
     # =========================================
-    source = np.array(encoding, dtype=float)
-    target = np.array(enrollment["encoding"], dtype=float)
+    target = similarity.as_vector(enrollment["encoding"])
     
     # Check encoding compatibility
-    if len(target) != len(source):
+    if len(target) != len(encoding):
         return {
             "success": False,
             "verified": False,
@@ -302,7 +466,7 @@ async def verify_user(
         }
     
     # Calculate cosine distance
-    distance = float(1.0 - float(np.dot(source, target)))
+    distance = similarity.cosine_distance(encoding, target)
     is_match = distance <= threshold
     
     return {
@@ -359,11 +523,9 @@ async def delete_enrollment(tenant_id: int, enrollment_id: int) -> Dict[str, obj
     if not deleted:
         raise HTTPException(status_code=404, detail="Enrollment not found")
     
-    enrollments = await tenant_manager.get_enrollments(tenant_id)
-    
     return {
         "deleted": enrollment_id,
-        "count": len(enrollments),
+        "count": await tenant_manager.get_enrollment_count(tenant_id),
         "tenant_id": tenant_id,
     }
 
@@ -384,10 +546,8 @@ async def delete_enrollment_by_name(tenant_id: int, name: str) -> Dict[str, obje
     if not deleted:
         raise HTTPException(status_code=404, detail="Enrollment not found")
     
-    enrollments = await tenant_manager.get_enrollments(tenant_id)
-    
     return {
         "deleted": name,
-        "count": len(enrollments),
+        "count": await tenant_manager.get_enrollment_count(tenant_id),
         "tenant_id": tenant_id,
     }
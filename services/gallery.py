@@ -0,0 +1,497 @@
+"""
+In-process per-tenant gallery index.
+
+Holds a tenant's enrollments as one contiguous float32 matrix plus parallel
+id/user_id/label arrays so identification is a single matrix-vector product
+instead of a Python loop over JSON-decoded lists. Scoring goes through the
+kernels in services.similarity, which also provides the compressed codes
+(float16, int8, PQ) used for memory-constrained nodes.
+"""
+
+import asyncio
+import time
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple, TypeVar
+
+import numpy as np
+
+from services.similarity import (
+    EMBEDDING_DIM,
+    PQCodes,
+    as_vector,
+    distances,
+    distances_batch,
+    make_codes,
+    rerank,
+    top_k_rows,
+)
+
+if TYPE_CHECKING:
+    from services.ann import IVFIndex
+
+# Enrollments appended (and encoded) per block when building an index
+_BUILD_BATCH = 4096
+
+T = TypeVar("T")
+
+
+def _training_sample(enrollments: List[Dict[str, Any]], dim: int, size: int = 8192, seed: int = 0) -> np.ndarray:
+    """Up to `size` randomly chosen enrollment vectors (PQ codebook training)."""
+    rows = []
+    for i in np.random.default_rng(seed).permutation(len(enrollments)):
+        vector = as_vector(enrollments[i]["encoding"])
+        if vector.shape[0] == dim:
+            rows.append(vector)
+            if len(rows) == size:
+                break
+    return np.stack(rows) if rows else np.empty((0, dim), dtype=np.float32)
+
+
+class SearchGuard:
+    """
+    Runs searches of one gallery in worker threads while its mutations stay
+    on the event loop.
+
+    Any number of searches may run at once. A mutation first awaits idle(),
+    which holds back new searches until the running ones are done, and then
+    applies its change before its next await, so no thread ever reads rows
+    being moved.
+    """
+
+    def __init__(self):
+        self._searches = 0
+        self._mutations = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._open = asyncio.Event()
+        self._open.set()
+
+    async def run(self, search: Callable[..., T], *args) -> T:
+        """search(*args) in a worker thread."""
+        while self._mutations:
+            await self._open.wait()
+        self._searches += 1
+        self._idle.clear()
+        future = asyncio.ensure_future(asyncio.to_thread(search, *args))
+        future.add_done_callback(self._search_done)
+        # Shielded: a cancelled caller must not let a mutation in while the
+        # thread is still reading
+        return await asyncio.shield(future)
+
+    def _search_done(self, future: asyncio.Future) -> None:
+        if not future.cancelled():
+            future.exception()  # retrieved by the caller, unless it was cancelled
+        self._searches -= 1
+        if not self._searches:
+            self._idle.set()
+
+    async def idle(self) -> None:
+        """Wait until no search is running; mutate before the next await."""
+        self._mutations += 1
+        self._open.clear()
+        try:
+            while self._searches:
+                await self._idle.wait()
+        finally:
+            self._mutations -= 1
+            if not self._mutations:
+                self._open.set()
+
+
+class GalleryIndex:
+    """
+    Contiguous embedding matrix for one tenant.
+
+    Rows are stored in a preallocated buffer that grows geometrically, so
+    enrollments can be appended and removed in place without rebuilding.
+    Removal swaps the last row into the freed slot (row order is not stable).
+    
+    An optional IVF index (services.ann) can be attached for large galleries;
+    searches then only score the rows of the closest inverted lists.
+    
+    With codes (float16, int8 or PQ, see services.similarity) searches scan
+    the compressed rows and keep the `rerank` best (at least k). With
+    keep_float32 the float32 matrix stays resident and those rows are
+    re-scored exactly here. Without it only the codes are held and searches
+    return approximate distances; callers re-score the shortlist() against
+    exact vectors kept elsewhere (see rescore()).
+
+    Searches are read-only and may run in worker threads through `guard`;
+    mutations must await guard.idle() first (see SearchGuard).
+    """
+
+    def __init__(
+        self,
+        dim: int = EMBEDDING_DIM,
+        capacity: int = 64,
+        codes=None,
+        rerank: int = 0,
+        keep_float32: bool = True,
+    ):
+        self.dim = dim
+        self._matrix: Optional[np.ndarray] = (
+            np.empty((capacity, dim), dtype=np.float32) if codes is None or keep_float32 else None
+        )
+        self._ids = np.empty(capacity, dtype=np.int64)
+        self._user_ids = np.empty(capacity, dtype=np.int64)
+        self._labels: List[str] = []
+        self._created_at: List[Optional[str]] = []
+        self._size = 0
+        self.skipped = 0  # records ignored because of dimension mismatch
+        self.built_at = time.monotonic()
+        self.ann: Optional["IVFIndex"] = None
+        self.codes = codes
+        self.rerank = rerank
+        self.guard = SearchGuard()
+
+    @classmethod
+    def from_enrollments(
+        cls,
+        enrollments: List[Dict[str, Any]],
+        dim: int = EMBEDDING_DIM,
+        compression: Optional[str] = None,
+        rerank: int = 0,
+        keep_float32: bool = True,
+        pq_subspaces: int = 128,
+        reuse: Optional[Tuple[PQCodes, np.ndarray]] = None,
+    ) -> "GalleryIndex":
+        """
+        Build an index from enrollment records as returned by TenantManager.
+
+        compression selects the codes ("float16", "int8", "pq"; None keeps
+        plain float32). PQ codebooks are trained on the enrollments unless
+        `reuse` passes a previous index's PQ codes and enrollment ids: its
+        codebooks are kept and rows of known enrollments are copied instead
+        of encoded again.
+        """
+        capacity = max(len(enrollments), 64)
+        codes = None
+        if compression:
+            training = None
+            if compression == "pq" and reuse is None:
+                training = _training_sample(enrollments, dim)
+            codebooks = (reuse[0].codebooks, reuse[0].trained_size) if reuse is not None else None
+            codes = make_codes(compression, dim, capacity, training, pq_subspaces, codebooks)
+        index = cls(dim=dim, capacity=capacity, codes=codes, rerank=rerank, keep_float32=keep_float32)
+        known = None
+        if reuse is not None and isinstance(codes, PQCodes):
+            known = (reuse[0], {int(enrollment_id): row for row, enrollment_id in enumerate(reuse[1])})
+        for start in range(0, len(enrollments), _BUILD_BATCH):
+            index.extend(enrollments[start:start + _BUILD_BATCH], known)
+        return index
+
+    def extend(
+        self,
+        records: List[Dict[str, Any]],
+        reuse: Optional[Tuple[PQCodes, Dict[int, int]]] = None,
+    ) -> int:
+        """
+        Append enrollment records in bulk (no replace_user); returns the rows added.
+
+        Codes are encoded for the whole block at once (one PQ pass per
+        subspace). With reuse (PQ codes sharing this index's codebooks and
+        their enrollment id -> row map), rows of known enrollments are
+        copied instead of encoded.
+        """
+        vectors = []
+        for rec in records:
+            vector = as_vector(rec["encoding"])
+            if vector.shape[0] != self.dim:
+                self.skipped += 1
+                continue
+            if self._size == self._ids.shape[0]:
+                self._grow()
+            row = self._size
+            self._ids[row] = rec["id"]
+            self._user_ids[row] = rec["user_id"]
+            self._labels.append(rec["label"])
+            self._created_at.append(rec.get("created_at"))
+            self._size += 1
+            vectors.append(vector)
+        if not vectors:
+            return 0
+        first = self._size - len(vectors)
+        block = np.stack(vectors)
+        if self._matrix is not None:
+            self._matrix[first:self._size] = block
+        if self.codes is not None:
+            self._encode(first, block, reuse)
+        if self.ann is not None:
+            for i, vector in enumerate(block):
+                self.ann.add(first + i, vector)
+        return len(vectors)
+
+    def _encode(self, first: int, block: np.ndarray, reuse: Optional[Tuple[PQCodes, Dict[int, int]]]) -> None:
+        rows = np.arange(first, first + block.shape[0])
+        copied = np.zeros(rows.shape[0], dtype=bool)
+        if reuse is not None:
+            source, known = reuse
+            copied = np.array([int(self._ids[row]) in known for row in rows], dtype=bool)
+        if not copied.any():
+            self.codes.set(first, block)
+            return
+        # Same codebooks: take the codes of enrollments the previous index held
+        self.codes.copy_rows(rows[copied], source, [known[int(self._ids[row])] for row in rows[copied]])
+        if not copied.all():
+            self.codes.set_rows(rows[~copied], block[~copied])
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """
+        View of the populated (N x dim) rows.
+
+        An index holding only codes returns a decoded (approximate) copy,
+        e.g. for IVF centroid training.
+        """
+        if self._matrix is None:
+            return self.codes.decode(np.arange(self._size))
+        return self._matrix[: self._size]
+
+    @property
+    def approximate(self) -> bool:
+        """True if searches return approximate distances (codes without a float32 copy)."""
+        return self._matrix is None
+
+    @property
+    def ids(self) -> np.ndarray:
+        return self._ids[: self._size]
+
+    @property
+    def user_ids(self) -> np.ndarray:
+        return self._user_ids[: self._size]
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory held by the index (allocated capacity)."""
+        labels = sum(len(label) for label in self._labels) + 64 * len(self._labels)
+        matrix = self._matrix.nbytes if self._matrix is not None else 0
+        codes = self.codes.nbytes if self.codes is not None else 0
+        return matrix + codes + self._ids.nbytes + self._user_ids.nbytes + labels
+
+    def age(self) -> float:
+        """Seconds since the index was built."""
+        return time.monotonic() - self.built_at
+
+    def record(self, row: int) -> Dict[str, Any]:
+        """Return the enrollment metadata stored at a row."""
+        return {
+            "id": int(self._ids[row]),
+            "user_id": int(self._user_ids[row]),
+            "label": self._labels[row],
+            "created_at": self._created_at[row],
+        }
+
+    def _grow(self) -> None:
+        capacity = max(self._ids.shape[0] * 2, 64)
+        if self._matrix is not None:
+            matrix = np.empty((capacity, self.dim), dtype=np.float32)
+            matrix[: self._size] = self._matrix[: self._size]
+            self._matrix = matrix
+        ids = np.empty(capacity, dtype=np.int64)
+        ids[: self._size] = self._ids[: self._size]
+        user_ids = np.empty(capacity, dtype=np.int64)
+        user_ids[: self._size] = self._user_ids[: self._size]
+        self._ids, self._user_ids = ids, user_ids
+        if self.codes is not None:
+            self.codes.grow(capacity)
+
+    def attach_ann(self, index: "IVFIndex") -> None:
+        """Attach an approximate index and populate it with the current rows."""
+        index.attach(self.matrix, self.ids)
+        self.ann = index
+
+    def _remove_row(self, row: int) -> None:
+        last = self._size - 1
+        if self.ann is not None:
+            self.ann.remove(row, last)
+        if row != last:
+            if self._matrix is not None:
+                self._matrix[row] = self._matrix[last]
+            if self.codes is not None:
+                self.codes.move(row, last)
+            self._ids[row] = self._ids[last]
+            self._user_ids[row] = self._user_ids[last]
+            self._labels[row] = self._labels[last]
+            self._created_at[row] = self._created_at[last]
+        self._labels.pop()
+        self._created_at.pop()
+        self._size = last
+
+    def upsert(
+        self,
+        enrollment_id: int,
+        user_id: int,
+        label: str,
+        encoding,
+        created_at: Optional[str] = None,
+        replace_user: bool = True,
+    ) -> bool:
+        """
+        Add an enrollment row.
+
+        With replace_user, existing rows for the same user_id are removed
+        first, mirroring the one-enrollment-per-user rule of add_enrollment.
+        Returns False if the encoding has the wrong dimension.
+        """
+        vector = np.asarray(encoding, dtype=np.float32).reshape(-1)
+        if vector.shape[0] != self.dim:
+            self.skipped += 1
+            return False
+
+        if replace_user:
+            self.remove_user(user_id)
+
+        if self._size == self._ids.shape[0]:
+            self._grow()
+        row = self._size
+        if self._matrix is not None:
+            self._matrix[row] = vector
+        if self.codes is not None:
+            self.codes.set(row, vector)
+        self._ids[row] = enrollment_id
+        self._user_ids[row] = user_id
+        self._labels.append(label)
+        self._created_at.append(created_at)
+        self._size += 1
+        if self.ann is not None:
+            self.ann.add(row, vector)
+        return True
+
+    def remove_id(self, enrollment_id: int) -> bool:
+        """Remove the row with the given enrollment id."""
+        rows = np.flatnonzero(self.ids == enrollment_id)
+        for row in rows[::-1]:
+            self._remove_row(int(row))
+        return len(rows) > 0
+
+    def remove_user(self, user_id: int) -> int:
+        """Remove all rows for a user_id; returns the number removed."""
+        rows = np.flatnonzero(self.user_ids == user_id)
+        for row in rows[::-1]:
+            self._remove_row(int(row))
+        return len(rows)
+
+    def remove_label(self, label: str) -> int:
+        """Remove all rows with the given label; returns the number removed."""
+        rows = [i for i, value in enumerate(self._labels) if value == label]
+        for row in reversed(rows):
+            self._remove_row(row)
+        return len(rows)
+
+    def distances(self, probe: np.ndarray) -> np.ndarray:
+        """Cosine distances from an L2-normalized probe to every row (approximate for codes only)."""
+        if self._matrix is None:
+            return self.codes.distances(probe, self._size)
+        return distances(self.matrix, probe)
+
+    def _scored_rows(self, probe, k: int = 1) -> Tuple[Optional[np.ndarray], np.ndarray]:
+        """
+        Distances to the rows worth scoring for a probe.
+
+        Returns (None, distances to all rows) for exact search, or
+        (candidate rows, their distances) when an ANN index is attached or
+        a scan of the codes preselected the rows to re-rank.
+        """
+        probe = as_vector(probe)
+        if self.ann is not None:
+            rows = self.ann.candidates(probe)
+            if rows.shape[0]:
+                if self.codes is None:
+                    return rows, rerank(self.matrix, rows, probe)
+                return self._refine(rows, self.codes.distances_rows(probe, rows), probe, k)
+        if self.codes is not None:
+            return self._refine(None, self.codes.distances(probe, self._size), probe, k)
+        return None, self.distances(probe)
+
+    def _refine(self, rows: Optional[np.ndarray], approx: np.ndarray, probe: np.ndarray, k: int):
+        """Keep the `rerank` (at least k) best approximate rows; re-score them if float32 is resident."""
+        keep = top_k_rows(approx, max(k, self.rerank))
+        rows = keep if rows is None else rows[keep]
+        if self._matrix is None:
+            return rows, approx[keep]
+        return rows, rerank(self.matrix, rows, probe)
+
+    def _matches(self, rows: Optional[np.ndarray], dists: np.ndarray, order) -> List[Dict[str, Any]]:
+        matches = []
+        for i in order:
+            match = self.record(int(i) if rows is None else int(rows[i]))
+            match["distance"] = float(dists[i])
+            matches.append(match)
+        return matches
+
+    def search(self, probe) -> Optional[Dict[str, Any]]:
+        """
+        Find the closest enrollment to a probe embedding.
+
+        Returns the enrollment record with its cosine distance, or None when
+        the gallery is empty.
+        """
+        if self._size == 0:
+            return None
+        rows, dists = self._scored_rows(probe)
+        return self._matches(rows, dists, [int(np.argmin(dists))])[0]
+
+    def search_top_k(self, probe, k: int) -> List[Dict[str, Any]]:
+        """
+        Find the k closest enrollments to a probe, nearest first.
+
+        Uses np.argpartition to select the k best rows in O(N) and only sorts
+        those k.
+        """
+        if self._size == 0 or k <= 0:
+            return []
+        rows, dists = self._scored_rows(probe, k)
+        return self._matches(rows, dists, top_k_rows(dists, k))
+
+    def shortlist(self, probe, k: int) -> List[Dict[str, Any]]:
+        """
+        Candidates for the k closest enrollments, nearest first.
+
+        For an approximate index these are the `rerank` (at least k) best
+        rows by approximate distance, to be passed to rescore() with the
+        exact vectors; otherwise the same as search_top_k().
+        """
+        if not self.approximate:
+            return self.search_top_k(probe, k)
+        return self.search_top_k(probe, max(k, self.rerank))
+
+    def search_batch(self, probes) -> List[Optional[Dict[str, Any]]]:
+        """
+        Find the closest enrollment for each of several probes.
+
+        Scores all probes against the gallery with one (N x dim) @ (dim x M)
+        matrix multiply. Returns one match per probe, in order.
+        """
+        probes = np.asarray(probes, dtype=np.float32).reshape(-1, self.dim)
+        if self._size == 0:
+            return [None] * probes.shape[0]
+        if self.ann is not None or self.codes is not None:
+            # Each probe visits its own inverted lists / re-rank candidates
+            return [self.search(probe) for probe in probes]
+        dists = distances_batch(self.matrix, probes)
+        rows = np.argmin(dists, axis=1)
+        return [self._matches(None, dists[i], [row])[0] for i, row in enumerate(rows)]
+
+
+def rescore(
+    probe,
+    candidates: List[Dict[str, Any]],
+    vectors: Dict[int, np.ndarray],
+    k: int,
+) -> List[Dict[str, Any]]:
+    """
+    The k closest of a shortlist, nearest first.
+
+    Every candidate is re-scored against its vector in `vectors`.
+    Candidates without one (deleted since the shortlist was taken) are left
+    out rather than ranked on an approximate distance, so fewer than k, or
+    none, may be returned.
+    """
+    known = [c for c in candidates if c["id"] in vectors]
+    if known:
+        exact = distances(np.stack([as_vector(vectors[c["id"]]) for c in known]), probe)
+        for candidate, distance in zip(known, exact):
+            candidate["distance"] = float(distance)
+    return sorted(known, key=lambda c: c["distance"])[:k]
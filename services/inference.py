@@ -0,0 +1,224 @@
+"""
+Dedicated inference scheduler with micro-batching.
+
+Model calls no longer go to the default executor (unbounded threads sharing
+one model). Requests are put on a bounded queue served by a fixed number of
+worker threads. Each worker collects the jobs that arrive within a short
+window, up to a maximum batch size, and runs them through the model in one
+call, so the recognition ONNX model sees whole batches.
+
+With INFERENCE_MODE=process the batches are executed by a pool of model
+processes (services.process_pool) instead of in the worker threads.
+"""
+
+import asyncio
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from fastapi import HTTPException
+
+from services import insight as insight_backend
+from services.config import settings
+
+# A batch function takes a list of inputs and returns one result per input
+BatchFunc = Callable[[Sequence[Any]], List[Any]]
+
+
+@dataclass
+class _Job:
+    func: BatchFunc
+    arg: Any
+    future: asyncio.Future
+    loop: asyncio.AbstractEventLoop
+
+
+_STOP = object()
+
+
+def _resolve(job: _Job, result: Any = None, error: Optional[BaseException] = None) -> None:
+    """Complete a job's future from a worker thread."""
+    def _set() -> None:
+        if job.future.done():
+            return
+        if error is not None:
+            job.future.set_exception(error)
+        else:
+            job.future.set_result(result)
+    job.loop.call_soon_threadsafe(_set)
+
+
+class InferenceScheduler:
+    """
+    Bounded queue + fixed worker pool that micro-batches model calls.
+
+    Jobs submitted with the same batch function within batch_window_ms of
+    each other (up to max_batch) are executed together in one call.
+    """
+
+    def __init__(self, workers: int, queue_size: int, max_batch: int, batch_window_ms: float):
+        self.workers = max(1, workers)
+        self.max_batch = max(1, max_batch)
+        self.batch_window = max(0.0, batch_window_ms) / 1000.0
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=max(1, queue_size))
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def start(self) -> None:
+        """Start worker threads (idempotent)."""
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker, name=f"inference-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Stop worker threads after they finish their current batch."""
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(_STOP)
+        for thread in threads:
+            thread.join(timeout)
+
+    async def submit(self, func: BatchFunc, arg: Any) -> Any:
+        """
+        Queue one input for a batch function and wait for its result.
+
+        Raises HTTPException 503 when the queue is full so overload is shed
+        instead of piling up unbounded work.
+        """
+        self.start()
+        loop = asyncio.get_running_loop()
+        job = _Job(func=func, arg=arg, future=loop.create_future(), loop=loop)
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            raise HTTPException(status_code=503, detail="Inference queue is full, retry later")
+        return await job.future
+
+    def _collect(self, first: _Job) -> Tuple[List[_Job], List[Any]]:
+        """Gather jobs for the same function within the batch window."""
+        batch = [first]
+        leftovers: List[Any] = []
+        deadline = time.perf_counter() + self.batch_window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _STOP or item.func is not first.func:
+                leftovers.append(item)
+                break
+            batch.append(item)
+        return batch, leftovers
+
+    def _run(self, batch: List[_Job]) -> None:
+        try:
+            results = batch[0].func([job.arg for job in batch])
+        except Exception as exc:  # propagate to every waiting request
+            for job in batch:
+                _resolve(job, error=exc)
+            return
+        for job, result in zip(batch, results):
+            _resolve(job, result=result)
+
+    def _worker(self) -> None:
+        pending: List[Any] = []
+        while True:
+            item = pending.pop(0) if pending else self._queue.get()
+            if item is _STOP:
+                return
+            batch, leftovers = self._collect(item)
+            self._run(batch)
+            pending.extend(leftovers)
+
+
+if settings.INFERENCE_MODE == "process":
+    from services.process_pool import process_pool
+
+    _encode_impl = process_pool.encode_faces
+    _detect_impl = process_pool.detect_faces_batch
+    # One dispatching thread per model process
+    _workers = process_pool.processes
+else:
+    process_pool = None
+    _encode_impl = insight_backend.encode_faces
+    _detect_impl = insight_backend.detect_faces_batch
+    _workers = settings.INFERENCE_WORKERS
+
+
+# Scheduler jobs are (image, det_size) pairs
+def _encode_batch(jobs: Sequence[Tuple[np.ndarray, Optional[int]]]) -> List[Any]:
+    return _encode_impl([image for image, _ in jobs], [det_size for _, det_size in jobs])
+
+
+def _detect_batch(jobs: Sequence[Tuple[np.ndarray, Optional[int]]]) -> List[Any]:
+    return _detect_impl([image for image, _ in jobs], [det_size for _, det_size in jobs])
+
+
+scheduler = InferenceScheduler(
+    workers=_workers,
+    queue_size=settings.INFERENCE_QUEUE_SIZE,
+    max_batch=settings.INFERENCE_MAX_BATCH,
+    batch_window_ms=settings.INFERENCE_BATCH_WINDOW_MS,
+)
+
+
+_ready = False
+
+
+def is_ready() -> bool:
+    """True once warm_up() has completed."""
+    return _ready
+
+
+async def warm_up() -> None:
+    """Load the model(s) and run a dummy inference without blocking the event loop."""
+    global _ready
+    if process_pool is not None:
+        await asyncio.to_thread(process_pool.warm_up)
+    else:
+        await asyncio.to_thread(insight_backend.warm_up)
+    scheduler.start()
+    _ready = True
+
+
+def shutdown() -> None:
+    """Stop scheduler workers and model processes."""
+    scheduler.stop()
+    if process_pool is not None:
+        process_pool.stop()
+
+
+async def encode(image: np.ndarray, det_size: Optional[int] = None) -> Tuple[np.ndarray, Dict[str, object]]:
+    """Encode the largest face in an image; raises ValueError if none found."""
+    result = await scheduler.submit(_encode_batch, (image, det_size))
+    if result is None:
+        raise ValueError("No face detected")
+    return result
+
+
+async def encode_many(
+    images: Sequence[np.ndarray],
+    det_size: Optional[int] = None,
+) -> List[Optional[Tuple[np.ndarray, Dict[str, object]]]]:
+    """Encode several images; None for images without a face."""
+    return list(await asyncio.gather(*(scheduler.submit(_encode_batch, (image, det_size)) for image in images)))
+
+
+async def detect(image: np.ndarray, det_size: Optional[int] = None) -> Dict[str, object]:
+    """Detect all faces in an image; returns {"faces": [...], "det_size": ...}."""
+    return await scheduler.submit(_detect_batch, (image, det_size))
@@ -0,0 +1,152 @@
+"""
+Upload ingestion.
+
+Uploads are checked before their bytes are copied anywhere: the size
+reported by the multipart parser is compared against MAX_UPLOAD_BYTES and
+the first bytes are sniffed for a supported image signature, so oversized
+or non-image parts are rejected without being buffered. Accepted uploads
+are copied chunk by chunk from Starlette's spooled file into a pooled,
+preallocated bytearray, and the decoder gets a memoryview over it (no
+bytes object the size of the whole image).
+"""
+
+import threading
+from typing import Dict, List, Optional
+
+from fastapi import HTTPException, UploadFile
+
+from services.config import settings
+
+# Leading bytes of the image formats cv2.imdecode is used for
+_SIGNATURES = (
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"BM", "bmp"),
+)
+_SNIFF_BYTES = 12
+# Uploads are copied into the pooled buffer in chunks of this size
+_READ_CHUNK_BYTES = 256 * 1024
+
+
+def sniff_image_type(head: bytes) -> Optional[str]:
+    """Image format from the first bytes of a file, or None if not supported."""
+    for signature, kind in _SIGNATURES:
+        if head.startswith(signature):
+            return kind
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+class BufferPool:
+    """
+    Reusable upload buffers, bucketed by power-of-two capacity.
+
+    Keeps at most max_pooled_bytes of idle buffers; anything beyond that is
+    left to the garbage collector. Thread-safe (buffers are released from
+    decode threads).
+    """
+
+    def __init__(self, max_pooled_bytes: int, min_capacity: int = 64 * 1024):
+        self.max_pooled_bytes = max_pooled_bytes
+        self.min_capacity = min_capacity
+        self._free: Dict[int, List[bytearray]] = {}
+        self._pooled_bytes = 0
+        self._lock = threading.Lock()
+
+    def _capacity(self, size: int) -> int:
+        capacity = self.min_capacity
+        while capacity < size:
+            capacity *= 2
+        return capacity
+
+    def acquire(self, size: int) -> bytearray:
+        """A buffer of at least size bytes (contents undefined)."""
+        capacity = self._capacity(size)
+        with self._lock:
+            free = self._free.get(capacity)
+            if free:
+                self._pooled_bytes -= capacity
+                return free.pop()
+        return bytearray(capacity)
+
+    def release(self, buffer: bytearray) -> None:
+        """Return a buffer obtained from acquire()."""
+        capacity = len(buffer)
+        with self._lock:
+            if self._pooled_bytes + capacity > self.max_pooled_bytes:
+                return
+            self._free.setdefault(capacity, []).append(buffer)
+            self._pooled_bytes += capacity
+
+
+buffer_pool = BufferPool(settings.UPLOAD_BUFFER_POOL_BYTES)
+
+
+class UploadBuffer:
+    """An upload's bytes in a pooled buffer; call release() once decoded."""
+
+    def __init__(self, buffer: Optional[bytearray], size: int):
+        self._buffer = buffer
+        self.size = size
+        self.view = memoryview(buffer)[:size] if buffer is not None else memoryview(b"")
+
+    def release(self) -> None:
+        if self._buffer is not None:
+            self.view.release()
+            self.view = memoryview(b"")
+            buffer_pool.release(self._buffer)
+            self._buffer = None
+
+
+def _upload_size(file: UploadFile) -> int:
+    if file.size is not None:
+        return file.size
+    # Size unknown (file not produced by the multipart parser): measure it
+    position = file.file.tell()
+    file.file.seek(0, 2)
+    size = file.file.tell() - position
+    file.file.seek(position)
+    return size
+
+
+async def _read_into(file: UploadFile, view: memoryview) -> int:
+    read = 0
+    while read < len(view):
+        chunk = await file.read(min(_READ_CHUNK_BYTES, len(view) - read))
+        if not chunk:
+            break
+        view[read:read + len(chunk)] = chunk
+        read += len(chunk)
+    return read
+
+
+async def read_upload(file: UploadFile) -> UploadBuffer:
+    """
+    Validate and read an upload into a pooled buffer.
+
+    Raises HTTP 413 if the upload exceeds MAX_UPLOAD_BYTES and HTTP 415 if
+    it is not a supported image (JPEG, PNG, WebP, BMP). An empty upload
+    yields an empty buffer so callers can report it their own way.
+    """
+    size = _upload_size(file)
+    if size > settings.MAX_UPLOAD_BYTES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Image too large; maximum is {settings.MAX_UPLOAD_BYTES} bytes",
+        )
+    if size == 0:
+        return UploadBuffer(None, 0)
+
+    head = await file.read(_SNIFF_BYTES)
+    if sniff_image_type(head) is None:
+        raise HTTPException(status_code=415, detail="Unsupported file type; expected a JPEG, PNG, WebP or BMP image")
+    await file.seek(0)
+
+    buffer = buffer_pool.acquire(size)
+    view = memoryview(buffer)[:size]
+    try:
+        read = await _read_into(file, view)
+    finally:
+        view.release()
+    return UploadBuffer(buffer, read)
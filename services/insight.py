@@ -1,17 +1,65 @@
 import math
-from typing import Dict, List, Tuple
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
 
 import cv2
 import insightface
 import numpy as np
+import onnxruntime
+from insightface.utils import face_align
+
+from services.config import settings
+from services import similarity
 
 # Lazy globals
 _model = None
+_model_lock = threading.Lock()
+
+
+def _intra_op_threads() -> int:
+    """ORT intra-op threads per session so all inference workers fit the cores."""
+    if settings.ORT_INTRA_OP_THREADS > 0:
+        return settings.ORT_INTRA_OP_THREADS
+    return max(1, (os.cpu_count() or 1) // max(1, settings.INFERENCE_WORKERS))
+
+
+def _pin_session_threads(model, threads: int) -> None:
+    """Recreate each model's ONNX session with a fixed intra-op thread count."""
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = threads
+    options.inter_op_num_threads = 1
+    for sub_model in model.models.values():
+        providers = sub_model.session.get_providers()
+        sub_model.session = onnxruntime.InferenceSession(
+            sub_model.model_file, sess_options=options, providers=providers
+        )
+
+
+def has_cuda() -> bool:
+    """True if this ONNX Runtime build can run on a CUDA GPU."""
+    return "CUDAExecutionProvider" in onnxruntime.get_available_providers()
 
 
 def _prepare_model(ctx_id: int):
-    model = insightface.app.FaceAnalysis(name="buffalo_l")
-    model.prepare(ctx_id=ctx_id, det_size=(640, 640))
+    if ctx_id >= 0:
+        providers = ["CUDAExecutionProvider", "CPUExecutionProvider"]
+    else:
+        providers = ["CPUExecutionProvider"]
+    # Only load the modules we use; buffalo_l also ships 2D/3D landmark and
+    # gender-age networks that FaceAnalysis.get() would otherwise run per face
+    model = insightface.app.FaceAnalysis(
+        name="buffalo_l",
+        allowed_modules=settings.INSIGHTFACE_MODULES,
+        providers=providers,
+    )
+    # The detector graph has a dynamic input shape, so one prepared session
+    # serves every size in DET_SIZES (passed per call to detect())
+    largest = max(settings.DET_SIZES)
+    model.prepare(ctx_id=ctx_id, det_size=(largest, largest))
+    if ctx_id < 0:
+        _pin_session_threads(model, _intra_op_threads())
     return model
 
 
@@ -19,55 +67,188 @@ def _ensure_model():
     global _model
     if _model is not None:
         return
-    try:
-        _model = _prepare_model(ctx_id=0)  # try GPU first
-    except Exception:
-        _model = _prepare_model(ctx_id=-1)  # fallback to CPU
+    with _model_lock:  # several inference workers may race on first use
+        if _model is not None:
+            return
+        if not has_cuda():
+            # CPU-only build: skip the GPU probe entirely
+            _model = _prepare_model(ctx_id=-1)
+            return
+        try:
+            _model = _prepare_model(ctx_id=0)  # try GPU first
+        except Exception:
+            _model = _prepare_model(ctx_id=-1)  # fallback to CPU
 
 
-def detect_faces(image: np.ndarray) -> List[Dict[str, object]]:
+def warm_up() -> None:
+    """
+    Load the model and run one dummy inference through every session.
+    
+    ONNX Runtime allocates buffers and picks kernels on the first run, so
+    doing it at startup keeps that cost off the first real request.
+    """
     _ensure_model()
-    faces = _model.get(image)
+    det_size = getattr(_model.det_model, "input_size", None) or (640, 640)
+    _model.det_model.detect(np.zeros((det_size[1], det_size[0], 3), dtype=np.uint8), max_num=0, metric="default")
+    rec_model = _model.models.get("recognition")
+    if rec_model is not None:
+        size = rec_model.input_size[0]
+        rec_model.get_feat([np.zeros((size, size, 3), dtype=np.uint8)])
+
+
+def _det_sizes(det_size: Optional[int]) -> List[int]:
+    """Detector resolutions to try, in order, for one image."""
+    if det_size:
+        return [det_size]
+    sizes = sorted(settings.DET_SIZES)
+    if settings.DET_SIZE_STRATEGY == "adaptive":
+        return sizes
+    return [sizes[-1]]
+
+
+def _detect(image: np.ndarray, det_size: Optional[int] = None) -> Tuple[np.ndarray, Optional[np.ndarray], int]:
+    """
+    Run the detector, returning (bboxes, kpss, detector size used).
+    
+    With the adaptive strategy the smallest size is tried first; larger
+    sizes are only used when no face reaches DET_ADAPTIVE_MIN_SCORE.
+    """
+    sizes = _det_sizes(det_size)
+    for size in sizes:
+        bboxes, kpss = _model.det_model.detect(image, input_size=(size, size), max_num=0, metric="default")
+        if bboxes.shape[0] and float(bboxes[:, 4].max()) >= settings.DET_ADAPTIVE_MIN_SCORE:
+            break
+    return bboxes, kpss, size
+
+
+def detect_faces(image: np.ndarray, det_size: Optional[int] = None) -> Dict[str, object]:
+    """
+    Detect faces with the detection model only (no recognition).
+    
+    Returns {"faces": [...], "det_size": detector size used, "timings":
+    {"detect": seconds}}.
+    """
+    _ensure_model()
+    start = time.perf_counter()
+    bboxes, kpss, used_size = _detect(image, det_size)
+    detect_seconds = time.perf_counter() - start
     results: List[Dict[str, object]] = []
-    for f in faces:
-        box = f.bbox.astype(int).tolist()
+    for i in range(bboxes.shape[0]):
+        box = bboxes[i, :4].astype(int).tolist()
         results.append(
             {
                 "bbox": {"left": box[0], "top": box[1], "right": box[2], "bottom": box[3]},
-                "kps": f.kps.astype(float).tolist(),
-                "det_score": float(f.det_score),
+                "kps": kpss[i].astype(float).tolist() if kpss is not None else [],
+                "det_score": float(bboxes[i, 4]),
             }
         )
-    return results
+    return {"faces": results, "det_size": used_size, "timings": {"detect": detect_seconds}}
+
+
+def detect_faces_batch(
+    images: Sequence[np.ndarray],
+    det_sizes: Optional[Sequence[Optional[int]]] = None,
+) -> List[Dict[str, object]]:
+    """detect_faces() for several images (batch interface for the scheduler)."""
+    det_sizes = det_sizes or [None] * len(images)
+    return [detect_faces(image, det_size) for image, det_size in zip(images, det_sizes)]
 
 
 def encode_face(image: np.ndarray) -> Tuple[List[float], Dict[str, object]]:
-    _ensure_model()
-    faces = _model.get(image)
-    if len(faces) == 0:
+    result = encode_faces([image])[0]
+    if result is None:
         raise ValueError("No face detected")
-    # pick largest face
-    faces = sorted(faces, key=lambda f: (f.bbox[2] - f.bbox[0]) * (f.bbox[3] - f.bbox[1]), reverse=True)
-    face = faces[0]
-    emb = face.normed_embedding  # already L2-normalized
-    meta = {
-        "bbox": face.bbox.astype(int).tolist(),
-        "kps": face.kps.astype(float).tolist(),
-        "det_score": float(face.det_score),
-    }
+    emb, meta = result  # already L2-normalized
     return emb.astype(float).tolist(), meta
 
 
+def encode_faces(
+    images: Sequence[np.ndarray],
+    det_sizes: Optional[Sequence[Optional[int]]] = None,
+) -> List[Optional[Tuple[np.ndarray, Dict[str, object]]]]:
+    """
+    Encode the largest face of each image, batching the recognition model.
+    
+    Detection runs per image (at det_sizes[i], or per DET_SIZE_STRATEGY when
+    None); the aligned crops of all images then go through the recognition
+    ONNX model in a single forward pass. Returns one entry per image:
+    (L2-normalized float32 embedding, meta) or None if no face found.
+    meta["timings"] holds the image's detection time and the time of the
+    shared recognition pass, in seconds.
+    """
+    _ensure_model()
+    rec_model = _model.models.get("recognition")
+    if rec_model is None:
+        raise RuntimeError("Recognition module is not loaded; add 'recognition' to INSIGHTFACE_MODULES")
+    crops: List[np.ndarray] = []
+    owners: List[int] = []
+    metas: List[Optional[Dict[str, object]]] = [None] * len(images)
+    
+    det_sizes = det_sizes or [None] * len(images)
+    for i, (image, det_size) in enumerate(zip(images, det_sizes)):
+        start = time.perf_counter()
+        bboxes, kpss, used_size = _detect(image, det_size)
+        detect_seconds = time.perf_counter() - start
+        if bboxes.shape[0] == 0 or kpss is None:
+            continue
+        areas = (bboxes[:, 2] - bboxes[:, 0]) * (bboxes[:, 3] - bboxes[:, 1])
+        j = int(np.argmax(areas))
+        crops.append(face_align.norm_crop(image, landmark=kpss[j], image_size=rec_model.input_size[0]))
+        owners.append(i)
+        metas[i] = {
+            "bbox": bboxes[j, :4].astype(int).tolist(),
+            "kps": kpss[j].astype(float).tolist(),
+            "det_score": float(bboxes[j, 4]),
+            "det_size": used_size,
+            "timings": {"detect": detect_seconds},
+        }
+    
+    results: List[Optional[Tuple[np.ndarray, Dict[str, object]]]] = [None] * len(images)
+    if not crops:
+        return results
+    
+    start = time.perf_counter()
+    feats = np.asarray(rec_model.get_feat(crops), dtype=np.float32)
+    feats /= np.linalg.norm(feats, axis=1, keepdims=True)
+    embed_seconds = time.perf_counter() - start
+    for k, i in enumerate(owners):
+        metas[i]["timings"]["embed"] = embed_seconds
+        results[i] = (feats[k], metas[i])
+    return results
+
+
 def cosine_distance(a: np.ndarray, b: np.ndarray) -> float:
     # embeddings are normalized; cosine distance = 1 - cos_sim
-    return float(1.0 - np.dot(a, b))
+    return similarity.cosine_distance(a, b)
 
 
-def best_match(source_emb: List[float], gallery: List[Dict[str, object]]) -> Dict[str, object]:
-    src = np.array(source_emb, dtype=float)
-    best = {"name": None, "distance": math.inf}
-    for rec in gallery:
-        dist = cosine_distance(src, np.array(rec["encoding"], dtype=float))
-        if dist < best["distance"]:
-            best = {"name": rec["name"], "distance": dist}
+def best_match(
+    source_emb: List[float],
+    gallery: List[Dict[str, object]],
+    top_k: int = 1,
+    threshold: Optional[float] = None,
+) -> Dict[str, object]:
+    """
+    Find the closest gallery records to an embedding.
+    
+    Scores the whole gallery with one matrix-vector product and selects the
+    top_k with partial selection. "name"/"distance" describe the best record;
+    "candidates" lists up to top_k records (nearest first), dropping those
+    farther than threshold when one is given.
+    """
+    best = {"name": None, "distance": math.inf, "candidates": []}
+    if not gallery:
+        return best
+    matrix = np.empty((len(gallery), len(gallery[0]["encoding"])), dtype=np.float32)
+    for row, rec in enumerate(gallery):
+        matrix[row] = rec["encoding"]
+    dists = similarity.distances(matrix, source_emb)
+    rows = similarity.top_k_rows(dists, max(top_k, 1))
+    best["name"] = gallery[rows[0]]["name"]
+    best["distance"] = float(dists[rows[0]])
+    best["candidates"] = [
+        {"name": gallery[row]["name"], "distance": float(dists[row])}
+        for row in rows[:top_k]
+        if threshold is None or dists[row] <= threshold
+    ]
     return best
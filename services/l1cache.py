@@ -0,0 +1,136 @@
+"""
+In-process L1 cache in front of Redis.
+
+An LRU map bounded by an approximate memory budget rather than an entry
+count: each entry is stored with its size in bytes and least recently used
+entries are evicted until the total fits. Entries may also carry a TTL.
+Only used from the event loop, so no locking.
+"""
+
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterator, Optional, Tuple
+
+
+class _Entry:
+    __slots__ = ("value", "nbytes", "expires_at")
+
+    def __init__(self, value: Any, nbytes: int, expires_at: Optional[float]):
+        self.value = value
+        self.nbytes = nbytes
+        self.expires_at = expires_at
+
+
+class L1Cache:
+    """Byte-budgeted LRU cache with per-entry TTL and hit/miss/eviction counters."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.rejected = 0  # entries larger than the whole budget
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.peek(key) is not None
+
+    def _expired(self, entry: _Entry) -> bool:
+        return entry.expires_at is not None and entry.expires_at <= time.monotonic()
+
+    def peek(self, key: Hashable) -> Optional[Any]:
+        """Value for key without touching LRU order or counters."""
+        entry = self._entries.get(key)
+        if entry is None or self._expired(entry):
+            return None
+        return entry.value
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Value for key (marking it most recently used), or None."""
+        entry = self._entries.get(key)
+        if entry is not None and self._expired(entry):
+            self._remove(key)
+            self.expirations += 1
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry.value
+
+    def put(self, key: Hashable, value: Any, nbytes: int, ttl: Optional[float] = None) -> None:
+        """Insert or replace an entry, evicting LRU entries to stay within budget."""
+        self._remove(key)
+        if nbytes > self.max_bytes:
+            self.rejected += 1
+            return
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        self._entries[key] = _Entry(value, nbytes, expires_at)
+        self._bytes += nbytes
+        self._evict()
+
+    def resize(self, key: Hashable, nbytes: int) -> None:
+        """Update the size of an entry mutated in place."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return
+        self._bytes += nbytes - entry.nbytes
+        entry.nbytes = nbytes
+        self._entries.move_to_end(key)
+        if nbytes > self.max_bytes:
+            self._remove(key)
+            self.rejected += 1
+        self._evict()
+
+    def pop(self, key: Hashable) -> Optional[Any]:
+        entry = self._remove(key)
+        return entry.value if entry is not None else None
+
+    def discard_where(self, predicate: Callable[[Hashable], bool]) -> int:
+        """Remove every entry whose key matches; returns the number removed."""
+        keys = [key for key in self._entries if predicate(key)]
+        for key in keys:
+            self._remove(key)
+        return len(keys)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._bytes = 0
+
+    def keys(self) -> Iterator[Hashable]:
+        return iter(list(self._entries))
+
+    def items(self) -> Iterator[Tuple[Hashable, Any]]:
+        return iter([(key, entry.value) for key, entry in self._entries.items()])
+
+    def _remove(self, key: Hashable) -> Optional[_Entry]:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.nbytes
+        return entry
+
+    def _evict(self) -> None:
+        while self._bytes > self.max_bytes and self._entries:
+            _, entry = self._entries.popitem(last=False)
+            self._bytes -= entry.nbytes
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "rejected": self.rejected,
+        }
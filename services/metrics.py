@@ -0,0 +1,239 @@
+"""
+Prometheus metrics.
+
+A small dependency-free implementation of the Prometheus text exposition
+format (histograms and callback gauges), served at GET /metrics.
+
+Per-stage latencies go to one histogram, face_stage_seconds, labelled by
+stage, endpoint and tenant. The endpoint and tenant of the current request
+live in a context variable set by the HTTP middleware (endpoint = route
+template, e.g. "/enrollments/{tenant_id}") and by the service functions
+once the tenant is known (set_tenant), so deep code such as TenantManager
+can time itself with stage() without passing labels around.
+
+Tenant ids are bounded by METRICS_MAX_TENANTS: once that many tenants have
+been seen, further tenants are reported as "other".
+
+Stage durations are also summed per request, for the Server-Timing header.
+"""
+
+import contextvars
+import functools
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from services.config import settings
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by label values."""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str], buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [bucket counts..., sum, count]
+        self._series: Dict[LabelValues, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def collect(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            snapshot = {labels: list(series) for labels, series in self._series.items()}
+        names = self.labelnames + ("le",)
+        for labels, series in sorted(snapshot.items()):
+            cumulative = 0.0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                yield f"{self.name}_bucket{_format_labels(names, labels + (_format_value(bound),))} {cumulative:g}"
+            yield f"{self.name}_bucket{_format_labels(names, labels + ('+Inf',))} {series[-1]:g}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(series[-2])}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {series[-1]:g}"
+
+
+class CallbackGauge:
+    """Gauge whose samples are read from a callback at scrape time."""
+
+    def __init__(self, name: str, documentation: str, callback: Callable[[], float], kind: str = "gauge"):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        self.kind = kind
+
+    def collect(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+        yield f"{self.name} {_format_value(self.callback())}"
+
+
+_registry: List[Any] = []
+
+
+def register(metric: Any) -> Any:
+    _registry.append(metric)
+    return metric
+
+
+def render() -> str:
+    """All registered metrics in the Prometheus text format."""
+    lines: List[str] = []
+    for metric in _registry:
+        try:
+            lines.extend(metric.collect())
+        except Exception:
+            # A failing gauge callback must not break the whole scrape
+            continue
+    return "\n".join(lines) + "\n"
+
+
+# ---- request labels ------------------------------------------------------
+
+class _RequestLabels:
+    """Mutable per-request labels (shared by the tasks a request spawns)."""
+
+    __slots__ = ("endpoint", "tenant", "timings")
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.tenant = ""
+        # stage -> seconds spent in this request
+        self.timings: Dict[str, float] = {}
+
+
+_labels: contextvars.ContextVar[Optional[_RequestLabels]] = contextvars.ContextVar("metrics_labels", default=None)
+_known_tenants: set = set()
+
+
+def start_request(endpoint: str) -> _RequestLabels:
+    """Called by the HTTP middleware for every request."""
+    labels = _RequestLabels(endpoint)
+    _labels.set(labels)
+    return labels
+
+
+def tenant_label(tenant_id: Any) -> str:
+    """Tenant label value under the cardinality guard."""
+    tenant = str(tenant_id)
+    if tenant in _known_tenants:
+        return tenant
+    if len(_known_tenants) < settings.METRICS_MAX_TENANTS:
+        _known_tenants.add(tenant)
+        return tenant
+    return "other"
+
+
+def set_tenant(tenant_id: Any) -> None:
+    """Attach the tenant to the current request's metrics."""
+    labels = _labels.get()
+    if labels is not None:
+        labels.tenant = tenant_label(tenant_id)
+
+
+def _current() -> Tuple[str, str]:
+    labels = _labels.get()
+    if labels is None:
+        return "", ""
+    return labels.endpoint, labels.tenant
+
+
+# ---- stage timing --------------------------------------------------------
+
+stage_seconds = register(Histogram(
+    "face_stage_seconds",
+    "Time spent per pipeline stage.",
+    ("stage", "endpoint", "tenant"),
+))
+request_seconds = register(Histogram(
+    "face_request_seconds",
+    "HTTP request latency.",
+    ("endpoint", "tenant"),
+))
+
+
+def observe_stage(stage: str, seconds: float) -> None:
+    labels = _labels.get()
+    if labels is not None:
+        labels.timings[stage] = labels.timings.get(stage, 0.0) + seconds
+    if settings.METRICS_ENABLED:
+        stage_seconds.observe(seconds, stage, *_current())
+
+
+def observe_request(seconds: float) -> None:
+    if settings.METRICS_ENABLED:
+        request_seconds.observe(seconds, *_current())
+
+
+@contextmanager
+def stage(name: str):
+    """Time a block as one pipeline stage of the current request."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - start)
+
+
+def timed(name: str):
+    """Decorator: time an async function as one pipeline stage."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with stage(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def observe_timings(timings: Optional[Dict[str, float]]) -> None:
+    """Record stage timings measured elsewhere (e.g. inside the model batch)."""
+    for name, seconds in (timings or {}).items():
+        observe_stage(name, seconds)
+
+
+def server_timing(labels: _RequestLabels, total: Optional[float] = None) -> str:
+    """Server-Timing header value (milliseconds) for a request's stages."""
+    entries = [f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in labels.timings.items()]
+    if total is not None:
+        entries.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(entries)
+
+
+def gauge(name: str, documentation: str, callback: Callable[[], float]) -> CallbackGauge:
+    return register(CallbackGauge(name, documentation, callback))
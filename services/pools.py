@@ -0,0 +1,250 @@
+"""
+Tenant database connection pools.
+
+Tenant databases mostly live on a handful of MySQL servers, so instead of
+one pool per tenant the registry keeps one pool per server login (host,
+port, user) and points each connection at the tenant's database with
+select_db (COM_INIT_DB) when it is handed out. Consecutive uses of a
+connection by the same tenant skip that round trip. Each tenant may hold at
+most tenant_size of its server pool's connections at once, so one slow
+tenant cannot starve the others sharing the server.
+
+Pool creation is single-flight per server key, so concurrent first requests
+(e.g. right after a deploy) share one pool instead of each creating and
+leaking their own. The registry enforces a global connection budget (the
+sum of the pools' maxsize, including pools still being created): creating
+a pool beyond it first closes least recently used idle pools.
+
+A background task closes pools that have been idle longer than
+DB_POOL_IDLE_TIMEOUT and pings one free connection of every pool, dropping
+pools whose server stopped answering (they are recreated on next use).
+"""
+
+import asyncio
+import hashlib
+import logging
+import time
+import weakref
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Set, Tuple
+
+import aiomysql
+
+from services.singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# (host, port, user, password digest): connections are interchangeable
+# within a key; a changed password gets a new pool
+ServerKey = Tuple[str, int, str, str]
+
+
+class PoolBudgetExhausted(Exception):
+    """No pool can be created without exceeding the global connection budget."""
+
+
+def _password_digest(password: str) -> str:
+    # Keeps plaintext passwords out of the registry keys (logged, listed)
+    return hashlib.sha256(password.encode()).hexdigest()
+
+
+@dataclass
+class _ServerPool:
+    pool: aiomysql.Pool
+    last_used: float
+
+
+class TenantPoolRegistry:
+    """Shared, budgeted and health-checked MySQL pools for tenant databases."""
+
+    def __init__(
+        self,
+        pool_size: int,
+        max_connections: int,
+        idle_timeout: float,
+        health_interval: float,
+        recycle: int,
+        tenant_size: Optional[int] = None,
+    ):
+        self.pool_size = max(1, pool_size)
+        self.tenant_size = max(1, min(tenant_size or self.pool_size, self.pool_size))
+        self.max_connections = max(self.pool_size, max_connections)
+        self.idle_timeout = idle_timeout
+        self.health_interval = health_interval
+        self.recycle = recycle
+        self._servers: "OrderedDict[ServerKey, _ServerPool]" = OrderedDict()
+        # tenant_id -> (server, database)
+        self._tenants: Dict[int, Tuple[ServerKey, str]] = {}
+        # tenant_id -> connections it may still take from its server pool
+        self._limits: Dict[int, asyncio.Semaphore] = {}
+        # Database each pooled connection currently has selected
+        self._selected: "weakref.WeakKeyDictionary[Any, str]" = weakref.WeakKeyDictionary()
+        self._task: Optional[asyncio.Task] = None
+        self._creating = SingleFlight()
+        # Serializes budget checks; connections reserved by pools being created
+        self._budget_lock = asyncio.Lock()
+        self._reserved = 0
+
+    # ---- lifecycle -------------------------------------------------------
+
+    def start(self) -> None:
+        """Start the idle/health maintenance task (idempotent)."""
+        if self.health_interval > 0 and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._maintain(), name="tenant-pool-maintenance")
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for key in list(self._servers):
+            await self._close(key)
+        self._tenants.clear()
+        self._limits.clear()
+
+    # ---- tenants ---------------------------------------------------------
+
+    def tenants(self) -> Set[int]:
+        return set(self._tenants)
+
+    def has_tenant(self, tenant_id: int) -> bool:
+        mapped = self._tenants.get(tenant_id)
+        return mapped is not None and mapped[0] in self._servers
+
+    async def register(self, tenant_id: int, host: str, port: int, user: str, password: str, database: str) -> None:
+        """Map a tenant to its server pool, creating the pool if needed."""
+        key: ServerKey = (host, port, user, _password_digest(password))
+        if key not in self._servers or self._servers[key].pool.closed:
+            await self._creating.do(key, lambda: self._create(key, password))
+        self._tenants[tenant_id] = (key, database)
+        if tenant_id not in self._limits:
+            self._limits[tenant_id] = asyncio.Semaphore(self.tenant_size)
+
+    async def forget(self, tenant_id: int) -> None:
+        """Drop a tenant's mapping (e.g. its config changed); closes the pool if no longer used."""
+        mapped = self._tenants.pop(tenant_id, None)
+        self._limits.pop(tenant_id, None)
+        if mapped is None:
+            return
+        key = mapped[0]
+        entry = self._servers.get(key)
+        still_used = any(server == key for server, _ in self._tenants.values())
+        if entry is not None and not still_used and self._idle(entry.pool):
+            await self._close(key)
+
+    @asynccontextmanager
+    async def connection(self, tenant_id: int):
+        """
+        Connection with the tenant's database selected; the tenant must be
+        registered. Waits while the tenant already holds tenant_size
+        connections.
+        """
+        key, database = self._tenants[tenant_id]
+        entry = self._servers[key]
+        entry.last_used = time.monotonic()
+        self._servers.move_to_end(key)
+        async with self._limits[tenant_id], entry.pool.acquire() as conn:
+            if self._selected.get(conn) != database:
+                await conn.select_db(database)
+                self._selected[conn] = database
+            yield conn
+
+    # ---- pools -----------------------------------------------------------
+
+    @staticmethod
+    def _idle(pool: aiomysql.Pool) -> bool:
+        return pool.size == pool.freesize
+
+    def _connections(self) -> int:
+        return sum(entry.pool.maxsize for entry in self._servers.values()) + self._reserved
+
+    async def _create(self, key: ServerKey, password: str) -> None:
+        """Create the pool for a server key; only called through _creating."""
+        async with self._budget_lock:
+            stale = self._servers.get(key)
+            if stale is not None:
+                await self._close(key)
+            # Make room under the budget by closing least recently used idle pools
+            for other in list(self._servers):
+                if self._connections() + self.pool_size <= self.max_connections:
+                    break
+                if self._idle(self._servers[other].pool):
+                    await self._close(other)
+            if self._connections() + self.pool_size > self.max_connections:
+                raise PoolBudgetExhausted(
+                    f"{self._connections()} of {self.max_connections} database connections in use"
+                )
+            self._reserved += self.pool_size
+
+        host, port, user, _ = key
+        try:
+            pool = await aiomysql.create_pool(
+                host=host,
+                port=port,
+                user=user,
+                password=password,
+                autocommit=True,
+                minsize=1,
+                maxsize=self.pool_size,
+                pool_recycle=self.recycle,
+            )
+        finally:
+            self._reserved -= self.pool_size
+        self._servers[key] = _ServerPool(pool=pool, last_used=time.monotonic())
+
+    async def _close(self, key: ServerKey) -> None:
+        entry = self._servers.pop(key, None)
+        for tenant_id in [t for t, (server, _) in self._tenants.items() if server == key]:
+            del self._tenants[tenant_id]
+            self._limits.pop(tenant_id, None)
+        if entry is None:
+            return
+        idle = self._idle(entry.pool)
+        entry.pool.close()
+        if idle:
+            await entry.pool.wait_closed()
+        # Otherwise connections in use are closed as they are released
+
+    async def check(self) -> None:
+        """Close idle pools past the idle timeout and pools that fail a ping."""
+        now = time.monotonic()
+        for key in list(self._servers):
+            entry = self._servers.get(key)
+            if entry is None:
+                continue
+            pool = entry.pool
+            if pool.closed:
+                await self._close(key)
+            elif self._idle(pool) and now - entry.last_used > self.idle_timeout:
+                await self._close(key)
+            elif pool.freesize:
+                try:
+                    async with pool.acquire() as conn:
+                        await asyncio.wait_for(conn.ping(reconnect=False), timeout=5)
+                except Exception as exc:
+                    logger.warning("Tenant pool %s:%s failed health check: %s", key[0], key[1], exc)
+                    await self._close(key)
+
+    async def _maintain(self) -> None:
+        while True:
+            await asyncio.sleep(self.health_interval)
+            try:
+                await self.check()
+            except Exception:
+                logger.exception("Tenant pool maintenance failed")
+
+    def stats(self) -> Dict[str, Any]:
+        pools = [entry.pool for entry in self._servers.values()]
+        return {
+            "pools": len(pools),
+            "tenants": len(self._tenants),
+            "connections": sum(pool.size for pool in pools),
+            "in_use": sum(pool.size - pool.freesize for pool in pools),
+            "max_connections": self.max_connections,
+            "tenant_limit": self.tenant_size,
+        }
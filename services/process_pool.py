@@ -0,0 +1,152 @@
+"""
+Multi-process model serving.
+
+With INFERENCE_MODE=process, model calls run in N worker processes, each
+holding its own FaceAnalysis model with ONNX Runtime intra-op threads pinned,
+so inference is not limited by one interpreter's GIL. The API process only
+does I/O and decoding: decoded images are handed over through shared memory
+(one memcpy, no pickling of pixel data) and only the small results
+(embeddings, boxes) travel back over the pipe.
+"""
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from services.config import settings
+
+# (shared memory name, shape, dtype string)
+ImageRef = Tuple[str, Tuple[int, ...], str]
+
+# Seconds warm_up waits for every worker to be spawned and load its model
+_WARM_UP_TIMEOUT = 600.0
+
+
+def _worker_init(threads: int) -> None:
+    """Process initializer: pin thread counts and load the model eagerly."""
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    import cv2
+
+    cv2.setNumThreads(1)
+    settings.ORT_INTRA_OP_THREADS = threads
+
+    from services import insight
+
+    insight._ensure_model()
+
+
+def _worker_run(func_name: str, refs: Sequence[ImageRef], det_sizes: Sequence[Optional[int]]) -> List[Any]:
+    """Run an insight batch function on images attached from shared memory."""
+    from services import insight
+
+    blocks = []
+    images = []
+    try:
+        for name, shape, dtype in refs:
+            # Spawned workers share the parent's resource tracker, which
+            # keeps a single registration per name; the parent unlinks it
+            block = SharedMemory(name=name)
+            blocks.append(block)
+            images.append(np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf))
+        return getattr(insight, func_name)(images, det_sizes)
+    finally:
+        del images
+        for block in blocks:
+            block.close()
+
+
+def _worker_warm_up(barrier) -> int:
+    """
+    Run a dummy inference in a worker process; returns its pid.
+
+    Waiting at the barrier first keeps this worker busy until every other
+    worker has picked up its own warm-up call, so no worker runs two.
+    """
+    from services import insight
+
+    barrier.wait(_WARM_UP_TIMEOUT)
+    insight.warm_up()
+    return os.getpid()
+
+
+class ProcessInferencePool:
+    """Pool of model-serving processes fed through shared memory."""
+
+    def __init__(self, processes: int, threads_per_process: int):
+        self.processes = max(1, processes)
+        self.threads_per_process = max(1, threads_per_process)
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def start(self) -> None:
+        """Spawn worker processes (idempotent)."""
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.processes,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_worker_init,
+                initargs=(self.threads_per_process,),
+            )
+
+    def stop(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def warm_up(self) -> None:
+        """Spawn every worker process and run a dummy inference in each (blocking)."""
+        self.start()
+        with multiprocessing.get_context("spawn").Manager() as manager:
+            barrier = manager.Barrier(self.processes)
+            futures = [self._executor.submit(_worker_warm_up, barrier) for _ in range(self.processes)]
+            pids = {future.result() for future in futures}
+        if len(pids) != self.processes:
+            raise RuntimeError(f"Warmed up {len(pids)} of {self.processes} inference processes")
+
+    def run_batch(
+        self,
+        func_name: str,
+        images: Sequence[np.ndarray],
+        det_sizes: Optional[Sequence[Optional[int]]] = None,
+    ) -> List[Any]:
+        """
+        Run an insight batch function in a worker process (blocking).
+
+        Each image is copied once into a shared memory block that lives only
+        for the duration of the call.
+        """
+        self.start()
+        blocks: List[SharedMemory] = []
+        try:
+            refs: List[ImageRef] = []
+            for image in images:
+                image = np.ascontiguousarray(image)
+                block = SharedMemory(create=True, size=max(image.nbytes, 1))
+                blocks.append(block)
+                np.ndarray(image.shape, dtype=image.dtype, buffer=block.buf)[...] = image
+                refs.append((block.name, image.shape, image.dtype.str))
+            det_sizes = list(det_sizes or [None] * len(refs))
+            return self._executor.submit(_worker_run, func_name, refs, det_sizes).result()
+        finally:
+            for block in blocks:
+                block.close()
+                block.unlink()
+
+    def encode_faces(self, images: Sequence[np.ndarray], det_sizes=None) -> List[Any]:
+        return self.run_batch("encode_faces", images, det_sizes)
+
+    def detect_faces_batch(self, images: Sequence[np.ndarray], det_sizes=None) -> List[Any]:
+        return self.run_batch("detect_faces_batch", images, det_sizes)
+
+
+def _default_threads(processes: int) -> int:
+    if settings.ORT_INTRA_OP_THREADS > 0:
+        return settings.ORT_INTRA_OP_THREADS
+    return max(1, (os.cpu_count() or 1) // processes)
+
+
+_processes = settings.INFERENCE_PROCESSES or (os.cpu_count() or 1)
+process_pool = ProcessInferencePool(_processes, _default_threads(_processes))
@@ -0,0 +1,184 @@
+"""
+Opt-in sampling profiler for live requests.
+
+With PROFILING_ENABLED, a PROFILING_SAMPLE_RATE fraction of requests, and
+any request whose X-Debug-Profile header equals PROFILING_SECRET, is
+profiled: while it runs, a background thread snapshots the Python stacks
+of every thread (sys._current_frames) every PROFILING_INTERVAL_MS. Nothing
+is sampled while no profiled request is in flight.
+
+Profiles are written to PROFILING_DIR in collapsed-stack format (one
+"frame;frame;frame count" line per distinct stack), which flamegraph.pl,
+speedscope and inferno read directly. Samples cover the whole process, so
+requests running concurrently with a profiled one show up in its profile;
+the event loop and model worker threads are labelled by thread name.
+"""
+
+import hmac
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from services.config import settings
+
+PROFILE_HEADER = "x-debug-profile"
+PROFILE_SUFFIX = ".folded"
+
+# Leaf frames of threads that are just waiting (executor/scheduler workers
+# blocked on a queue, the event loop in select); not recorded
+_IDLE_LEAVES = {
+    ("threading.py", "wait"),
+    ("queue.py", "get"),
+    ("selectors.py", "select"),
+    ("thread.py", "_worker"),  # concurrent.futures worker in SimpleQueue.get
+}
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class Capture:
+    """Stacks sampled while one request was in flight."""
+
+    def __init__(self):
+        self.stacks: Counter = Counter()
+        self.started = time.time()
+
+
+class SamplingProfiler:
+    """Samples all thread stacks while at least one capture is active."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._captures: List[Capture] = []
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def begin(self) -> Capture:
+        capture = Capture()
+        with self._lock:
+            self._captures.append(capture)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+                self._thread.start()
+        return capture
+
+    def end(self, capture: Capture) -> Capture:
+        with self._lock:
+            if capture in self._captures:
+                self._captures.remove(capture)
+        return capture
+
+    def _sample(self) -> Counter:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        own = threading.get_ident()
+        stacks: Counter = Counter()
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            leaf = (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name)
+            if leaf in _IDLE_LEAVES:
+                continue
+            frames = []
+            while frame is not None:
+                frames.append(_frame_label(frame))
+                frame = frame.f_back
+            frames.append(names.get(ident, f"thread-{ident}"))
+            stacks[";".join(reversed(frames))] += 1
+        return stacks
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                if not self._captures:
+                    self._thread = None
+                    return
+                captures = list(self._captures)
+            stacks = self._sample()
+            for capture in captures:
+                capture.stacks.update(stacks)
+            time.sleep(self.interval)
+
+
+profiler = SamplingProfiler(settings.PROFILING_INTERVAL_MS / 1000.0)
+
+
+def _directory() -> Path:
+    return Path(settings.PROFILING_DIR)
+
+
+def authorized(headers) -> bool:
+    """True if the request carries the profiling secret."""
+    secret = settings.PROFILING_SECRET
+    value = headers.get(PROFILE_HEADER)
+    return bool(secret) and value is not None and hmac.compare_digest(value.encode(), secret.encode())
+
+
+def should_profile(headers) -> bool:
+    if not settings.PROFILING_ENABLED:
+        return False
+    if authorized(headers):
+        return True
+    return settings.PROFILING_SAMPLE_RATE > 0 and random.random() < settings.PROFILING_SAMPLE_RATE
+
+
+def _slug(value: str) -> str:
+    return re.sub(r"[^A-Za-z0-9]+", "_", value).strip("_") or "root"
+
+
+def save(capture: Capture, endpoint: str, tenant: str, duration: float) -> Optional[str]:
+    """Write a capture as a collapsed-stack file; returns its name (None if nothing was sampled)."""
+    if not capture.stacks:
+        return None
+    directory = _directory()
+    directory.mkdir(parents=True, exist_ok=True)
+    stamp = time.strftime("%Y%m%dT%H%M%S", time.gmtime(capture.started))
+    name = (
+        f"{stamp}-{int(capture.started * 1000) % 1000:03d}-{_slug(endpoint)}"
+        f"-t{_slug(tenant or 'none')}-{int(duration * 1000)}ms{PROFILE_SUFFIX}"
+    )
+    lines = [f"{stack} {count}" for stack, count in capture.stacks.most_common()]
+    (directory / name).write_text("\n".join(lines) + "\n")
+    _prune(directory)
+    return name
+
+
+def _prune(directory: Path) -> None:
+    files = sorted(directory.glob(f"*{PROFILE_SUFFIX}"), key=lambda path: path.stat().st_mtime)
+    for path in files[: max(0, len(files) - settings.PROFILING_MAX_FILES)]:
+        try:
+            path.unlink()
+        except OSError:
+            pass
+
+
+def list_profiles() -> List[Dict[str, Any]]:
+    """Saved profiles, newest first."""
+    directory = _directory()
+    if not directory.is_dir():
+        return []
+    profiles = []
+    for path in directory.glob(f"*{PROFILE_SUFFIX}"):
+        stat = path.stat()
+        profiles.append({
+            "name": path.name,
+            "bytes": stat.st_size,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(stat.st_mtime)),
+        })
+    return sorted(profiles, key=lambda profile: profile["name"], reverse=True)
+
+
+def profile_path(name: str) -> Optional[Path]:
+    """Path of a saved profile, or None (also for names escaping PROFILING_DIR)."""
+    if Path(name).name != name or not name.endswith(PROFILE_SUFFIX):
+        return None
+    path = _directory() / name
+    return path if path.is_file() else None
@@ -1,11 +1,17 @@
 import asyncio
-from typing import Dict, List, Sequence
+import contextvars
+import struct
+from typing import Dict, List, Optional, Sequence, Tuple
 
 import cv2
 import numpy as np
 from fastapi import HTTPException, UploadFile
 
-from services import insight as insight_backend
+from services import inference, metrics, similarity
+from services.codec import decode_embedding
+from services.config import settings
+from services.gallery import EMBEDDING_DIM
+from services.ingest import UploadBuffer, read_upload
 
 # Cosine distance threshold for ArcFace embeddings (L2-normalized)
 DEFAULT_THRESHOLD = 0.35
@@ -13,16 +19,121 @@ DEFAULT_THRESHOLD = 0.35
 
 async def _run_in_thread(func, *args, **kwargs):
     loop = asyncio.get_running_loop()
-    return await loop.run_in_executor(None, lambda: func(*args, **kwargs))
+    # Carry the request's context (metrics labels) into the worker thread
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(None, lambda: context.run(func, *args, **kwargs))
 
 
-def _decode_image(data: bytes) -> np.ndarray:
-    """Decode raw bytes into BGR image for InsightFace."""
-    arr = np.frombuffer(data, dtype=np.uint8)
-    image = cv2.imdecode(arr, cv2.IMREAD_COLOR)
+# JPEG DCT scaling: decode straight to 1/8, 1/4 or 1/2 resolution
+_REDUCED_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+# Start-of-frame markers (baseline, progressive, ...) carrying the image size
+_JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def _jpeg_size(data: bytes) -> Optional[Tuple[int, int]]:
+    """(width, height) from a JPEG header without decoding, or None if not a JPEG."""
+    if len(data) < 4 or data[0] != 0xFF or data[1] != 0xD8:
+        return None
+    i = 2
+    n = len(data)
+    while i + 9 < n:
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:  # fill byte
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:  # standalone markers
+            i += 2
+            continue
+        (length,) = struct.unpack_from(">H", data, i + 2)
+        if marker in _JPEG_SOF:
+            height, width = struct.unpack_from(">HH", data, i + 5)
+            return (width, height) if width and height else None
+        if marker == 0xDA:  # start of scan without a frame header
+            return None
+        i += 2 + length
+    return None
+
+
+def _decode_scale(size: Optional[Tuple[int, int]], det_size: Optional[int]) -> int:
+    """Largest DCT scale factor that keeps the longer side above the decode floor."""
+    if not size or not settings.DECODE_REDUCED:
+        return 1
+    floor = max(settings.DECODE_MIN_SIDE, det_size or max(settings.DET_SIZES))
+    longest = max(size)
+    for factor, _ in _REDUCED_FLAGS:
+        if longest // factor >= floor:
+            return factor
+    return 1
+
+
+# (BGR image, scale factor of the decode, original (width, height))
+DecodedImage = Tuple[np.ndarray, int, Tuple[int, int]]
+
+
+def _try_decode_image(data: bytes, det_size: Optional[int] = None) -> Optional[DecodedImage]:
+    """
+    Decode raw bytes into a BGR image for InsightFace, None on failure.
+    
+    JPEGs larger than needed for detection are decoded directly at 1/2, 1/4
+    or 1/8 resolution, which skips most of the IDCT work and the full-size
+    pixel buffer.
+    """
+    if not data:
+        return None
+    size = _jpeg_size(data)
+    scale = _decode_scale(size, det_size)
+    flags = dict(_REDUCED_FLAGS).get(scale, cv2.IMREAD_COLOR)
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flags)
     if image is None:
+        return None
+    if scale == 1:
+        size = (image.shape[1], image.shape[0])
+    elif (image.shape[1] > image.shape[0]) != (size[0] > size[1]):
+        # imdecode applied an EXIF rotation; the header holds the stored size
+        size = (size[1], size[0])
+    return image, scale, size
+
+
+def _decode_image(data: bytes, det_size: Optional[int] = None) -> DecodedImage:
+    """_try_decode_image() raising HTTP 400 on failure."""
+    decoded = _try_decode_image(data, det_size)
+    if decoded is None:
         raise HTTPException(status_code=400, detail="Failed to decode image")
-    return image
+    return decoded
+
+
+def _scale_meta(meta: Dict[str, object], scale: int) -> Dict[str, object]:
+    """Map bbox/kps from a reduced decode back to original image coordinates."""
+    if scale == 1:
+        return meta
+    meta = dict(meta)
+    bbox = meta.get("bbox")
+    if isinstance(bbox, dict):
+        meta["bbox"] = {key: value * scale for key, value in bbox.items()}
+    elif bbox is not None:
+        meta["bbox"] = [value * scale for value in bbox]
+    if meta.get("kps") is not None:
+        meta["kps"] = [[x * scale, y * scale] for x, y in meta["kps"]]
+    return meta
+
+
+def _validate_det_size(det_size: Optional[int]) -> Optional[int]:
+    """Validate a per-request detector size override (None = use DET_SIZES)."""
+    if det_size is None:
+        return None
+    if det_size < 32 or det_size > settings.DET_SIZE_MAX or det_size % 32:
+        raise HTTPException(
+            status_code=400,
+            detail=f"det_size must be a multiple of 32 between 32 and {settings.DET_SIZE_MAX}",
+        )
+    return det_size
 
 
 def _bbox_from_meta(meta: Dict[str, object]) -> Dict[str, float]:
@@ -36,56 +147,240 @@ def _bbox_from_meta(meta: Dict[str, object]) -> Dict[str, float]:
         "right": float(right),
         "bottom": float(bottom),
         "det_score": float(meta.get("det_score", 0.0)) if isinstance(meta, dict) else 0.0,
+        "det_size": int(meta.get("det_size", 0)) if isinstance(meta, dict) else 0,
     }
 
 
-async def encode_image_with_box(file: UploadFile) -> tuple[List[float], Dict[str, float]]:
-    data = await file.read()
-    if not data:
-        raise HTTPException(status_code=400, detail="Image file is empty")
-    image = _decode_image(data)
-    try:
-        encoding, meta = await _run_in_thread(insight_backend.encode_face, image)
-    except ValueError as exc:
-        raise HTTPException(status_code=400, detail=str(exc)) from exc
-    bbox = _bbox_from_meta(meta)
-    return encoding, bbox
-
-
-async def encode_image(file: UploadFile) -> List[float]:
-    encoding, _ = await encode_image_with_box(file)
+class ImagePipeline:
+    """
+    One uploaded image flowing through the recognition stages.
+    
+    The upload is read once, decoded once, and the detection/embedding
+    results are kept on the object, so callers that need the frame size as
+    well as the embedding (e.g. verify) never re-read or re-decode the file.
+    
+    Large JPEGs are decoded at a reduced scale (see _decode_scale); width,
+    height and every returned box/landmark are in original image pixels.
+    
+    Uploads are read into a pooled buffer (services.ingest) that goes back
+    to the pool as soon as the image has been decoded.
+    """
+    
+    def __init__(
+        self,
+        data: bytes,
+        det_size: Optional[int] = None,
+        upload: Optional[UploadBuffer] = None,
+    ):
+        self.data = data
+        self.nbytes = len(data)
+        self.upload = upload
+        self.det_size = _validate_det_size(det_size)
+        self.image: Optional[np.ndarray] = None
+        self.scale = 1
+        self.frame_size: Optional[Tuple[int, int]] = None  # original (width, height)
+        self.encoding: Optional[np.ndarray] = None
+        self.meta: Dict[str, object] = {}
+    
+    @classmethod
+    async def from_upload(cls, file: UploadFile, det_size: Optional[int] = None) -> "ImagePipeline":
+        """Read an upload (once) into a new pipeline."""
+        det_size = _validate_det_size(det_size)
+        with metrics.stage("upload_read"):
+            upload = await read_upload(file)
+        return cls(upload.view, det_size, upload)
+    
+    @property
+    def empty(self) -> bool:
+        return self.nbytes == 0
+    
+    @property
+    def width(self) -> int:
+        self.decode()
+        return self.frame_size[0]
+    
+    @property
+    def height(self) -> int:
+        self.decode()
+        return self.frame_size[1]
+    
+    @property
+    def bbox(self) -> Dict[str, float]:
+        return _bbox_from_meta(self.meta)
+    
+    def _release(self) -> None:
+        """Drop the encoded bytes once decoding has been attempted."""
+        self.data = b""
+        if self.upload is not None:
+            self.upload.release()
+            self.upload = None
+    
+    def try_decode(self) -> Optional[np.ndarray]:
+        """Decode the image bytes (once); None if empty or undecodable."""
+        if self.image is None and self.data:
+            with metrics.stage("decode"):
+                decoded = _try_decode_image(self.data, self.det_size)
+            self._release()
+            if decoded is not None:
+                self.image, self.scale, self.frame_size = decoded
+        return self.image
+    
+    def decode(self) -> np.ndarray:
+        """Decode the image bytes (once); raises HTTP 400 on failure."""
+        if self.image is None:
+            if self.empty:
+                raise HTTPException(status_code=400, detail="Image file is empty")
+            try:
+                with metrics.stage("decode"):
+                    self.image, self.scale, self.frame_size = _decode_image(self.data, self.det_size)
+            finally:
+                self._release()
+        return self.image
+    
+    def set_encoding(self, encoding: np.ndarray, meta: Dict[str, object]) -> None:
+        meta = dict(meta)
+        metrics.observe_timings(meta.pop("timings", None))
+        self.encoding = encoding
+        self.meta = _scale_meta(meta, self.scale)
+    
+    async def encode(self) -> np.ndarray:
+        """Embed the largest face (cached); raises HTTP 400 if none is found."""
+        if self.encoding is None:
+            image = self.decode()
+            try:
+                with metrics.stage("inference"):
+                    encoding, meta = await inference.encode(image, self.det_size)
+            except ValueError as exc:
+                raise HTTPException(status_code=400, detail=str(exc)) from exc
+            self.set_encoding(encoding, meta)
+        return self.encoding
+    
+    async def detect(self) -> Dict[str, object]:
+        """Detect all faces; returns {"faces": [...], "det_size": ...}."""
+        image = self.decode()
+        with metrics.stage("inference"):
+            result = dict(await inference.detect(image, self.det_size))
+        metrics.observe_timings(result.pop("timings", None))
+        if self.scale > 1:
+            result = dict(result, faces=[_scale_meta(face, self.scale) for face in result["faces"]])
+        return result
+
+
+async def encode_image_with_box(
+    file: UploadFile, det_size: Optional[int] = None
+) -> tuple[List[float], Dict[str, float]]:
+    pipeline = await ImagePipeline.from_upload(file, det_size)
+    encoding = await pipeline.encode()
+    return encoding.astype(float).tolist(), pipeline.bbox
+
+
+async def encode_images_with_boxes(
+    files: Sequence[UploadFile], det_size: Optional[int] = None
+) -> List[Dict[str, object]]:
+    """
+    Encode many uploads at once.
+    
+    Images are decoded in parallel worker threads (cv2 releases the GIL) and
+    submitted together to the inference scheduler, which batches them through
+    the recognition model. Returns one dict per file, in input
+    order, with "encoding" (float32 array) and "bbox", or "error" if the
+    image could not be decoded or contains no face.
+    """
+    det_size = _validate_det_size(det_size)
+    results: List[Dict[str, object]] = [{} for _ in files]
+    pipelines: List[Optional[ImagePipeline]] = []
+    for i, file in enumerate(files):
+        try:
+            pipelines.append(await ImagePipeline.from_upload(file, det_size))
+        except HTTPException as exc:
+            # Oversized / non-image parts fail on their own
+            pipelines.append(None)
+            results[i] = {"error": exc.detail}
+    await asyncio.gather(*(_run_in_thread(p.try_decode) for p in pipelines if p is not None))
+    
+    valid = []
+    for i, pipeline in enumerate(pipelines):
+        if pipeline is None:
+            continue
+        if pipeline.empty:
+            results[i] = {"error": "Image file is empty"}
+        elif pipeline.image is None:
+            results[i] = {"error": "Failed to decode image"}
+        else:
+            valid.append(i)
+    
+    with metrics.stage("inference"):
+        encoded = await inference.encode_many([pipelines[i].image for i in valid], det_size)
+    for i, item in zip(valid, encoded):
+        if item is None:
+            results[i] = {"error": "No face detected"}
+        else:
+            pipelines[i].set_encoding(*item)
+            results[i] = {"encoding": pipelines[i].encoding, "bbox": pipelines[i].bbox}
+    return results
+
+
+async def encode_image(file: UploadFile, det_size: Optional[int] = None) -> List[float]:
+    encoding, _ = await encode_image_with_box(file, det_size)
     return encoding
 
 
 async def compare_face(
-    file: UploadFile, target_encoding: Sequence[float], threshold: float = DEFAULT_THRESHOLD
+    file: UploadFile,
+    target_encoding: Sequence[float],
+    threshold: float = DEFAULT_THRESHOLD,
+    det_size: Optional[int] = None,
 ) -> Dict[str, float | bool]:
     if len(target_encoding) != 512:
         raise HTTPException(status_code=400, detail="Target encoding must have length 512 (ArcFace)")
 
-    data = await file.read()
-    if not data:
-        raise HTTPException(status_code=400, detail="Image file is empty")
-
-    image = _decode_image(data)
-    try:
-        encoding, _ = await _run_in_thread(insight_backend.encode_face, image)
-    except ValueError as exc:
-        raise HTTPException(status_code=400, detail=str(exc)) from exc
+    pipeline = await ImagePipeline.from_upload(file, det_size)
+    encoding = await pipeline.encode()
 
-    src = np.array(encoding, dtype=float)
-    tgt = np.array(target_encoding, dtype=float)
-    if len(tgt) != len(src):
+    tgt = similarity.as_vector(target_encoding)
+    if len(tgt) != len(encoding):
         raise HTTPException(status_code=400, detail="Encoding length mismatch; re-enroll using current model (512-d ArcFace).")
 
-    distance = float(1.0 - float(np.dot(src, tgt)))
-    return {"match": distance <= threshold, "distance": distance, "threshold": threshold}
+    distance = similarity.cosine_distance(encoding, tgt)
+    return {
+        "match": distance <= threshold,
+        "distance": distance,
+        "threshold": threshold,
+        "det_size": pipeline.meta.get("det_size"),
+    }
 
 
-async def detect_faces(file: UploadFile) -> List[Dict[str, object]]:
-    data = await file.read()
-    if not data:
-        raise HTTPException(status_code=400, detail="Image file is empty")
-    image = _decode_image(data)
-    faces = await _run_in_thread(insight_backend.detect_faces, image)
-    return faces
+async def detect_faces(file: UploadFile, det_size: Optional[int] = None) -> Dict[str, object]:
+    """Detect all faces; returns {"faces": [...], "det_size": detector size used}."""
+    pipeline = await ImagePipeline.from_upload(file, det_size)
+    return await pipeline.detect()
+
+
+def parse_embedding(value: bytes, field: str = "embedding") -> np.ndarray:
+    """
+    Validate a client-supplied binary embedding.
+    
+    Accepts 512 little-endian float32 (2048 bytes) or float16 (1024 bytes)
+    values and returns an L2-normalized float32 vector; HTTP 400 otherwise.
+    """
+    if len(value) not in (EMBEDDING_DIM * 4, EMBEDDING_DIM * 2):
+        raise HTTPException(
+            status_code=400,
+            detail=f"{field} must be {EMBEDDING_DIM} float32 ({EMBEDDING_DIM * 4} bytes) "
+                   f"or float16 ({EMBEDDING_DIM * 2} bytes) values, got {len(value)} bytes",
+        )
+    vector = decode_embedding(value)
+    norm = float(np.linalg.norm(vector))
+    if not np.isfinite(norm) or norm == 0.0:
+        raise HTTPException(status_code=400, detail=f"{field} must be a finite, non-zero vector")
+    return vector / norm
+
+
+def compare_embeddings(
+    embedding_a: bytes, embedding_b: bytes, threshold: float = DEFAULT_THRESHOLD
+) -> Dict[str, float | bool]:
+    """Cosine distance between two precomputed embeddings (no model involved)."""
+    src = parse_embedding(embedding_a, "embedding_a")
+    tgt = parse_embedding(embedding_b, "embedding_b")
+    distance = similarity.cosine_distance(src, tgt)
+    return {"match": distance <= threshold, "distance": distance, "threshold": threshold}
@@ -0,0 +1,383 @@
+"""
+Similarity kernels shared by every comparison path.
+
+Embeddings are L2-normalized, so cosine distance is 1 - dot product. All
+scoring is float32 (half the memory traffic of float64) and goes through
+BLAS: one gemv for a probe against a gallery matrix, one gemm for several
+probes at once.
+
+The *Codes classes are compressed copies of a gallery matrix, scored with
+asymmetric distances (float32 probe against compressed rows):
+
+    Float16Codes  1 KB per 512-d face (2x smaller)
+    Int8Codes     516 B per face: int8 codes plus a float32 scale (4x)
+    PQCodes       product quantization, one byte per subspace (16x with
+                  128 subspaces); distances are table lookups
+
+numpy has no float16/int8 BLAS, so scalar codes are dequantized block by
+block into a small cache-resident float32 buffer and scored with gemv. An
+int8 scan runs at about the speed of a float32 scan; float16 is several
+times slower (numpy converts half floats in software). The approximate
+distances pick the candidates; those are then scored again exactly.
+"""
+
+import threading
+from typing import Optional, Tuple
+
+import numpy as np
+
+EMBEDDING_DIM = 512
+
+# Rows dequantized per gemv call (2048 x 512 float32 = 4 MB)
+_BLOCK_ROWS = 2048
+
+# Dequantization buffer, one per thread: searches run in worker threads
+# (GalleryIndex.guard)
+_scratch = threading.local()
+
+# Rows accumulated per PQ table pass (scores stay cache-resident)
+_PQ_BLOCK_ROWS = 32768
+
+
+def as_vector(value, dim: Optional[int] = None) -> np.ndarray:
+    """A contiguous 1-D float32 view/copy of an embedding."""
+    vector = np.ascontiguousarray(value, dtype=np.float32).reshape(-1)
+    if dim is not None and vector.shape[0] != dim:
+        raise ValueError(f"Embedding has {vector.shape[0]} values; expected {dim}")
+    return vector
+
+
+def cosine_distance(a, b) -> float:
+    """Cosine distance between two L2-normalized embeddings."""
+    return float(1.0 - np.dot(as_vector(a), as_vector(b)))
+
+
+def distances(matrix: np.ndarray, probe, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """Cosine distances from a probe to every row of a float32 matrix (gemv)."""
+    scores = np.dot(matrix, as_vector(probe), out=out)
+    np.subtract(1.0, scores, out=scores)
+    return scores
+
+
+def distances_batch(matrix: np.ndarray, probes) -> np.ndarray:
+    """(M x N) cosine distances from M probes to N rows (one gemm)."""
+    probes = np.ascontiguousarray(probes, dtype=np.float32).reshape(-1, matrix.shape[1])
+    scores = probes @ matrix.T
+    np.subtract(1.0, scores, out=scores)
+    return scores
+
+
+def top_k_rows(dists: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k smallest distances, sorted ascending (partial selection)."""
+    n = dists.shape[0]
+    k = min(k, n)
+    if k < n:
+        rows = np.argpartition(dists, k - 1)[:k]
+    else:
+        rows = np.arange(n)
+    return rows[np.argsort(dists[rows], kind="stable")]
+
+
+def rerank(matrix: np.ndarray, rows: np.ndarray, probe) -> np.ndarray:
+    """Exact float32 distances for selected rows of a matrix."""
+    return distances(matrix[rows], probe)
+
+
+def _scratch_block(dim: int) -> np.ndarray:
+    """This thread's (_BLOCK_ROWS x dim) float32 dequantization buffer."""
+    block = getattr(_scratch, "block", None)
+    if block is None or block.shape[1] != dim:
+        block = _scratch.block = np.empty((_BLOCK_ROWS, dim), dtype=np.float32)
+    return block
+
+
+class _ScalarCodes:
+    """
+    Row-aligned compressed copy of a growable embedding matrix.
+
+    Rows are managed by the owner (set, move, grow) so they stay aligned
+    with its other per-row arrays. Subclasses with per-row scales set
+    `scales`; row r then decodes to codes[r] * scales[r].
+    """
+
+    dtype: np.dtype
+    scales: Optional[np.ndarray] = None
+
+    def __init__(self, dim: int = EMBEDDING_DIM, capacity: int = 64):
+        self.dim = dim
+        self.codes = np.zeros((capacity, dim), dtype=self.dtype)
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes
+
+    def grow(self, capacity: int) -> None:
+        n = min(capacity, self.codes.shape[0])
+        codes = np.zeros((capacity, self.dim), dtype=self.dtype)
+        codes[:n] = self.codes[:n]
+        self.codes = codes
+
+    def set(self, row: int, vectors) -> None:
+        """Encode one vector, or an (n x dim) block, starting at row."""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        self.codes[row:row + vectors.shape[0]] = vectors
+
+    def move(self, dst: int, src: int) -> None:
+        self.codes[dst] = self.codes[src]
+
+    def decode(self, rows: np.ndarray) -> np.ndarray:
+        """Float32 reconstruction of the given rows."""
+        return self.codes[rows].astype(np.float32)
+
+    def distances(self, probe, n: int) -> np.ndarray:
+        """Approximate cosine distances from a float32 probe to the first n rows."""
+        probe = as_vector(probe, self.dim)
+        scores = np.empty(n, dtype=np.float32)
+        buffer = _scratch_block(self.dim)
+        for start in range(0, n, _BLOCK_ROWS):
+            stop = min(n, start + _BLOCK_ROWS)
+            block = buffer[: stop - start]
+            np.copyto(block, self.codes[start:stop], casting="unsafe")
+            np.dot(block, probe, out=scores[start:stop])
+        if self.scales is not None:
+            scores *= self.scales[:n]
+        np.subtract(1.0, scores, out=scores)
+        return scores
+
+    def distances_rows(self, probe, rows: np.ndarray) -> np.ndarray:
+        """Approximate cosine distances from a probe to selected rows."""
+        scores = np.dot(self.codes[rows].astype(np.float32), as_vector(probe, self.dim))
+        if self.scales is not None:
+            scores *= self.scales[rows]
+        np.subtract(1.0, scores, out=scores)
+        return scores
+
+
+class Float16Codes(_ScalarCodes):
+    """Rows stored as float16 (relative error ~1e-3 per value)."""
+
+    dtype = np.dtype(np.float16)
+
+
+class Int8Codes(_ScalarCodes):
+    """
+    Per-row symmetric int8 quantization.
+
+    Row r is stored as codes[r] (int8) and scales[r] with
+    vector ~= codes[r] * scales[r].
+    """
+
+    dtype = np.dtype(np.int8)
+
+    def __init__(self, dim: int = EMBEDDING_DIM, capacity: int = 64):
+        super().__init__(dim, capacity)
+        self.scales = np.zeros(capacity, dtype=np.float32)
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + self.scales.nbytes
+
+    def grow(self, capacity: int) -> None:
+        n = min(capacity, self.codes.shape[0])
+        super().grow(capacity)
+        scales = np.zeros(capacity, dtype=np.float32)
+        scales[:n] = self.scales[:n]
+        self.scales = scales
+
+    def set(self, row: int, vectors) -> None:
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        peaks = np.abs(vectors).max(axis=1)
+        scales = np.where(peaks > 0, peaks / 127.0, 1.0).astype(np.float32)
+        stop = row + vectors.shape[0]
+        self.scales[row:stop] = scales
+        self.codes[row:stop] = np.rint(vectors / scales[:, None])
+
+    def move(self, dst: int, src: int) -> None:
+        super().move(dst, src)
+        self.scales[dst] = self.scales[src]
+
+    def decode(self, rows: np.ndarray) -> np.ndarray:
+        return super().decode(rows) * self.scales[rows, None]
+
+
+def train_pq(
+    vectors: np.ndarray,
+    subspaces: int,
+    iterations: int = 8,
+    max_samples: int = 8192,
+    seed: int = 0,
+) -> np.ndarray:
+    """
+    Product-quantization codebooks: k-means (up to 256 centroids) per subspace.
+
+    Returns a (subspaces x ksub x dim/subspaces) float32 array.
+    """
+    rng = np.random.default_rng(seed)
+    n, dim = vectors.shape
+    if dim % subspaces:
+        raise ValueError(f"{subspaces} subspaces do not divide dimension {dim}")
+    sample = vectors[rng.choice(n, size=max_samples, replace=False)] if n > max_samples else vectors
+    sample = np.ascontiguousarray(sample, dtype=np.float32).reshape(sample.shape[0], subspaces, -1)
+    ksub = min(256, sample.shape[0])
+    codebooks = np.empty((subspaces, ksub, sample.shape[2]), dtype=np.float32)
+    for m in range(subspaces):
+        points = np.ascontiguousarray(sample[:, m])
+        centroids = points[rng.choice(points.shape[0], size=ksub, replace=False)].copy()
+        for _ in range(iterations):
+            assign = _nearest(points, centroids)
+            counts = np.bincount(assign, minlength=ksub)
+            sums = np.stack(
+                [np.bincount(assign, weights=points[:, d], minlength=ksub) for d in range(points.shape[1])],
+                axis=1,
+            )
+            empty = counts == 0
+            if empty.any():
+                # Re-seed empty centroids with random points
+                sums[empty] = points[rng.choice(points.shape[0], size=int(empty.sum()), replace=False)]
+                counts[empty] = 1
+            centroids = (sums / counts[:, None]).astype(np.float32)
+        codebooks[m] = centroids
+    return codebooks
+
+
+def _nearest(points: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Index of the nearest (euclidean) centroid for each point."""
+    scores = points @ centroids.T
+    scores *= -2.0
+    scores += np.einsum("ij,ij->i", centroids, centroids)
+    return np.argmin(scores, axis=1)
+
+
+class PQCodes:
+    """
+    Product-quantized rows: each of the m subvectors is replaced by the
+    index (one byte) of its nearest codebook centroid.
+
+    Distances use asymmetric lookup tables: the probe's dot product with
+    every centroid of every subspace is computed once (m x 256), and a
+    row's score is the sum of m table entries. Codes are stored subspace
+    by subspace (m x capacity) so each table lookup is one contiguous
+    np.take. Codebooks are trained by train_pq on the gallery the codes
+    are built for.
+    """
+
+    def __init__(self, codebooks: np.ndarray, capacity: int = 64, trained_size: int = 0):
+        self.codebooks = np.ascontiguousarray(codebooks, dtype=np.float32)
+        self.subspaces, self.ksub, self.dsub = self.codebooks.shape
+        self.dim = self.subspaces * self.dsub
+        self.trained_size = trained_size
+        self.codes = np.zeros((self.subspaces, capacity), dtype=np.uint8)
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + self.codebooks.nbytes
+
+    def grow(self, capacity: int) -> None:
+        n = min(capacity, self.codes.shape[1])
+        codes = np.zeros((self.subspaces, capacity), dtype=np.uint8)
+        codes[:, :n] = self.codes[:, :n]
+        self.codes = codes
+
+    def encode(self, vectors) -> np.ndarray:
+        """PQ codes (subspaces x n uint8) of one vector or an (n x dim) block."""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(-1, self.subspaces, self.dsub)
+        codes = np.empty((self.subspaces, vectors.shape[0]), dtype=np.uint8)
+        # Small blocks keep the (rows x 256) score matrix in cache
+        for start in range(0, vectors.shape[0], 1024):
+            block = vectors[start:start + 1024]
+            for m in range(self.subspaces):
+                codes[m, start:start + block.shape[0]] = _nearest(block[:, m], self.codebooks[m])
+        return codes
+
+    def set(self, row: int, vectors) -> None:
+        """Encode one vector, or an (n x dim) block, starting at row."""
+        codes = self.encode(vectors)
+        self.codes[:, row:row + codes.shape[1]] = codes
+
+    def set_rows(self, rows: np.ndarray, vectors: np.ndarray) -> None:
+        """Encode an (n x dim) block into the given rows."""
+        self.codes[:, rows] = self.encode(vectors)
+
+    def fork(self, n: int) -> "PQCodes":
+        """Copy of the first n rows, sharing the codebooks."""
+        fork = PQCodes(self.codebooks, n, self.trained_size)
+        fork.codes[:] = self.codes[:, :n]
+        return fork
+
+    def copy_rows(self, dst: np.ndarray, source: "PQCodes", src) -> None:
+        """Copy rows encoded with the same codebooks from another instance."""
+        self.codes[:, dst] = source.codes[:, src]
+
+    def move(self, dst: int, src: int) -> None:
+        self.codes[:, dst] = self.codes[:, src]
+
+    def decode(self, rows: np.ndarray) -> np.ndarray:
+        """Float32 reconstruction of the given rows."""
+        codes = self.codes[:, rows]
+        parts = self.codebooks[np.arange(self.subspaces)[:, None], codes]
+        return np.ascontiguousarray(parts.transpose(1, 0, 2)).reshape(codes.shape[1], self.dim)
+
+    def _table(self, probe) -> np.ndarray:
+        """(m x 256) dot products of the probe's subvectors with every centroid."""
+        probe = as_vector(probe, self.dim).reshape(self.subspaces, self.dsub, 1)
+        return np.matmul(self.codebooks, probe)[:, :, 0]
+
+    def _scores(self, table: np.ndarray, codes: np.ndarray, out: np.ndarray) -> None:
+        out[:] = 0.0
+        lookup = np.empty(out.shape[0], dtype=np.float32)
+        for m in range(self.subspaces):
+            np.take(table[m], codes[m], out=lookup)
+            out += lookup
+
+    def distances(self, probe, n: int) -> np.ndarray:
+        """Approximate cosine distances from a float32 probe to the first n rows."""
+        table = self._table(probe)
+        scores = np.empty(n, dtype=np.float32)
+        for start in range(0, n, _PQ_BLOCK_ROWS):
+            stop = min(n, start + _PQ_BLOCK_ROWS)
+            self._scores(table, self.codes[:, start:stop], scores[start:stop])
+        np.subtract(1.0, scores, out=scores)
+        return scores
+
+    def distances_rows(self, probe, rows: np.ndarray) -> np.ndarray:
+        """Approximate cosine distances from a probe to selected rows."""
+        scores = np.empty(rows.shape[0], dtype=np.float32)
+        self._scores(self._table(probe), self.codes[:, rows], scores)
+        np.subtract(1.0, scores, out=scores)
+        return scores
+
+
+COMPRESSION_FORMATS = ("float16", "int8", "pq")
+
+# Galleries smaller than this get int8 codes instead of PQ (too few rows
+# to train 256 centroids per subspace, and too small to matter)
+PQ_MIN_TRAINING_ROWS = 4096
+
+
+def make_codes(
+    fmt: str,
+    dim: int,
+    capacity: int,
+    training: Optional[np.ndarray] = None,
+    subspaces: int = 128,
+    codebooks: Optional[Tuple[np.ndarray, int]] = None,
+):
+    """
+    Empty codes of the given format, sized for capacity rows.
+
+    PQ needs codebooks: reused from `codebooks` (array, trained size) when
+    given, otherwise trained on `training` (a sample of the capacity rows
+    to be encoded); with fewer than PQ_MIN_TRAINING_ROWS training rows the
+    codes fall back to int8.
+    """
+    if fmt == "float16":
+        return Float16Codes(dim, capacity)
+    if fmt == "int8":
+        return Int8Codes(dim, capacity)
+    if fmt == "pq":
+        if codebooks is not None:
+            return PQCodes(codebooks[0], capacity, codebooks[1])
+        if training is not None and training.shape[0] >= PQ_MIN_TRAINING_ROWS:
+            return PQCodes(train_pq(training, subspaces), capacity, capacity)
+        return Int8Codes(dim, capacity)
+    raise ValueError(f"Unknown gallery compression {fmt!r}; expected one of {list(COMPRESSION_FORMATS)}")
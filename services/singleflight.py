@@ -0,0 +1,125 @@
+"""
+Cache-miss coordination.
+
+SingleFlight coalesces concurrent loads of the same key inside one process:
+the first caller starts the load and everyone else awaits the same result,
+so an expired cache entry on a busy tenant costs one query instead of one
+per request. It also runs background refreshes for stale-while-revalidate.
+
+RedisLoadLock extends this across replicas: only the replica holding the
+lock loads; the others poll the cache until it is filled (or the lock times
+out and they load themselves).
+"""
+
+import asyncio
+import logging
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, TypeVar
+
+import redis.asyncio as redis
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """Per-key in-flight loads shared by concurrent callers."""
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+
+    def _start(self, key: Hashable, load: Callable[[], Awaitable[Any]]) -> asyncio.Future:
+        future = self._calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(load())
+            self._calls[key] = future
+
+            def _done(f: asyncio.Future) -> None:
+                if self._calls.get(key) is f:
+                    del self._calls[key]
+
+            future.add_done_callback(_done)
+        return future
+
+    async def do(self, key: Hashable, load: Callable[[], Awaitable[T]]) -> T:
+        """Run load() unless a load for key is already running; return its result."""
+        # Shielded: a cancelled caller must not cancel the shared load
+        return await asyncio.shield(self._start(key, load))
+
+    def spawn(self, key: Hashable, load: Callable[[], Awaitable[Any]]) -> None:
+        """Start load() in the background unless one is already running."""
+        if key in self._calls:
+            return
+
+        def _log(f: asyncio.Future) -> None:
+            if not f.cancelled() and f.exception() is not None:
+                logger.warning("Background refresh of %r failed: %s", key, f.exception())
+
+        self._start(key, load).add_done_callback(_log)
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._calls
+
+
+class RedisLoadLock:
+    """
+    Best-effort cross-replica lock around a cache fill.
+
+    SET NX PX with a random token; released with a WATCH'd compare-and-delete
+    so an expired lock taken over by another replica is never deleted.
+    """
+
+    def __init__(self, client: redis.Redis, name: str, timeout: float):
+        self.client = client
+        self.key = f"lock:{name}"
+        self.timeout = timeout
+        self._token = uuid.uuid4().hex.encode()
+
+    async def acquire(self) -> bool:
+        return bool(await self.client.set(self.key, self._token, nx=True, px=int(self.timeout * 1000)))
+
+    async def release(self) -> None:
+        async with self.client.pipeline(transaction=True) as pipe:
+            try:
+                await pipe.watch(self.key)
+                if await pipe.get(self.key) == self._token:
+                    pipe.multi()
+                    pipe.delete(self.key)
+                    await pipe.execute()
+            except redis.WatchError:
+                pass
+
+
+async def fill_once(
+    client: Optional[redis.Redis],
+    name: str,
+    timeout: float,
+    read_cache: Callable[[], Awaitable[Optional[T]]],
+    load: Callable[[], Awaitable[T]],
+    poll_interval: float = 0.05,
+) -> T:
+    """
+    Run load() (which fills the cache) on one replica at a time.
+
+    Without a client, just runs load(). Replicas that lose the lock poll
+    read_cache() until it returns a value, falling back to load() once the
+    lock timeout has passed.
+    """
+    if client is None:
+        return await load()
+    lock = RedisLoadLock(client, name, timeout)
+    if await lock.acquire():
+        try:
+            return await load()
+        finally:
+            await lock.release()
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while loop.time() < deadline:
+        await asyncio.sleep(poll_interval)
+        cached = await read_cache()
+        if cached is not None:
+            return cached
+    return await load()
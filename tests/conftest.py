@@ -0,0 +1,30 @@
+import fakeredis
+import pytest
+
+from services.database import TenantManager
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    """
+    The TenantManager singleton on an in-memory Redis.
+
+    initialize() is skipped (it would connect to the gateway database), so
+    only paths that do not reach MySQL can be exercised; tests replace
+    _load_enrollments where a table read is needed.
+    """
+    tm = TenantManager()
+
+    async def initialize() -> None:
+        pass
+
+    monkeypatch.setattr(tm, "initialize", initialize)
+    client = fakeredis.aioredis.FakeRedis()
+    monkeypatch.setattr(tm, "_redis", client)
+    # Version counters live in the same Redis (the subscriber is not started)
+    monkeypatch.setattr(tm._bus, "_redis", client)
+    yield tm
+    tm._galleries.clear()
+    tm._gallery_versions.clear()
+    tm._l1.clear()
+    tm._bus._latest.clear()
@@ -0,0 +1,109 @@
+"""Round trips of the embedding and enrollment codecs in every storage format."""
+
+import json
+
+import numpy as np
+import pytest
+
+from services.codec import (
+    EMBEDDING_DTYPES,
+    decode_embedding,
+    encode_embedding,
+    pack_enrollment,
+    pack_enrollments,
+    unpack_enrollment,
+    unpack_enrollments,
+)
+from services.gallery import EMBEDDING_DIM
+
+FORMATS = sorted(EMBEDDING_DTYPES)
+# Worst-case rounding of a unit-vector component
+TOLERANCE = {"float32": 0.0, "float16": 1e-3}
+
+
+def _vector(seed=0):
+    vector = np.random.default_rng(seed).standard_normal(EMBEDDING_DIM).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def _record(enrollment_id, label="Siti Aminah", created_at="2024-01-02 03:04:05"):
+    return {
+        "id": enrollment_id,
+        "user_id": enrollment_id * 10,
+        "label": label,
+        "encoding": _vector(enrollment_id),
+        "status": "active",
+        "created_at": created_at,
+    }
+
+
+@pytest.mark.parametrize("fmt", FORMATS)
+def test_embedding_round_trip(fmt):
+    vector = _vector()
+    blob = encode_embedding(vector, fmt)
+
+    assert len(blob) == EMBEDDING_DIM * EMBEDDING_DTYPES[fmt].itemsize
+    decoded = decode_embedding(blob)
+    assert decoded.dtype == np.float32
+    np.testing.assert_allclose(decoded, vector, atol=TOLERANCE[fmt])
+
+
+def test_float32_blob_that_looks_like_json():
+    # 0x5b ("[") as first byte: binary blobs are recognised by length first
+    vector = _vector()
+    vector[0] = np.frombuffer(b"[\x00\x00\x00", dtype="<f4")[0]
+    np.testing.assert_array_equal(decode_embedding(encode_embedding(vector)), vector)
+
+
+def test_legacy_json_embedding():
+    vector = _vector()
+    text = json.dumps(vector.tolist())
+    np.testing.assert_allclose(decode_embedding(text), vector, atol=1e-7)
+    np.testing.assert_allclose(decode_embedding(text.encode()), vector, atol=1e-7)
+    np.testing.assert_allclose(decode_embedding(vector.tolist()), vector, atol=1e-7)
+
+
+def test_rejects_unknown_format_and_bad_length():
+    with pytest.raises(ValueError):
+        encode_embedding(_vector(), "int8")
+    with pytest.raises(ValueError):
+        decode_embedding(b"\x00" * 100)
+
+
+@pytest.mark.parametrize("fmt", FORMATS)
+def test_enrollment_list_round_trip(fmt):
+    records = [_record(1), _record(2, label="Budi"), _record(3, created_at=None)]
+    unpacked = unpack_enrollments(pack_enrollments(records, fmt))
+
+    assert len(unpacked) == len(records)
+    for original, restored in zip(records, unpacked):
+        assert {k: v for k, v in restored.items() if k != "encoding"} == {
+            k: v for k, v in original.items() if k != "encoding"
+        }
+        np.testing.assert_allclose(restored["encoding"], original["encoding"], atol=TOLERANCE[fmt])
+
+
+def test_empty_enrollment_list_round_trip():
+    assert unpack_enrollments(pack_enrollments([])) == []
+
+
+def test_legacy_json_enrollment_list():
+    record = _record(1)
+    legacy = json.dumps([dict(record, encoding=record["encoding"].tolist())])
+    (restored,) = unpack_enrollments(legacy.encode())
+    assert restored["label"] == record["label"]
+    np.testing.assert_allclose(restored["encoding"], record["encoding"], atol=1e-7)
+
+
+@pytest.mark.parametrize("fmt", FORMATS)
+@pytest.mark.parametrize("created_at", ["2024-01-02 03:04:05", None])
+def test_hash_field_round_trip(fmt, created_at):
+    record = _record(7, label="Dewi Lestari éè", created_at=created_at)
+    restored = unpack_enrollment(7, pack_enrollment(record, fmt))
+
+    assert restored["id"] == 7
+    assert restored["user_id"] == record["user_id"]
+    assert restored["label"] == record["label"]
+    assert restored["created_at"] == created_at
+    assert restored["status"] == "active"
+    np.testing.assert_allclose(restored["encoding"], record["encoding"], atol=TOLERANCE[fmt])
@@ -0,0 +1,221 @@
+"""Cross-replica version counters, pub/sub invalidation and gallery rebuilds racing deltas."""
+
+import asyncio
+
+import fakeredis
+import numpy as np
+import pytest
+
+from services.codec import pack_enrollments
+from services.coherence import SCOPE_CONFIG, SCOPE_ENROLLMENTS, InvalidationBus
+from services.config import settings
+from services.database import TenantConfig
+from services.gallery import EMBEDDING_DIM, GalleryIndex
+
+TENANT = 1
+CHANNEL = "test:invalidate"
+
+
+def _record(enrollment_id, user_id=None):
+    vector = np.random.default_rng(enrollment_id).standard_normal(EMBEDDING_DIM).astype(np.float32)
+    user_id = enrollment_id if user_id is None else user_id
+    return {
+        "id": enrollment_id,
+        "user_id": user_id,
+        "label": f"user{user_id}",
+        "encoding": vector / np.linalg.norm(vector),
+        "created_at": None,
+    }
+
+
+async def _until(condition, timeout=2.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not condition():
+        assert loop.time() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+def test_publish_reaches_other_replicas_but_not_itself():
+    async def scenario():
+        server = fakeredis.FakeServer()
+        first = InvalidationBus(CHANNEL, reconcile_interval=60)
+        second = InvalidationBus(CHANNEL, reconcile_interval=60)
+        seen = {"first": [], "second": []}
+
+        async def on_first(tenant_id, scope):
+            seen["first"].append((tenant_id, scope))
+
+        async def on_second(tenant_id, scope):
+            seen["second"].append((tenant_id, scope))
+
+        first.start(fakeredis.aioredis.FakeRedis(server=server), on_first, lambda: [])
+        second.start(fakeredis.aioredis.FakeRedis(server=server), on_second, lambda: [])
+        await asyncio.sleep(0.05)  # subscribed
+
+        versions = await first.publish(TENANT, [SCOPE_ENROLLMENTS, SCOPE_CONFIG])
+        await _until(lambda: len(seen["second"]) == 2)
+        await first.publish(TENANT, [SCOPE_ENROLLMENTS])
+        await _until(lambda: second.latest(TENANT, SCOPE_ENROLLMENTS) == 2)
+        await first.stop()
+        await second.stop()
+        return versions, seen, first, second
+
+    versions, seen, first, second = asyncio.run(scenario())
+    assert versions == {SCOPE_ENROLLMENTS: 1, SCOPE_CONFIG: 1}
+    assert seen["first"] == []
+    assert seen["second"] == [(TENANT, SCOPE_ENROLLMENTS), (TENANT, SCOPE_CONFIG), (TENANT, SCOPE_ENROLLMENTS)]
+    assert first.latest(TENANT, SCOPE_CONFIG) == second.latest(TENANT, SCOPE_CONFIG) == 1
+
+
+def test_reconcile_catches_up_on_a_missed_message():
+    async def scenario():
+        client = fakeredis.aioredis.FakeRedis()
+        bus = InvalidationBus(CHANNEL, reconcile_interval=60)
+        seen = []
+
+        async def handler(tenant_id, scope):
+            seen.append((tenant_id, scope))
+
+        bus._redis, bus._handler, bus._resident = client, handler, lambda: [TENANT, 2]
+        # Bumped by another replica while this one was not subscribed
+        await client.set(InvalidationBus.version_key(TENANT, SCOPE_ENROLLMENTS), 3)
+        await bus.reconcile()
+        await bus.reconcile()
+        return bus, seen
+
+    bus, seen = asyncio.run(scenario())
+    assert seen == [(TENANT, SCOPE_ENROLLMENTS)]
+    assert bus.latest(TENANT, SCOPE_ENROLLMENTS) == 3 and bus.latest(2, SCOPE_ENROLLMENTS) == 0
+
+
+def test_malformed_messages_are_ignored():
+    bus = InvalidationBus(CHANNEL, reconcile_interval=60)
+    asyncio.run(bus._on_message(b"not json"))
+    asyncio.run(bus._on_message(b'{"versions": {}}'))
+    assert bus._latest == {}
+
+
+def _table(manager, monkeypatch, rows, during_load=None):
+    async def load(tenant_id):
+        if during_load is not None:
+            await during_load()
+        return [dict(row) for row in rows]
+
+    monkeypatch.setattr(manager, "_load_enrollments", load)
+
+
+def test_local_mutation_keeps_its_gallery_current(manager, monkeypatch):
+    _table(manager, monkeypatch, [_record(1), _record(2)])
+
+    async def scenario():
+        gallery = await manager.get_gallery(TENANT)
+        await manager._apply_gallery_delta(TENANT, lambda g: g.upsert(3, 3, "user3", _record(3)["encoding"]))
+        await manager._publish(TENANT, SCOPE_ENROLLMENTS)
+        return gallery, await manager.get_gallery(TENANT)
+
+    before, after = asyncio.run(scenario())
+    assert after is before and len(after) == 3
+    assert manager._gallery_versions[TENANT] == manager._bus.latest(TENANT, SCOPE_ENROLLMENTS) == 1
+
+
+def test_change_from_another_replica_rebuilds_the_gallery(manager, monkeypatch):
+    rows = [_record(1), _record(2)]
+    _table(manager, monkeypatch, rows)
+
+    async def scenario():
+        gallery = await manager.get_gallery(TENANT)
+        # Another replica enrolled: its bump is seen before our own publish
+        rows.append(_record(3))
+        await manager._redis.delete(manager._enrollment_cache_key(TENANT))
+        await manager._redis.incr(InvalidationBus.version_key(TENANT, SCOPE_ENROLLMENTS))
+        await manager._on_invalidate(TENANT, SCOPE_ENROLLMENTS)
+        await manager._bus.current(TENANT, SCOPE_ENROLLMENTS)
+        await manager._publish(TENANT, SCOPE_ENROLLMENTS)
+        return gallery, await manager.get_gallery(TENANT)
+
+    before, after = asyncio.run(scenario())
+    # Our publish did not paper over the other replica's change
+    assert after is not before
+    assert sorted(after.ids.tolist()) == [1, 2, 3]
+    assert manager._gallery_versions[TENANT] == 2
+
+
+def test_stale_l1_entries_are_not_served(manager, monkeypatch):
+    config = TenantConfig(TENANT, "School", "db1", 3306, "school_1", "app", "secret", "active")
+    loads = []
+
+    async def load_config(tenant_id):
+        loads.append(tenant_id)
+        return manager._remember_config(config, await manager._current_version(tenant_id, SCOPE_CONFIG))
+
+    monkeypatch.setattr(manager, "_load_tenant_config", load_config)
+    resident, reenrolled = dict(_record(7), status="active"), dict(_record(8, user_id=7), status="active")
+
+    async def scenario():
+        await manager.get_tenant_config(TENANT)
+        await manager.get_tenant_config(TENANT)
+        manager._remember_user_enrollment(TENANT, resident, 0)
+        assert (await manager.get_user_enrollment(TENANT, 7))["id"] == 7
+        assert loads == [TENANT]
+
+        # Another replica changed both scopes (seen by message or reconcile)
+        for scope in (SCOPE_CONFIG, SCOPE_ENROLLMENTS):
+            await manager._redis.incr(InvalidationBus.version_key(TENANT, scope))
+            manager._bus._observe(TENANT, scope, 1)
+        await manager._redis.set(
+            f"tenant:{TENANT}:user:7:enrollment", pack_enrollments([reenrolled], settings.EMBEDDING_FORMAT)
+        )
+        await manager.get_tenant_config(TENANT)
+        return await manager.get_user_enrollment(TENANT, 7)
+
+    assert asyncio.run(scenario())["id"] == 8
+    assert loads == [TENANT, TENANT]
+    assert manager._l1.peek(("config", TENANT))[1] == 1
+
+
+def test_config_invalidation_drops_the_pool_mapping(manager, monkeypatch):
+    forgotten = []
+
+    async def forget(tenant_id):
+        forgotten.append(tenant_id)
+
+    monkeypatch.setattr(manager._pools, "forget", forget)
+    manager._l1.put(("config", TENANT), (object(), 0), 10)
+    manager._schemas[TENANT] = object()
+
+    asyncio.run(manager._on_invalidate(TENANT, SCOPE_ENROLLMENTS))
+    assert ("config", TENANT) in manager._l1 and forgotten == []
+
+    asyncio.run(manager._on_invalidate(TENANT, SCOPE_CONFIG))
+    assert ("config", TENANT) not in manager._l1
+    assert TENANT not in manager._schemas
+    assert forgotten == [TENANT]
+
+
+@pytest.mark.parametrize("coherence", [False, True])
+@pytest.mark.parametrize("compression", ["", "int8"])
+def test_delta_during_a_rebuild_reaches_the_new_gallery(manager, monkeypatch, coherence, compression):
+    monkeypatch.setattr(settings, "COHERENCE_ENABLED", coherence)
+    monkeypatch.setattr(settings, "GALLERY_COMPRESSION", compression)
+    monkeypatch.setattr(settings, "GALLERY_KEEP_FLOAT32", True)
+    rows = [_record(1), _record(2), _record(3)]
+
+    async def enroll_and_delete_meanwhile():
+        # Committed to MySQL after the table was read; the deltas reach
+        # the gallery being built only by replay
+        await manager._apply_gallery_delta(TENANT, lambda g: g.upsert(4, 4, "user4", _record(4)["encoding"]))
+        await manager._apply_gallery_delta(TENANT, lambda g: g.remove_id(2))
+        # Re-enrollment of user 1 under a new id
+        replacement = _record(5, user_id=1)
+        await manager._apply_gallery_delta(
+            TENANT, lambda g: g.upsert(5, 1, "user1", replacement["encoding"])
+        )
+        await manager._publish(TENANT, SCOPE_ENROLLMENTS)
+
+    _table(manager, monkeypatch, rows, during_load=enroll_and_delete_meanwhile)
+
+    gallery = asyncio.run(manager.get_gallery(TENANT))
+    assert sorted(gallery.ids.tolist()) == [3, 4, 5]
+    assert manager._pending_deltas == {}
+    assert isinstance(gallery, GalleryIndex) and (gallery.codes is not None) == bool(compression)
@@ -0,0 +1,257 @@
+"""Compressed gallery codes, shortlist re-scoring and the exact-distance match rule."""
+
+import asyncio
+
+import numpy as np
+import pytest
+from fastapi import HTTPException
+
+from services import enrollment, similarity
+from services.config import settings
+from services.database import tenant_manager
+from services.gallery import GalleryIndex, rescore
+from services.similarity import EMBEDDING_DIM, Float16Codes, Int8Codes, PQCodes, make_codes
+
+TENANT = 1
+# Small PQ setup so codebooks train in well under a second
+SUBSPACES = 32
+
+
+def _unit(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)
+
+
+def _faces(seed, identities=300, noise=0.02):
+    """One enrollment per identity, and a second capture of each as probes."""
+    rng = np.random.default_rng(seed)
+    centers = _unit(rng.standard_normal((identities, EMBEDDING_DIM)))
+    enrolled, probes = (_unit(centers + noise * rng.standard_normal(centers.shape)) for _ in range(2))
+    return enrolled, probes
+
+
+def _records(vectors):
+    return [
+        {"id": i + 1, "user_id": i + 1, "label": f"user{i + 1}", "encoding": vector}
+        for i, vector in enumerate(vectors)
+    ]
+
+
+def _top_ids(dists, k):
+    return set(similarity.top_k_rows(dists, k).tolist())
+
+
+@pytest.fixture
+def small_pq(monkeypatch):
+    monkeypatch.setattr(similarity, "PQ_MIN_TRAINING_ROWS", 256)
+
+
+@pytest.mark.parametrize("codes_class, atol, min_recall", [(Float16Codes, 2e-3, 0.99), (Int8Codes, 2e-2, 0.9)])
+def test_scalar_codes_track_float32(codes_class, atol, min_recall):
+    gallery, probes = _faces(0)
+    codes = codes_class(EMBEDDING_DIM, 16)
+    codes.grow(len(gallery))
+    codes.set(0, gallery[:100])
+    for row in range(100, len(gallery)):
+        codes.set(row, gallery[row])
+
+    np.testing.assert_allclose(codes.decode(np.arange(len(gallery))), gallery, atol=atol)
+    recall = []
+    for probe in probes[:40]:
+        exact = similarity.distances(gallery, probe)
+        approx = codes.distances(probe, len(gallery))
+        np.testing.assert_allclose(approx, exact, atol=atol)
+        rows = np.arange(0, len(gallery), 7)
+        np.testing.assert_allclose(codes.distances_rows(probe, rows), exact[rows], atol=atol)
+        recall.append(len(_top_ids(approx, 10) & _top_ids(exact, 10)) / 10)
+    assert np.mean(recall) >= min_recall
+
+
+def test_scalar_codes_move_keeps_rows_aligned():
+    gallery, _ = _faces(1, identities=10)
+    codes = Int8Codes(EMBEDDING_DIM, 10)
+    codes.set(0, gallery)
+    codes.move(2, 9)
+    np.testing.assert_allclose(codes.decode(np.array([2])), gallery[9:10], atol=2e-2)
+
+
+def test_pq_codes_find_the_same_faces(small_pq):
+    gallery, probes = _faces(2)
+    codes = make_codes("pq", EMBEDDING_DIM, len(gallery), gallery, SUBSPACES)
+    assert isinstance(codes, PQCodes)
+    codes.set(0, gallery)
+
+    hits = 0
+    for i, probe in enumerate(probes):
+        approx = codes.distances(probe, len(gallery))
+        hits += i in _top_ids(approx, 10)
+        np.testing.assert_allclose(
+            codes.distances_rows(probe, np.array([i, 0])), approx[[i, 0]], atol=1e-5
+        )
+    assert hits / len(probes) >= 0.95
+
+
+def test_make_codes_falls_back_to_int8_for_small_galleries(small_pq):
+    gallery, _ = _faces(3, identities=100)
+    assert isinstance(make_codes("pq", EMBEDDING_DIM, 100, gallery, SUBSPACES), Int8Codes)
+    assert isinstance(make_codes("pq", EMBEDDING_DIM, 100, None, SUBSPACES), Int8Codes)
+    assert isinstance(make_codes("float16", EMBEDDING_DIM, 100), Float16Codes)
+    with pytest.raises(ValueError):
+        make_codes("int4", EMBEDDING_DIM, 100)
+
+
+def test_make_codes_reuses_codebooks():
+    codebooks = np.zeros((SUBSPACES, 256, EMBEDDING_DIM // SUBSPACES), dtype=np.float32)
+    codes = make_codes("pq", EMBEDDING_DIM, 10, None, SUBSPACES, (codebooks, 5000))
+    assert isinstance(codes, PQCodes)
+    assert codes.trained_size == 5000 and codes.codebooks.shape == codebooks.shape
+
+
+@pytest.mark.parametrize("compression", ["float16", "int8", "pq"])
+def test_resident_rerank_matches_float32_search(compression, small_pq):
+    vectors, probes = _faces(4)
+    plain = GalleryIndex.from_enrollments(_records(vectors))
+    compressed = GalleryIndex.from_enrollments(
+        _records(vectors), compression=compression, rerank=32, keep_float32=True, pq_subspaces=SUBSPACES
+    )
+    assert not compressed.approximate
+
+    for probe in probes[:50]:
+        expected = plain.search_top_k(probe, 3)
+        found = compressed.search_top_k(probe, 3)
+        assert [match["id"] for match in found] == [match["id"] for match in expected]
+        # Re-ranked on the float32 rows: the same distances, not approximations
+        assert [match["distance"] for match in found] == pytest.approx(
+            [match["distance"] for match in expected], abs=1e-6
+        )
+
+
+def _approximate_gallery(vectors, compression="pq"):
+    return GalleryIndex.from_enrollments(
+        _records(vectors), compression=compression, rerank=16, keep_float32=False, pq_subspaces=SUBSPACES
+    )
+
+
+def test_shortlist_then_rescore_gives_exact_ranking(small_pq):
+    vectors, probes = _faces(5)
+    plain = GalleryIndex.from_enrollments(_records(vectors))
+    gallery = _approximate_gallery(vectors)
+    assert gallery.approximate
+    exact = {i + 1: vector for i, vector in enumerate(vectors)}
+
+    for probe in probes[:30]:
+        shortlist = gallery.shortlist(probe, 3)
+        assert len(shortlist) == 16
+        ranked = rescore(probe, shortlist, exact, 3)
+        expected = plain.search_top_k(probe, 3)
+        assert [match["id"] for match in ranked] == [match["id"] for match in expected]
+        assert [match["distance"] for match in ranked] == pytest.approx(
+            [match["distance"] for match in expected], abs=1e-6
+        )
+
+
+def test_rescore_leaves_out_candidates_without_vectors():
+    vectors, probes = _faces(6, identities=50)
+    gallery = _approximate_gallery(vectors, "int8")
+    shortlist = gallery.shortlist(probes[0], 3)
+    nearest = shortlist[0]["id"]
+    # The nearest enrollment was deleted after the shortlist was taken
+    known = {c["id"]: vectors[c["id"] - 1] for c in shortlist if c["id"] != nearest}
+
+    ranked = rescore(probes[0], shortlist, known, 3)
+    assert nearest not in [match["id"] for match in ranked]
+    for match in ranked:
+        expected = similarity.cosine_distance(probes[0], known[match["id"]])
+        assert match["distance"] == pytest.approx(expected, abs=1e-6)
+    assert rescore(probes[0], gallery.shortlist(probes[0], 3), {}, 3) == []
+
+
+@pytest.fixture
+def stored(monkeypatch):
+    """Serve get_exact_embeddings from a dict of enrollment id -> stored vector."""
+    vectors = {}
+
+    async def get_exact_embeddings(tenant_id, enrollment_ids):
+        return {i: vectors[i] for i in enrollment_ids if i in vectors}
+
+    monkeypatch.setattr(tenant_manager, "get_exact_embeddings", get_exact_embeddings)
+    return vectors
+
+
+def test_match_is_decided_on_stored_vectors_not_codes(stored):
+    vectors, probes = _faces(7, identities=50)
+    gallery = _approximate_gallery(vectors, "int8")
+    stored.update({i + 1: vector for i, vector in enumerate(vectors)})
+    probe = vectors[0]
+    # The codes still say enrollment 1 is the probe itself; its stored
+    # vector (re-enrolled meanwhile) is another face
+    stored[1] = probes[25]
+
+    result = asyncio.run(enrollment._identify_result(TENANT, gallery, probe, 0.35, 1))
+    assert not result["match"]
+    assert result["candidates"] == []
+    assert result["distance"] == pytest.approx(
+        similarity.cosine_distance(probe, stored[result["enrollment_id"]]), abs=1e-6
+    )
+
+
+def test_shortlist_deleted_meanwhile_is_a_503(stored):
+    vectors, _ = _faces(8, identities=20)
+    gallery = _approximate_gallery(vectors, "float16")
+
+    with pytest.raises(HTTPException) as raised:
+        asyncio.run(enrollment._identify_result(TENANT, gallery, vectors[0], 0.35, 1))
+    assert raised.value.status_code == 503
+
+
+def test_batch_reports_a_deleted_shortlist_per_image(stored, monkeypatch):
+    vectors, probes = _faces(9, identities=200)
+    gallery = _approximate_gallery(vectors, "int8")
+    stored.update({i + 1: vector for i, vector in enumerate(vectors)})
+    # Every candidate of the second probe is gone
+    gone = [candidate["id"] for candidate in gallery.shortlist(probes[1], 1)]
+    assert 1 not in gone
+    for enrollment_id in gone:
+        stored.pop(enrollment_id)
+
+    async def get_gallery(tenant_id):
+        return gallery
+
+    async def encode_images_with_boxes(files, det_size):
+        return [{"encoding": probes[0], "bbox": {}}, {"encoding": probes[1], "bbox": {}}, {"error": "No face"}]
+
+    monkeypatch.setattr(tenant_manager, "get_gallery", get_gallery)
+    monkeypatch.setattr(enrollment.recognition, "encode_images_with_boxes", encode_images_with_boxes)
+
+    results = asyncio.run(enrollment.identify_faces_batch(TENANT, [object()] * 3))["results"]
+    assert results[0]["enrollment_id"] == 1 and results[0]["match"]
+    assert results[1] == {"index": 1, "match": False, "error": enrollment._SHORTLIST_GONE}
+    assert results[2] == {"index": 2, "match": False, "error": "No face"}
+
+
+def test_pq_codebooks_are_reused_until_the_gallery_grows(small_pq, monkeypatch):
+    monkeypatch.setattr(settings, "GALLERY_PQ_SUBSPACES", SUBSPACES)
+    monkeypatch.setattr(settings, "ANN_RETRAIN_GROWTH", 2)
+    vectors, _ = _faces(10)
+    previous = _approximate_gallery(vectors)
+    trained = previous.codes.trained_size
+    assert trained == len(vectors)
+
+    codes, ids = tenant_manager._reusable_codes(previous, trained + 10)
+    assert codes.codebooks is previous.codes.codebooks
+    np.testing.assert_array_equal(ids, previous.ids)
+    # The copy is private: deltas on the previous gallery do not reach it
+    previous.remove_id(1)
+    assert 1 in ids.tolist()
+
+    rebuilt = GalleryIndex.from_enrollments(
+        _records(vectors), compression="pq", rerank=16, keep_float32=False, pq_subspaces=SUBSPACES,
+        reuse=(codes, ids),
+    )
+    np.testing.assert_array_equal(rebuilt.codes.codebooks, previous.codes.codebooks)
+
+    assert tenant_manager._reusable_codes(previous, 2 * trained) is None
+    monkeypatch.setattr(settings, "GALLERY_PQ_SUBSPACES", 64)
+    assert tenant_manager._reusable_codes(previous, trained) is None
+    assert tenant_manager._reusable_codes(_approximate_gallery(vectors, "int8"), trained) is None
+    assert tenant_manager._reusable_codes(None, trained) is None
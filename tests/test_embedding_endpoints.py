@@ -0,0 +1,133 @@
+"""Embedding-only /compare-embedding and /identify-embedding, and encoding form parsing."""
+
+import base64
+
+import numpy as np
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+import main
+from models.recognition_request import FaceCompareRequest
+from services.database import tenant_manager
+from services.gallery import EMBEDDING_DIM, GalleryIndex
+
+TENANT = 1
+OCTET = {"content-type": "application/octet-stream"}
+
+
+def _vector(seed):
+    return np.random.default_rng(seed).standard_normal(EMBEDDING_DIM).astype(np.float32)
+
+
+def _b64(vector, dtype="<f4"):
+    return base64.b64encode(np.asarray(vector, dtype=dtype).tobytes()).decode()
+
+
+@pytest.fixture
+def client():
+    return TestClient(main.app)
+
+
+@pytest.fixture
+def gallery(monkeypatch):
+    vectors = [_vector(i) for i in range(1, 4)]
+    gallery = GalleryIndex.from_enrollments([
+        {"id": i, "user_id": i * 10, "label": f"user{i}", "encoding": vector / np.linalg.norm(vector)}
+        for i, vector in enumerate(vectors, start=1)
+    ])
+
+    async def get_gallery(tenant_id):
+        return gallery
+
+    monkeypatch.setattr(tenant_manager, "get_gallery", get_gallery)
+    return vectors
+
+
+def test_compare_base64_normalizes_both_vectors(client):
+    vector = _vector(1)
+    response = client.post(
+        "/compare-embedding",
+        json={"embedding_a": _b64(vector), "embedding_b": _b64(vector * 7.5, "<f2"), "threshold": 0.2},
+    )
+    assert response.status_code == 200
+    body = response.json()
+    # Scaled copy (sent as float16): the same direction once normalized
+    assert body["match"] and body["distance"] == pytest.approx(0.0, abs=1e-3)
+    assert body["threshold"] == 0.2
+
+
+def test_compare_octet_stream_body(client):
+    body = np.concatenate([_vector(1), _vector(2)]).astype("<f4").tobytes()
+    response = client.post("/compare-embedding?threshold=0.5", content=body, headers=OCTET)
+    assert response.status_code == 200
+    a, b = _vector(1), _vector(2)
+    expected = 1.0 - float(a @ b / np.linalg.norm(a) / np.linalg.norm(b))
+    assert response.json()["distance"] == pytest.approx(expected, abs=1e-5)
+    assert response.json()["match"] is False
+
+    odd = client.post("/compare-embedding", content=body + b"\0", headers=OCTET)
+    assert odd.status_code == 400
+
+
+@pytest.mark.parametrize(
+    "embedding, status",
+    [
+        (_b64(np.ones(300, dtype=np.float32)), 400),  # wrong dimension
+        (_b64(np.ones(EMBEDDING_DIM, dtype=np.float64), "<f8"), 400),  # float64: neither size
+        (_b64(np.zeros(EMBEDDING_DIM, dtype=np.float32)), 400),  # no direction
+        (_b64(np.full(EMBEDDING_DIM, np.nan, dtype=np.float32)), 400),
+        ("not base64!", 422),
+        ([0.1] * EMBEDDING_DIM, 422),  # JSON arrays go to /compare as a form field
+    ],
+    ids=["dimension", "float64", "zero", "nan", "base64", "list"],
+)
+def test_compare_rejects_bad_embeddings(client, embedding, status):
+    response = client.post("/compare-embedding", json={"embedding_a": embedding, "embedding_b": _b64(_vector(1))})
+    assert response.status_code == status
+
+
+def test_non_object_json_body_is_rejected(client):
+    assert client.post("/compare-embedding", json=[1, 2]).status_code == 400
+    assert client.post("/compare-embedding", content=b"{", headers={"content-type": "application/json"}).status_code == 400
+
+
+def test_identify_embedding_json(client, gallery):
+    response = client.post(
+        "/identify-embedding",
+        json={"tenant_id": TENANT, "embedding": _b64(gallery[1] * 3), "top_k": 2, "threshold": 0.5},
+    )
+    assert response.status_code == 200
+    body = response.json()
+    assert body["match"] and body["enrollment_id"] == 2 and body["user_id"] == 20
+    assert body["distance"] == pytest.approx(0.0, abs=1e-5)
+    assert [c["enrollment_id"] for c in body["candidates"]] == [2]
+    assert body["count"] == 3 and body["tenant_id"] == TENANT
+
+
+def test_identify_embedding_octet_stream(client, gallery):
+    body = np.asarray(gallery[2], dtype="<f2").tobytes()
+    response = client.post(f"/identify-embedding?tenant_id={TENANT}&threshold=0.1", content=body, headers=OCTET)
+    assert response.status_code == 200
+    assert response.json()["enrollment_id"] == 3
+
+    missing_tenant = client.post("/identify-embedding", content=body, headers=OCTET)
+    assert missing_tenant.status_code == 400
+
+
+def test_identify_embedding_validates_before_searching(client, gallery):
+    short = client.post("/identify-embedding", json={"tenant_id": TENANT, "embedding": _b64(np.ones(100))})
+    assert short.status_code == 400
+    no_tenant = client.post("/identify-embedding", json={"embedding": _b64(gallery[0])})
+    assert no_tenant.status_code == 422
+    bad_top_k = client.post("/identify-embedding", json={"tenant_id": TENANT, "embedding": _b64(gallery[0]), "top_k": 0})
+    assert bad_top_k.status_code == 400
+
+
+def test_encoding_form_field_is_a_json_array():
+    payload = FaceCompareRequest.as_form(encoding=str([0.5] * EMBEDDING_DIM), threshold=0.3)
+    assert len(payload.encoding) == EMBEDDING_DIM and payload.threshold == 0.3
+    for encoding in ("[0.5, ", '{"a": 1}'):
+        with pytest.raises(HTTPException) as raised:
+            FaceCompareRequest.as_form(encoding=encoding, threshold=0.3)
+        assert raised.value.status_code == 400
@@ -0,0 +1,169 @@
+"""The per-tenant Redis enrollment hash: fills, in-place mutations and counts."""
+
+import asyncio
+import time
+
+import numpy as np
+
+from services.coherence import SCOPE_ENROLLMENTS
+from services.config import settings
+from services.gallery import EMBEDDING_DIM, GalleryIndex
+
+TENANT = 1
+KEY = f"tenant:{TENANT}:enrollments:h"
+LEGACY_KEY = f"tenant:{TENANT}:enrollments"
+
+
+def _record(enrollment_id):
+    vector = np.random.default_rng(enrollment_id).standard_normal(EMBEDDING_DIM).astype(np.float32)
+    return {
+        "id": enrollment_id,
+        "user_id": enrollment_id,
+        "label": f"user{enrollment_id}",
+        "encoding": vector / np.linalg.norm(vector),
+        "status": "active",
+        "created_at": None,
+    }
+
+
+def _table(manager, monkeypatch, rows, during_load=None):
+    """Serve `rows` as the tenant's enrollment table; during_load runs mid-read."""
+    async def load(tenant_id):
+        if during_load is not None:
+            await during_load()
+        return [dict(row) for row in rows]
+
+    monkeypatch.setattr(manager, "_load_enrollments", load)
+
+
+def _ids(cached):
+    return [record["id"] for record in cached[0]]
+
+
+def test_fill_then_read(manager, monkeypatch):
+    rows = [_record(i) for i in (3, 1, 2)]
+    _table(manager, monkeypatch, rows)
+
+    async def scenario():
+        await manager._fill_enrollments(TENANT)
+        return await manager._read_enrollment_hash(TENANT), await manager._redis.ttl(KEY)
+
+    cached, ttl = asyncio.run(scenario())
+    assert _ids(cached) == [1, 2, 3]
+    assert cached[1] > time.time()
+    assert ttl > 0
+    for record in cached[0]:
+        np.testing.assert_array_equal(record["encoding"], rows[[3, 1, 2].index(record["id"])]["encoding"])
+
+
+def test_mutation_during_fill_aborts_the_stale_snapshot(manager, monkeypatch):
+    rows = [_record(1), _record(2)]
+
+    async def enroll_meanwhile():
+        # Another request enrolls while the table is being read
+        await manager._update_enrollment_hash(TENANT, upsert=_record(3))
+
+    _table(manager, monkeypatch, rows, during_load=enroll_meanwhile)
+
+    async def scenario():
+        returned = await manager._fill_enrollments(TENANT)
+        return returned, await manager._read_enrollment_hash(TENANT), await manager._redis.hkeys(KEY)
+
+    returned, cached, fields = asyncio.run(scenario())
+    assert [record["id"] for record in returned] == [1, 2]
+    # The snapshot was not written: the hash is incomplete, not stale
+    assert cached is None
+    assert fields == [b"3"]
+
+
+def test_refill_after_aborted_fill_is_complete(manager, monkeypatch):
+    rows = [_record(1)]
+    calls = []
+
+    async def enroll_once():
+        if not calls:
+            rows.append(_record(2))
+            await manager._update_enrollment_hash(TENANT, upsert=_record(2))
+        calls.append(1)
+
+    _table(manager, monkeypatch, rows, during_load=enroll_once)
+
+    async def scenario():
+        await manager._fill_enrollments(TENANT)
+        await manager._fill_enrollments(TENANT)
+        return await manager._read_enrollment_hash(TENANT)
+
+    assert _ids(asyncio.run(scenario())) == [1, 2]
+
+
+def test_mutations_update_fields_in_place(manager, monkeypatch):
+    _table(manager, monkeypatch, [_record(1), _record(2), _record(3)])
+
+    async def scenario():
+        await manager._fill_enrollments(TENANT)
+        await manager._update_enrollment_hash(TENANT, upsert=_record(4), remove=[2])
+        await manager._update_enrollment_hash(TENANT, remove=[3])
+        return await manager._read_enrollment_hash(TENANT)
+
+    assert _ids(asyncio.run(scenario())) == [1, 4]
+
+
+def test_mutation_on_expired_hash_is_bounded_and_incomplete(manager):
+    async def scenario():
+        await manager._update_enrollment_hash(TENANT, upsert=_record(1))
+        return await manager._read_enrollment_hash(TENANT), await manager._redis.ttl(KEY)
+
+    cached, ttl = asyncio.run(scenario())
+    assert cached is None
+    assert ttl > 0
+
+
+def test_large_hash_is_read_with_hscan(manager, monkeypatch):
+    monkeypatch.setattr(settings, "ENROLLMENT_CACHE_SCAN_COUNT", 4)
+    _table(manager, monkeypatch, [_record(i) for i in range(1, 12)])
+
+    async def scenario():
+        await manager._fill_enrollments(TENANT)
+        return await manager._read_enrollment_hash(TENANT)
+
+    assert _ids(asyncio.run(scenario())) == list(range(1, 12))
+
+
+def test_count_from_complete_hash(manager, monkeypatch):
+    _table(manager, monkeypatch, [_record(i) for i in range(1, 6)])
+
+    async def scenario():
+        await manager._fill_enrollments(TENANT)
+        await manager._update_enrollment_hash(TENANT, remove=[5])
+        return await manager.get_enrollment_count(TENANT)
+
+    assert asyncio.run(scenario()) == 4
+
+
+def test_count_from_resident_gallery(manager):
+    gallery = GalleryIndex.from_enrollments([_record(i) for i in range(1, 8)])
+    manager._galleries.put(TENANT, gallery, gallery.nbytes)
+    manager._gallery_versions[TENANT] = manager._bus.latest(TENANT, SCOPE_ENROLLMENTS)
+
+    # No Redis hash at all: the count comes from the gallery
+    assert asyncio.run(manager.get_enrollment_count(TENANT)) == 7
+
+
+def test_legacy_string_cache_does_not_collide(manager, monkeypatch):
+    _table(manager, monkeypatch, [_record(1), _record(2)])
+    monkeypatch.setattr(manager._pools, "has_tenant", lambda tenant_id: False)
+
+    async def scenario():
+        # JSON list cached by a replica still running an earlier release
+        await manager._redis.set(LEGACY_KEY, b'[{"id": 1}]', ex=60)
+        enrollments = await manager.get_enrollments(TENANT)
+        status = await manager.get_cache_status(TENANT)
+        legacy_before = await manager._redis.exists(LEGACY_KEY)
+        await manager._update_enrollment_hash(TENANT, upsert=_record(3))
+        return enrollments, status, legacy_before, await manager._redis.exists(LEGACY_KEY)
+
+    enrollments, status, legacy_before, legacy_after = asyncio.run(scenario())
+    assert [record["id"] for record in enrollments] == [1, 2]
+    assert status["enrollment_cache_exists"] and status["enrollment_cache_size"] == 2
+    # Left alone by fills; deleted by mutations so old replicas reload
+    assert legacy_before == 1 and legacy_after == 0
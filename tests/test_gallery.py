@@ -0,0 +1,239 @@
+"""GalleryIndex deltas (upsert/remove) and its IVF lists against brute force."""
+
+import asyncio
+import threading
+
+import numpy as np
+import pytest
+
+from services.ann import IVFIndex, train_centroids
+from services.gallery import GalleryIndex
+
+DIM = 512
+
+
+def _unit(rng, n):
+    vectors = rng.standard_normal((n, DIM)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def _records(vectors, first_id=1):
+    return [
+        {"id": first_id + i, "user_id": first_id + i, "label": f"user{first_id + i}", "encoding": vector}
+        for i, vector in enumerate(vectors)
+    ]
+
+
+class _Reference:
+    """Brute-force model of the gallery: enrollment id -> (user_id, label, vector)."""
+
+    def __init__(self):
+        self.rows = {}
+
+    def upsert(self, enrollment_id, user_id, label, vector):
+        self.rows = {key: row for key, row in self.rows.items() if row[0] != user_id}
+        self.rows[enrollment_id] = (user_id, label, vector)
+
+    def remove_id(self, enrollment_id):
+        self.rows.pop(enrollment_id, None)
+
+    def remove_label(self, label):
+        self.rows = {key: row for key, row in self.rows.items() if row[1] != label}
+
+    def top_k(self, probe, k):
+        ids = np.array(list(self.rows))
+        matrix = np.stack([row[2] for row in self.rows.values()])
+        dists = 1.0 - matrix @ probe
+        order = np.argsort(dists, kind="stable")[:k]
+        return [int(ids[i]) for i in order], dists[order]
+
+
+def _apply_deltas(gallery, reference, rng, steps=300):
+    """Random mix of new users, re-enrollments and deletes, mirrored in the reference."""
+    next_id = 10_000
+    for step in range(steps):
+        action = rng.random()
+        if action < 0.5 or not reference.rows:
+            user_id = int(rng.integers(1, 2_000))
+            vector = _unit(rng, 1)[0]
+            label = f"user{user_id}"
+            gallery.upsert(next_id, user_id, label, vector)
+            reference.upsert(next_id, user_id, label, vector)
+            next_id += 1
+        elif action < 0.8:
+            enrollment_id = int(rng.choice(list(reference.rows)))
+            assert gallery.remove_id(enrollment_id)
+            reference.remove_id(enrollment_id)
+        else:
+            label = reference.rows[int(rng.choice(list(reference.rows)))][1]
+            assert gallery.remove_label(label) >= 1
+            reference.remove_label(label)
+
+
+def _assert_same_rows(gallery, reference):
+    assert len(gallery) == len(reference.rows)
+    assert sorted(gallery.ids.tolist()) == sorted(reference.rows)
+    for row, enrollment_id in enumerate(gallery.ids.tolist()):
+        user_id, label, vector = reference.rows[enrollment_id]
+        record = gallery.record(row)
+        assert (record["user_id"], record["label"]) == (user_id, label)
+        np.testing.assert_array_equal(gallery.matrix[row], vector)
+
+
+def _assert_ivf_consistent(gallery):
+    """Every gallery row sits in exactly one inverted list, the one of its nearest centroid."""
+    ann = gallery.ann
+    assert len(ann) == len(gallery)
+    every = np.sort(ann.candidates(np.zeros(DIM, dtype=np.float32), nprobe=ann.nlist))
+    np.testing.assert_array_equal(every, np.arange(len(gallery)))
+    nearest = ann.nearest_lists(gallery.matrix)
+    for list_no, rows in enumerate(ann._lists):
+        assert np.all(nearest[rows.view()] == list_no)
+
+
+def test_deltas_match_brute_force():
+    rng = np.random.default_rng(1)
+    vectors = _unit(rng, 500)
+    gallery = GalleryIndex.from_enrollments(_records(vectors))
+    reference = _Reference()
+    for rec in _records(vectors):
+        reference.upsert(rec["id"], rec["user_id"], rec["label"], rec["encoding"])
+
+    _apply_deltas(gallery, reference, rng)
+
+    _assert_same_rows(gallery, reference)
+    for probe in _unit(rng, 20):
+        expected_ids, expected = reference.top_k(probe, 5)
+        found = gallery.search_top_k(probe, 5)
+        assert [match["id"] for match in found] == expected_ids
+        np.testing.assert_allclose([match["distance"] for match in found], expected, atol=1e-5)
+        assert gallery.search(probe)["id"] == expected_ids[0]
+    batch = gallery.search_batch(_unit(np.random.default_rng(2), 8))
+    assert [match["id"] for match in batch] == [
+        reference.top_k(probe, 1)[0][0] for probe in _unit(np.random.default_rng(2), 8)
+    ]
+
+
+def test_upsert_replaces_the_users_previous_enrollment():
+    rng = np.random.default_rng(3)
+    gallery = GalleryIndex.from_enrollments(_records(_unit(rng, 10)))
+    vector = _unit(rng, 1)[0]
+
+    gallery.upsert(99, user_id=4, label="again", encoding=vector)
+
+    assert len(gallery) == 10
+    assert 4 not in gallery.ids.tolist()
+    assert gallery.search(vector)["id"] == 99
+
+
+def test_wrong_dimension_is_skipped():
+    gallery = GalleryIndex()
+    assert not gallery.upsert(1, 1, "short", np.ones(128, dtype=np.float32))
+    assert len(gallery) == 0
+    assert gallery.skipped == 1
+
+
+@pytest.mark.parametrize("nprobe", [4, 32])
+def test_ivf_lists_follow_deltas(nprobe):
+    rng = np.random.default_rng(4)
+    vectors = _unit(rng, 800)
+    gallery = GalleryIndex.from_enrollments(_records(vectors))
+    index = IVFIndex(train_centroids(gallery.matrix, 32), nprobe, len(gallery))
+    gallery.attach_ann(index)
+    reference = _Reference()
+    for rec in _records(vectors):
+        reference.upsert(rec["id"], rec["user_id"], rec["label"], rec["encoding"])
+
+    _apply_deltas(gallery, reference, rng)
+
+    _assert_same_rows(gallery, reference)
+    _assert_ivf_consistent(gallery)
+    for probe in _unit(rng, 20):
+        found = gallery.search_top_k(probe, 3)
+        if nprobe == index.nlist:
+            # Probing every list is exhaustive
+            assert [match["id"] for match in found] == reference.top_k(probe, 3)[0]
+        else:
+            # Approximate, but every distance reported is exact
+            for match in found:
+                vector = reference.rows[match["id"]][2]
+                assert match["distance"] == pytest.approx(1.0 - float(vector @ probe), abs=1e-5)
+
+
+def test_ivf_fork_keeps_assignments_across_rebuilds():
+    rng = np.random.default_rng(5)
+    vectors = _unit(rng, 400)
+    gallery = GalleryIndex.from_enrollments(_records(vectors))
+    gallery.attach_ann(IVFIndex(train_centroids(gallery.matrix, 16), 4, len(gallery)))
+    gallery.remove_id(7)
+    gallery.upsert(1_000, 1_000, "new", _unit(rng, 1)[0])
+
+    rebuilt = GalleryIndex.from_enrollments(
+        [dict(gallery.record(row), encoding=gallery.matrix[row]) for row in range(len(gallery))[::-1]]
+    )
+    rebuilt.attach_ann(gallery.ann.fork(gallery.ids))
+
+    before = {int(i): int(gallery.ann._assign[row]) for row, i in enumerate(gallery.ids)}
+    after = {int(i): int(rebuilt.ann._assign[row]) for row, i in enumerate(rebuilt.ids)}
+    assert before == after
+    _assert_ivf_consistent(rebuilt)
+
+
+def test_mutation_waits_for_running_searches():
+    rng = np.random.default_rng(5)
+    gallery = GalleryIndex.from_enrollments(_records(_unit(rng, 50)))
+    release = threading.Event()
+    events = []
+
+    def slow_search(probe):
+        release.wait(5)
+        events.append("search done")
+        return gallery.search(probe)
+
+    async def mutate():
+        await gallery.guard.idle()
+        events.append("mutated")
+        gallery.remove_id(1)
+
+    async def scenario():
+        probe = gallery.matrix[0].copy()
+        searches = [asyncio.ensure_future(gallery.guard.run(slow_search, probe)) for _ in range(3)]
+        await asyncio.sleep(0.05)
+        mutation = asyncio.ensure_future(mutate())
+        # Held back behind the running searches, and holding back new ones
+        late = asyncio.ensure_future(gallery.guard.run(gallery.search, probe))
+        await asyncio.sleep(0.05)
+        assert events == []
+        release.set()
+        results = await asyncio.gather(*searches)
+        await mutation
+        return results, await late
+
+    results, late = asyncio.run(scenario())
+    assert events == ["search done"] * 3 + ["mutated"]
+    assert [match["id"] for match in results] == [1, 1, 1]
+    assert late["id"] != 1
+
+
+def test_cancelled_search_keeps_the_gallery_guarded():
+    gallery = GalleryIndex.from_enrollments(_records(_unit(np.random.default_rng(6), 10)))
+    release = threading.Event()
+    events = []
+
+    def slow_search():
+        release.wait(5)
+        events.append("search done")
+
+    async def scenario():
+        search = asyncio.ensure_future(gallery.guard.run(slow_search))
+        await asyncio.sleep(0.05)
+        search.cancel()
+        mutation = asyncio.ensure_future(gallery.guard.idle())
+        await asyncio.sleep(0.05)
+        assert not mutation.done()
+        release.set()
+        await mutation
+        events.append("mutated")
+
+    asyncio.run(scenario())
+    assert events == ["search done", "mutated"]
@@ -0,0 +1,138 @@
+"""Micro-batching inference scheduler, driven by stub batch functions instead of the model."""
+
+import asyncio
+import threading
+
+import pytest
+from fastapi import HTTPException
+
+from services.inference import InferenceScheduler
+
+
+class StubModel:
+    """Batch function recording the batches it was called with."""
+
+    def __init__(self, gate=None):
+        self.batches = []
+        self.gate = gate
+
+    def __call__(self, inputs):
+        if self.gate is not None:
+            self.gate.wait(5)
+        self.batches.append(list(inputs))
+        return [value * 10 for value in inputs]
+
+
+def _scheduler(workers=1, queue_size=100, max_batch=8, batch_window_ms=50):
+    return InferenceScheduler(workers, queue_size, max_batch, batch_window_ms)
+
+
+def test_jobs_within_the_window_run_as_one_batch():
+    scheduler = _scheduler(max_batch=8)
+    model = StubModel()
+
+    async def scenario():
+        return await asyncio.gather(*(scheduler.submit(model, i) for i in range(5)))
+
+    try:
+        results = asyncio.run(scenario())
+    finally:
+        scheduler.stop()
+    assert results == [0, 10, 20, 30, 40]
+    assert model.batches == [[0, 1, 2, 3, 4]]
+
+
+def test_batches_are_capped_at_max_batch():
+    scheduler = _scheduler(max_batch=3)
+    model = StubModel()
+
+    async def scenario():
+        return await asyncio.gather(*(scheduler.submit(model, i) for i in range(7)))
+
+    try:
+        assert asyncio.run(scenario()) == [i * 10 for i in range(7)]
+    finally:
+        scheduler.stop()
+    assert [len(batch) for batch in model.batches] == [3, 3, 1]
+
+
+def test_job_for_another_function_is_carried_over():
+    scheduler = _scheduler(max_batch=8)
+    encode, detect = StubModel(), StubModel()
+
+    async def scenario():
+        return await asyncio.gather(
+            scheduler.submit(encode, 1),
+            scheduler.submit(encode, 2),
+            scheduler.submit(detect, 3),
+            scheduler.submit(encode, 4),
+        )
+
+    try:
+        assert asyncio.run(scenario()) == [10, 20, 30, 40]
+    finally:
+        scheduler.stop()
+    # The detect job ends the first batch and is run next, not dropped
+    assert encode.batches == [[1, 2], [4]]
+    assert detect.batches == [[3]]
+
+
+def test_errors_reach_every_job_of_the_batch():
+    scheduler = _scheduler()
+
+    def broken(inputs):
+        raise RuntimeError("model failed")
+
+    async def scenario():
+        return await asyncio.gather(*(scheduler.submit(broken, i) for i in range(3)), return_exceptions=True)
+
+    try:
+        results = asyncio.run(scenario())
+    finally:
+        scheduler.stop()
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+def test_full_queue_is_a_503():
+    scheduler = _scheduler(queue_size=2, max_batch=1, batch_window_ms=0)
+    gate = threading.Event()
+    model = StubModel(gate)
+
+    async def scenario():
+        # One job held by the worker, two waiting in the queue
+        running = asyncio.ensure_future(scheduler.submit(model, 0))
+        await asyncio.sleep(0.05)
+        queued = [asyncio.ensure_future(scheduler.submit(model, i)) for i in (1, 2)]
+        await asyncio.sleep(0)
+        with pytest.raises(HTTPException) as raised:
+            await scheduler.submit(model, 3)
+        assert raised.value.status_code == 503
+        assert scheduler.queue_depth == 2
+        gate.set()
+        return await asyncio.gather(running, *queued)
+
+    try:
+        assert asyncio.run(scenario()) == [0, 10, 20]
+    finally:
+        gate.set()
+        scheduler.stop()
+
+
+def test_stop_drains_queued_jobs():
+    scheduler = _scheduler(workers=2, max_batch=2, batch_window_ms=0)
+    gate = threading.Event()
+    model = StubModel(gate)
+
+    async def scenario():
+        jobs = [asyncio.ensure_future(scheduler.submit(model, i)) for i in range(6)]
+        await asyncio.sleep(0.05)
+        # Stop while every job is still queued or running
+        stopping = asyncio.ensure_future(asyncio.to_thread(scheduler.stop))
+        await asyncio.sleep(0.05)
+        gate.set()
+        await stopping
+        return await asyncio.wait_for(asyncio.gather(*jobs), timeout=1)
+
+    assert asyncio.run(scenario()) == [i * 10 for i in range(6)]
+    assert sorted(value for batch in model.batches for value in batch) == list(range(6))
+    assert scheduler._threads == []
@@ -0,0 +1,90 @@
+"""Upload ingestion: signature sniffing, size limits and pooled buffers."""
+
+import asyncio
+import io
+
+import pytest
+from fastapi import HTTPException, UploadFile
+from starlette.datastructures import Headers
+
+from services import ingest
+from services.config import settings
+from services.ingest import BufferPool, read_upload, sniff_image_type
+
+JPEG = b"\xff\xd8\xff\xe0" + bytes(range(256)) * 40
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 100
+
+
+def _upload(data, known_size=True):
+    return UploadFile(
+        io.BytesIO(data),
+        size=len(data) if known_size else None,
+        filename="face.jpg",
+        headers=Headers({"content-type": "image/jpeg"}),
+    )
+
+
+@pytest.mark.parametrize(
+    "head, kind",
+    [
+        (JPEG[:12], "jpeg"),
+        (PNG[:12], "png"),
+        (b"BM" + b"\x00" * 10, "bmp"),
+        (b"RIFF\x00\x00\x00\x00WEBP", "webp"),
+        (b"RIFF\x00\x00\x00\x00WAVE", None),
+        (b"GIF89a", None),
+        (b"", None),
+    ],
+)
+def test_sniff_image_type(head, kind):
+    assert sniff_image_type(head) == kind
+
+
+@pytest.mark.parametrize("known_size", [True, False])
+def test_reads_whole_upload_into_a_pooled_buffer(known_size, monkeypatch):
+    # Several chunks, the last one partial
+    monkeypatch.setattr(ingest, "_READ_CHUNK_BYTES", 1000)
+    upload = asyncio.run(read_upload(_upload(JPEG, known_size)))
+    try:
+        assert upload.size == len(JPEG)
+        assert bytes(upload.view) == JPEG
+    finally:
+        upload.release()
+    assert len(upload.view) == 0
+
+
+def test_oversized_upload_is_rejected_before_reading(monkeypatch):
+    monkeypatch.setattr(settings, "MAX_UPLOAD_BYTES", 1000)
+    with pytest.raises(HTTPException) as raised:
+        asyncio.run(read_upload(_upload(JPEG)))
+    assert raised.value.status_code == 413
+
+
+def test_non_image_is_rejected():
+    with pytest.raises(HTTPException) as raised:
+        asyncio.run(read_upload(_upload(b"%PDF-1.7 not a face")))
+    assert raised.value.status_code == 415
+
+
+def test_empty_upload_gives_an_empty_buffer():
+    upload = asyncio.run(read_upload(_upload(b"")))
+    assert upload.size == 0 and bytes(upload.view) == b""
+    upload.release()
+
+
+def test_buffer_pool_reuses_by_power_of_two_capacity():
+    pool = BufferPool(max_pooled_bytes=1 << 20, min_capacity=1024)
+    buffer = pool.acquire(3000)
+    assert len(buffer) == 4096
+    pool.release(buffer)
+    assert pool.acquire(2500) is buffer
+    assert pool.acquire(2500) is not buffer
+
+
+def test_buffer_pool_keeps_at_most_its_budget():
+    pool = BufferPool(max_pooled_bytes=4096, min_capacity=4096)
+    first, second = pool.acquire(4096), pool.acquire(4096)
+    pool.release(first)
+    pool.release(second)  # over budget: left to the garbage collector
+    assert pool.acquire(4096) is first
+    assert pool.acquire(4096) is not second
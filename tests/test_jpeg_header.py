@@ -0,0 +1,96 @@
+"""JPEG start-of-frame parsing used to pick the reduced decode scale."""
+
+import struct
+
+import cv2
+import numpy as np
+import pytest
+
+from services.config import settings
+from services.recognition import _decode_scale, _jpeg_size
+
+
+def _encode(width, height, progressive=False):
+    image = np.random.default_rng(0).integers(0, 255, (height, width, 3), dtype=np.uint8)
+    params = [cv2.IMWRITE_JPEG_PROGRESSIVE, 1] if progressive else []
+    ok, data = cv2.imencode(".jpg", image, params)
+    assert ok
+    return data.tobytes()
+
+
+def _segment(marker, payload):
+    return bytes([0xFF, marker]) + struct.pack(">H", len(payload) + 2) + payload
+
+
+def _sof(marker, width, height):
+    return _segment(marker, struct.pack(">BHHB", 8, height, width, 3) + b"\x01\x22\x00" * 3)
+
+
+@pytest.mark.parametrize("progressive", [False, True])
+def test_size_of_encoded_jpegs(progressive):
+    assert _jpeg_size(_encode(640, 480, progressive)) == (640, 480)
+    assert _jpeg_size(_encode(31, 97, progressive)) == (31, 97)
+
+
+@pytest.mark.parametrize("marker", [0xC0, 0xC1, 0xC2, 0xC3, 0xC9, 0xCF])
+def test_frame_after_other_segments(marker):
+    data = (
+        b"\xff\xd8"
+        + _segment(0xE0, b"JFIF\x00" + b"\x00" * 9)
+        + _segment(0xE1, b"Exif\x00\x00" + b"\x00" * 300)
+        + _segment(0xDB, b"\x00" * 65)
+        + _sof(marker, 4000, 3000)
+        + b"\x00" * 16
+    )
+    assert _jpeg_size(data) == (4000, 3000)
+
+
+def test_fill_bytes_before_a_marker():
+    data = b"\xff\xd8" + b"\xff\xff\xff" + _sof(0xC0, 1920, 1080) + b"\x00" * 16
+    assert _jpeg_size(data) == (1920, 1080)
+
+
+def test_dht_and_jpg_markers_are_not_frames():
+    # 0xC4 (DHT) and 0xC8 (JPG) sit in the SOF range but carry no size
+    data = (
+        b"\xff\xd8"
+        + _segment(0xC4, b"\x00" * 40)
+        + _segment(0xC8, b"\x00" * 8)
+        + _sof(0xC2, 800, 600)
+        + b"\x00" * 16
+    )
+    assert _jpeg_size(data) == (800, 600)
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        b"",
+        b"\x89PNG\r\n\x1a\n" + b"\x00" * 64,
+        b"\xff\xd8",
+        # Scan starts before any frame header
+        b"\xff\xd8" + _segment(0xDA, b"\x00" * 10) + b"\x00" * 16,
+        # Garbage where a marker should be
+        b"\xff\xd8" + b"\x12\x34" + b"\x00" * 32,
+        # Frame header truncated
+        b"\xff\xd8" + _sof(0xC0, 640, 480)[:8],
+        # Zero dimensions
+        b"\xff\xd8" + _sof(0xC0, 0, 480) + b"\x00" * 16,
+    ],
+)
+def test_not_a_usable_jpeg_header(data):
+    assert _jpeg_size(data) is None
+
+
+def test_decode_scale_keeps_the_longer_side_above_the_floor(monkeypatch):
+    monkeypatch.setattr(settings, "DECODE_REDUCED", True)
+    monkeypatch.setattr(settings, "DECODE_MIN_SIDE", 960)
+    assert _decode_scale((4000, 3000), det_size=640) == 4
+    assert _decode_scale((8000, 6000), det_size=640) == 8
+    assert _decode_scale((1920, 1080), det_size=640) == 2
+    assert _decode_scale((1280, 720), det_size=640) == 1
+    assert _decode_scale((4000, 3000), det_size=2048) == 1
+    assert _decode_scale(None, det_size=640) == 1
+
+    monkeypatch.setattr(settings, "DECODE_REDUCED", False)
+    assert _decode_scale((8000, 6000), det_size=640) == 1
@@ -0,0 +1,125 @@
+"""Byte-budgeted L1 cache: LRU eviction, TTL and in-place resize accounting."""
+
+import numpy as np
+
+from services.gallery import EMBEDDING_DIM, GalleryIndex
+from services.l1cache import L1Cache
+
+
+def test_evicts_least_recently_used_by_bytes():
+    cache = L1Cache(max_bytes=100)
+    cache.put("a", 1, 40)
+    cache.put("b", 2, 40)
+    assert cache.get("a") == 1  # "b" is now least recently used
+
+    cache.put("c", 3, 40)
+
+    assert cache.peek("b") is None
+    assert cache.peek("a") == 1 and cache.peek("c") == 3
+    assert cache.stats()["bytes"] == 80
+    assert cache.evictions == 1
+
+
+def test_peek_does_not_refresh_recency_or_count():
+    cache = L1Cache(max_bytes=100)
+    cache.put("a", 1, 50)
+    cache.put("b", 2, 50)
+    assert cache.peek("a") == 1
+
+    cache.put("c", 3, 50)
+
+    assert "a" not in cache
+    assert cache.hits == 0 and cache.misses == 0
+
+
+def test_replacing_an_entry_updates_its_size():
+    cache = L1Cache(max_bytes=100)
+    cache.put("a", 1, 60)
+    cache.put("a", 2, 30)
+    assert cache.stats()["bytes"] == 30
+    assert cache.get("a") == 2
+
+
+def test_entry_larger_than_budget_is_rejected():
+    cache = L1Cache(max_bytes=100)
+    cache.put("a", 1, 50)
+    cache.put("huge", 2, 101)
+    assert "huge" not in cache
+    assert cache.peek("a") == 1
+    assert cache.rejected == 1
+
+
+def test_expired_entries_count_as_misses(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("services.l1cache.time.monotonic", lambda: now[0])
+    cache = L1Cache(max_bytes=100)
+    cache.put("a", 1, 10, ttl=5)
+    assert cache.get("a") == 1
+
+    now[0] += 5
+    assert cache.get("a") is None
+    assert cache.expirations == 1 and cache.misses == 1
+    assert cache.stats()["bytes"] == 0
+
+
+def test_resize_grows_and_evicts_others():
+    cache = L1Cache(max_bytes=100)
+    cache.put("a", 1, 30)
+    cache.put("b", 2, 30)
+
+    cache.resize("a", 80)
+
+    # "a" was just mutated, so "b" goes
+    assert "b" not in cache
+    assert cache.stats()["bytes"] == 80
+
+
+def test_resize_shrinks_and_ignores_missing_keys():
+    cache = L1Cache(max_bytes=100)
+    cache.put("a", 1, 80)
+    cache.resize("a", 20)
+    cache.resize("missing", 50)
+    assert cache.stats()["bytes"] == 20
+    assert len(cache) == 1
+
+
+def test_resize_past_budget_drops_the_entry():
+    cache = L1Cache(max_bytes=100)
+    cache.put("a", 1, 50)
+    cache.resize("a", 150)
+    assert "a" not in cache
+    assert cache.rejected == 1
+    assert cache.stats()["bytes"] == 0
+
+
+def test_gallery_deltas_keep_accounting_exact():
+    rng = np.random.default_rng(0)
+    cache = L1Cache(max_bytes=1 << 30)
+    gallery = GalleryIndex.from_enrollments([])
+    cache.put(1, gallery, gallery.nbytes)
+
+    for i in range(200):
+        gallery.upsert(i, i, f"user{i}", rng.standard_normal(EMBEDDING_DIM).astype(np.float32))
+        cache.resize(1, gallery.nbytes)
+    assert cache.stats()["bytes"] == gallery.nbytes
+
+    for i in range(0, 200, 2):
+        gallery.remove_id(i)
+        cache.resize(1, gallery.nbytes)
+    gallery.remove_label("user1")
+    cache.resize(1, gallery.nbytes)
+    assert cache.stats()["bytes"] == gallery.nbytes
+
+
+def test_discard_where_and_clear():
+    cache = L1Cache(max_bytes=100)
+    cache.put(("user", 1, 5), "x", 10)
+    cache.put(("user", 2, 5), "y", 10)
+    cache.put(("config", 1), "z", 10)
+
+    assert cache.discard_where(lambda key: key[1] == 1) == 2
+    assert list(cache.keys()) == [("user", 2, 5)]
+    assert cache.stats()["bytes"] == 10
+
+    cache.clear()
+    assert len(cache) == 0 and cache.stats()["bytes"] == 0
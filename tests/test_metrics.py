@@ -0,0 +1,83 @@
+"""Prometheus text exposition and the route-template request labels."""
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from services import enrollment, metrics
+from services.config import settings
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(settings, "METRICS_ENABLED", True)
+
+    async def list_enrollments(tenant_id):
+        with metrics.stage("db"):
+            pass
+        return []
+
+    monkeypatch.setattr(enrollment, "list_enrollments", list_enrollments)
+    return TestClient(main.app)
+
+
+def _samples(text):
+    """{series: value} of the sample lines of an exposition."""
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            series, value = line.rsplit(" ", 1)
+            samples[series] = float(value)
+    return samples
+
+
+def test_histogram_exposition_format():
+    histogram = metrics.Histogram("test_seconds", "Test latency.", ("endpoint",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 3.0):
+        histogram.observe(value, '/a"b')
+
+    assert list(histogram.collect()) == [
+        "# HELP test_seconds Test latency.",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{endpoint="/a\\"b",le="0.1"} 1',
+        'test_seconds_bucket{endpoint="/a\\"b",le="1.0"} 3',
+        'test_seconds_bucket{endpoint="/a\\"b",le="+Inf"} 4',
+        'test_seconds_sum{endpoint="/a\\"b"} 4.05',
+        'test_seconds_count{endpoint="/a\\"b"} 4',
+    ]
+
+
+def test_parameterized_route_is_labelled_by_its_template(client):
+    for tenant_id in (901, 901, 902):
+        assert client.get(f"/enrollments/{tenant_id}").status_code == 200
+    response = client.get("/metrics")
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+
+    samples = _samples(response.text)
+    # One series per route template and tenant, never per raw path
+    assert samples['face_request_seconds_count{endpoint="/enrollments/{tenant_id}",tenant="901"}'] == 2
+    assert samples['face_request_seconds_count{endpoint="/enrollments/{tenant_id}",tenant="902"}'] == 1
+    assert samples['face_stage_seconds_count{stage="db",endpoint="/enrollments/{tenant_id}",tenant="901"}'] == 2
+    assert not any('endpoint="/enrollments/901"' in series for series in samples)
+    assert (
+        samples['face_request_seconds_bucket{endpoint="/enrollments/{tenant_id}",tenant="901",le="+Inf"}']
+        == samples['face_request_seconds_count{endpoint="/enrollments/{tenant_id}",tenant="901"}']
+    )
+    assert "# TYPE face_request_seconds histogram" in response.text
+    assert "# TYPE face_inference_queue_depth gauge" in response.text
+
+
+def test_unknown_paths_share_one_label(client):
+    client.get("/no/such/route/1")
+    client.get("/no/such/route/2")
+    samples = _samples(client.get("/metrics").text)
+    assert samples['face_request_seconds_count{endpoint="unmatched",tenant=""}'] >= 2
+    assert not any("/no/such/route" in series for series in samples)
+
+
+def test_tenant_labels_are_capped(monkeypatch):
+    monkeypatch.setattr(metrics, "_known_tenants", {"1", "2"})
+    monkeypatch.setattr(settings, "METRICS_MAX_TENANTS", 3)
+    assert metrics.tenant_label(3) == "3"
+    assert metrics.tenant_label(4) == "other"
+    assert metrics.tenant_label(1) == "1"
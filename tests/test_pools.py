@@ -0,0 +1,237 @@
+"""Shared tenant pool registry: select_db routing, budget, keys and health checks."""
+
+import asyncio
+from contextlib import asynccontextmanager
+
+import pytest
+
+from services import pools
+from services.pools import PoolBudgetExhausted, TenantPoolRegistry
+
+
+class FakeConnection:
+    def __init__(self, log):
+        self.log = log
+        self.alive = True
+
+    async def select_db(self, database):
+        self.log.append(database)
+
+    async def ping(self, reconnect=False):
+        if not self.alive:
+            raise ConnectionError("server gone")
+
+
+class FakePool:
+    """The parts of aiomysql.Pool the registry uses; acquire waits at maxsize."""
+
+    def __init__(self, log, **kwargs):
+        self.kwargs = kwargs
+        self.maxsize = kwargs["maxsize"]
+        self._log = log
+        self._free = [FakeConnection(log)]
+        self._used = 0
+        self._slots = asyncio.Semaphore(self.maxsize)
+        self.closed = False
+
+    @property
+    def size(self):
+        return len(self._free) + self._used
+
+    @property
+    def freesize(self):
+        return len(self._free)
+
+    @asynccontextmanager
+    async def acquire(self):
+        async with self._slots:
+            conn = self._free.pop() if self._free else FakeConnection(self._log)
+            self._used += 1
+            try:
+                yield conn
+            finally:
+                self._used -= 1
+                self._free.append(conn)
+
+    def close(self):
+        self.closed = True
+
+    async def wait_closed(self):
+        pass
+
+
+@pytest.fixture
+def created(monkeypatch):
+    """Pools created through aiomysql.create_pool, plus the select_db log."""
+    made = []
+    selects = []
+
+    async def create_pool(**kwargs):
+        await asyncio.sleep(0.01)
+        pool = FakePool(selects, **kwargs)
+        made.append(pool)
+        return pool
+
+    monkeypatch.setattr(pools.aiomysql, "create_pool", create_pool)
+    return made, selects
+
+
+def _registry(pool_size=5, max_connections=100, tenant_size=None):
+    return TenantPoolRegistry(
+        pool_size=pool_size,
+        max_connections=max_connections,
+        idle_timeout=60,
+        health_interval=0,
+        recycle=3600,
+        tenant_size=tenant_size,
+    )
+
+
+async def _use(registry, tenant_id):
+    async with registry.connection(tenant_id):
+        pass
+
+
+def test_tenants_on_one_login_share_a_pool(created):
+    made, selects = created
+    registry = _registry()
+
+    async def scenario():
+        await registry.register(1, "db1", 3306, "app", "secret", "school_1")
+        await registry.register(2, "db1", 3306, "app", "secret", "school_2")
+        await registry.register(3, "db2", 3306, "app", "secret", "school_3")
+        for tenant_id in (1, 1, 2, 2, 1, 3):
+            await _use(registry, tenant_id)
+
+    asyncio.run(scenario())
+    assert len(made) == 2
+    # select_db only when a connection switches database
+    assert selects == ["school_1", "school_2", "school_1", "school_3"]
+    assert registry.stats()["pools"] == 2 and registry.stats()["tenants"] == 3
+
+
+def test_busy_tenant_does_not_block_others_on_its_server(created):
+    made, _ = created
+    registry = _registry(pool_size=8, tenant_size=4)
+
+    async def scenario():
+        await registry.register(1, "db1", 3306, "app", "secret", "school_1")
+        await registry.register(2, "db1", 3306, "app", "secret", "school_2")
+        release = asyncio.Event()
+
+        async def slow_query():
+            async with registry.connection(1):
+                await release.wait()
+
+        # Tenant 1 is stuck on enough slow queries to fill the whole pool
+        slow = [asyncio.ensure_future(slow_query()) for _ in range(8)]
+        await asyncio.sleep(0.01)
+        assert registry.stats()["in_use"] == 4
+
+        await asyncio.wait_for(_use(registry, 2), timeout=1)
+        release.set()
+        await asyncio.gather(*slow)
+
+    asyncio.run(scenario())
+    assert len(made) == 1 and made[0].maxsize == 8
+
+
+def test_concurrent_first_requests_create_one_pool(created):
+    made, _ = created
+    registry = _registry()
+
+    async def scenario():
+        await asyncio.gather(*(
+            registry.register(tenant_id, "db1", 3306, "app", "secret", f"school_{tenant_id}")
+            for tenant_id in range(20)
+        ))
+
+    asyncio.run(scenario())
+    assert len(made) == 1
+    assert registry.tenants() == set(range(20))
+
+
+def test_keys_hold_no_password_and_change_with_it(created):
+    made, _ = created
+    registry = _registry()
+
+    async def scenario():
+        await registry.register(1, "db1", 3306, "app", "old-secret", "school_1")
+        await registry.register(2, "db1", 3306, "app", "new-secret", "school_2")
+
+    asyncio.run(scenario())
+    assert len(made) == 2
+    assert [pool.kwargs["password"] for pool in made] == ["old-secret", "new-secret"]
+    for key in registry._servers:
+        assert "old-secret" not in key and "new-secret" not in key
+
+
+def test_budget_closes_idle_pools_first(created):
+    made, _ = created
+    registry = _registry(pool_size=5, max_connections=10)
+
+    async def scenario():
+        for tenant_id in (1, 2, 3):
+            await registry.register(tenant_id, f"db{tenant_id}", 3306, "app", "secret", "school")
+
+    asyncio.run(scenario())
+    assert len(made) == 3
+    assert made[0].closed and not made[1].closed and not made[2].closed
+    assert registry.tenants() == {2, 3}
+
+
+def test_budget_exhausted_when_pools_are_busy(created):
+    registry = _registry(pool_size=5, max_connections=5)
+
+    async def scenario():
+        await registry.register(1, "db1", 3306, "app", "secret", "school_1")
+        async with registry.connection(1):
+            with pytest.raises(PoolBudgetExhausted):
+                await registry.register(2, "db2", 3306, "app", "secret", "school_2")
+        # The failed creation released its reservation
+        assert registry._reserved == 0
+
+    asyncio.run(scenario())
+
+
+def test_forget_closes_a_pool_no_tenant_uses(created):
+    made, _ = created
+    registry = _registry()
+
+    async def scenario():
+        await registry.register(1, "db1", 3306, "app", "secret", "school_1")
+        await registry.register(2, "db1", 3306, "app", "secret", "school_2")
+        await registry.forget(1)
+        assert not made[0].closed
+        await registry.forget(2)
+
+    asyncio.run(scenario())
+    assert made[0].closed
+    assert registry.stats()["pools"] == 0
+
+
+def test_health_check_drops_dead_and_idle_pools(created):
+    made, _ = created
+    registry = _registry()
+
+    async def scenario():
+        await registry.register(1, "db1", 3306, "app", "secret", "school_1")
+        await registry.register(2, "db2", 3306, "app", "secret", "school_2")
+        made[0]._free[0].alive = False
+        await registry.check()
+        assert registry.tenants() == {2}
+
+        registry.idle_timeout = 0
+        await registry.check()
+        assert registry.tenants() == set()
+
+    asyncio.run(scenario())
+    assert all(pool.closed for pool in made)
+
+
+def test_budget_exhausted_is_a_503():
+    import main
+
+    handler = main.app.exception_handlers[PoolBudgetExhausted]
+    response = asyncio.run(handler(None, PoolBudgetExhausted("10 of 10 database connections in use")))
+    assert response.status_code == 503
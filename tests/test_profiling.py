@@ -0,0 +1,110 @@
+"""Request profiling: secret-gated capture and download, and the Server-Timing header."""
+
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from services import enrollment, metrics, profiling
+from services.config import settings
+
+SECRET = "s3cret"
+
+
+def _busy(seconds):
+    # Blocks the event loop in Python code, so the sampler sees a stack
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "PROFILING_ENABLED", True)
+    monkeypatch.setattr(settings, "PROFILING_SECRET", SECRET)
+    monkeypatch.setattr(settings, "PROFILING_SAMPLE_RATE", 0.0)
+    monkeypatch.setattr(settings, "PROFILING_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "SERVER_TIMING_ENABLED", True)
+    monkeypatch.setattr(profiling.profiler, "interval", 0.001)
+
+    async def list_enrollments(tenant_id):
+        with metrics.stage("db"):
+            _busy(0.05)
+        return []
+
+    monkeypatch.setattr(enrollment, "list_enrollments", list_enrollments)
+    return TestClient(main.app)
+
+
+def test_request_with_the_secret_is_profiled_and_downloadable(client, tmp_path):
+    headers = {"X-Debug-Profile": SECRET}
+    response = client.get("/enrollments/4", headers=headers)
+    name = response.headers["x-profile"]
+    assert "enrollments_tenant_id" in name and "-t4-" in name
+    assert (tmp_path / name).is_file()
+
+    listed = client.get("/admin/profiles", headers=headers).json()["profiles"]
+    assert [profile["name"] for profile in listed] == [name]
+    body = client.get(f"/admin/profiles/{name}", headers=headers).text
+    # Collapsed stacks: "thread;frame;...;frame count", with our handler on some stack
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in body.splitlines())
+    assert "_busy (test_profiling.py" in body
+
+
+@pytest.mark.parametrize("header", [None, "wrong", SECRET + "x", ""])
+def test_request_without_the_secret_is_not_profiled(client, header, tmp_path):
+    headers = {} if header is None else {"X-Debug-Profile": header}
+    response = client.get("/enrollments/4", headers=headers)
+    assert response.status_code == 200
+    assert "x-profile" not in response.headers
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_profile_download_needs_the_secret(client, monkeypatch):
+    assert client.get("/admin/profiles").status_code == 403
+    assert client.get("/admin/profiles", headers={"X-Debug-Profile": "wrong"}).status_code == 403
+    assert client.get("/admin/profiles", headers={"X-Debug-Profile": SECRET}).status_code == 200
+
+    # Without a configured secret nothing matches, not even an empty header
+    monkeypatch.setattr(settings, "PROFILING_SECRET", "")
+    assert client.get("/admin/profiles", headers={"X-Debug-Profile": ""}).status_code == 403
+    assert not profiling.authorized({"x-debug-profile": ""})
+
+    monkeypatch.setattr(settings, "PROFILING_ENABLED", False)
+    assert client.get("/admin/profiles", headers={"X-Debug-Profile": SECRET}).status_code == 404
+
+
+@pytest.mark.parametrize(
+    "name",
+    ["../secret.folded", "..%2Fsecret.folded", "%2E%2E%2Fsecret.folded", "sub%2Finner.folded", "notes.txt"],
+)
+def test_profile_names_cannot_leave_the_profile_directory(client, tmp_path, name):
+    # Files a traversal would reach: next to the directory, in a subdirectory, or not a profile
+    (tmp_path.parent / "secret.folded").write_text("outside\n")
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "inner.folded").write_text("nested\n")
+    (tmp_path / "notes.txt").write_text("not a profile\n")
+
+    response = client.get(f"/admin/profiles/{name}", headers={"X-Debug-Profile": SECRET})
+    assert response.status_code == 404
+
+
+def test_profile_path_accepts_only_plain_profile_names(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "PROFILING_DIR", str(tmp_path))
+    (tmp_path / "a.folded").write_text("x 1\n")
+    assert profiling.profile_path("a.folded") == tmp_path / "a.folded"
+    for name in ("missing.folded", "../a.folded", "./a.folded", "/etc/passwd", "a.folded/..", ""):
+        assert profiling.profile_path(name) is None
+
+
+def test_server_timing_reports_stages_and_total(client):
+    response = client.get("/enrollments/4")
+    entries = dict(entry.split(";dur=") for entry in response.headers["server-timing"].split(", "))
+    assert list(entries) == ["db", "total"]
+    assert 50 <= float(entries["db"]) <= float(entries["total"])
+
+
+def test_server_timing_can_be_turned_off(client, monkeypatch):
+    monkeypatch.setattr(settings, "SERVER_TIMING_ENABLED", False)
+    assert "server-timing" not in client.get("/enrollments/4").headers
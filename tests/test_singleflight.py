@@ -0,0 +1,280 @@
+"""SingleFlight, the Redis load lock and fill_once."""
+
+import asyncio
+import json
+import time
+from contextlib import asynccontextmanager
+
+import fakeredis
+import numpy as np
+import pytest
+
+from services.config import settings
+from services.database import TenantConfig
+from services.gallery import EMBEDDING_DIM
+from services.singleflight import RedisLoadLock, SingleFlight, fill_once
+
+TENANT = 1
+
+
+def test_concurrent_callers_share_one_load():
+    flight = SingleFlight()
+    calls = []
+
+    async def load():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return len(calls)
+
+    async def scenario():
+        results = await asyncio.gather(*(flight.do("key", load) for _ in range(20)))
+        assert not flight.in_flight("key")
+        # A later call starts a new load
+        return results, await flight.do("key", load)
+
+    results, later = asyncio.run(scenario())
+    assert results == [1] * 20
+    assert later == 2
+
+
+def test_errors_reach_every_waiter_and_are_not_cached():
+    flight = SingleFlight()
+    attempts = []
+
+    async def load():
+        attempts.append(1)
+        await asyncio.sleep(0.01)
+        if len(attempts) == 1:
+            raise RuntimeError("database down")
+        return "ok"
+
+    async def scenario():
+        results = await asyncio.gather(*(flight.do("key", load) for _ in range(3)), return_exceptions=True)
+        return results, await flight.do("key", load)
+
+    results, retried = asyncio.run(scenario())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert retried == "ok"
+
+
+def test_cancelled_caller_does_not_cancel_the_shared_load():
+    flight = SingleFlight()
+
+    async def load():
+        await asyncio.sleep(0.02)
+        return "loaded"
+
+    async def scenario():
+        first = asyncio.ensure_future(flight.do("key", load))
+        second = asyncio.ensure_future(flight.do("key", load))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(scenario()) == "loaded"
+
+
+def test_spawn_runs_once_in_background():
+    flight = SingleFlight()
+    calls = []
+
+    async def load():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+
+    async def scenario():
+        flight.spawn("key", load)
+        flight.spawn("key", load)
+        assert flight.in_flight("key")
+        await asyncio.sleep(0.05)
+        return flight.in_flight("key")
+
+    assert asyncio.run(scenario()) is False
+    assert calls == [1]
+
+
+def test_lock_is_exclusive_and_only_released_by_its_owner():
+    async def scenario():
+        client = fakeredis.aioredis.FakeRedis()
+        first = RedisLoadLock(client, "fill", timeout=5)
+        second = RedisLoadLock(client, "fill", timeout=5)
+        assert await first.acquire()
+        assert not await second.acquire()
+        # Not the owner: the release leaves the lock in place
+        await second.release()
+        assert not await second.acquire()
+        await first.release()
+        assert await second.acquire()
+
+    asyncio.run(scenario())
+
+
+def test_expired_lock_taken_over_is_kept():
+    async def scenario():
+        client = fakeredis.aioredis.FakeRedis()
+        stale = RedisLoadLock(client, "fill", timeout=5)
+        assert await stale.acquire()
+        await client.delete(stale.key)  # expired
+        fresh = RedisLoadLock(client, "fill", timeout=5)
+        assert await fresh.acquire()
+        await stale.release()
+        return await client.get(fresh.key) == fresh._token
+
+    assert asyncio.run(scenario())
+
+
+def test_fill_once_loads_on_one_replica():
+    loads = []
+    cache = {}
+
+    async def read_cache():
+        return cache.get("value")
+
+    async def load():
+        loads.append(1)
+        await asyncio.sleep(0.05)
+        cache["value"] = "filled"
+        return "filled"
+
+    async def scenario():
+        client = fakeredis.aioredis.FakeRedis()
+        # Each call stands for a replica (no shared SingleFlight)
+        return await asyncio.gather(
+            *(fill_once(client, "tenant:1", 5, read_cache, load, poll_interval=0.01) for _ in range(5))
+        )
+
+    assert asyncio.run(scenario()) == ["filled"] * 5
+    assert loads == [1]
+
+
+def test_fill_once_falls_back_to_loading_after_timeout():
+    async def scenario():
+        client = fakeredis.aioredis.FakeRedis()
+        # A replica took the lock and died without filling the cache
+        assert await RedisLoadLock(client, "tenant:1", timeout=5).acquire()
+
+        async def read_cache():
+            return None
+
+        async def load():
+            return "loaded"
+
+        return await fill_once(client, "tenant:1", 0.05, read_cache, load, poll_interval=0.01)
+
+    assert asyncio.run(scenario()) == "loaded"
+
+
+@pytest.fixture
+def load_lock(monkeypatch):
+    monkeypatch.setattr(settings, "CACHE_LOAD_LOCK", True)
+    monkeypatch.setattr(settings, "CACHE_LOAD_LOCK_TIMEOUT", 2)
+
+
+def test_waiting_replica_polls_only_the_sentinel(manager, monkeypatch, load_lock):
+    full_reads = []
+    read_hash = manager._read_enrollment_hash
+
+    async def counted(tenant_id):
+        full_reads.append(1)
+        return await read_hash(tenant_id)
+
+    async def load(tenant_id):
+        return [
+            {"id": i, "user_id": i, "label": f"user{i}", "encoding": np.full(EMBEDDING_DIM, 0.5, dtype=np.float32)}
+            for i in (1, 2)
+        ]
+
+    monkeypatch.setattr(manager, "_read_enrollment_hash", counted)
+    monkeypatch.setattr(manager, "_load_enrollments", load)
+
+    async def scenario():
+        # Another replica holds the lock while it fills
+        other = RedisLoadLock(manager._redis, manager._enrollment_cache_key(TENANT), timeout=2)
+        assert await other.acquire()
+        waiter = asyncio.ensure_future(manager._refresh_enrollments(TENANT))
+        await asyncio.sleep(0.3)
+        polled = len(full_reads)
+        await manager._fill_enrollments(TENANT)
+        await other.release()
+        return polled, await waiter
+
+    polled, enrollments = asyncio.run(scenario())
+    assert polled == 0
+    assert [record["id"] for record in enrollments] == [1, 2]
+    assert len(full_reads) == 1
+
+
+class _Gateway:
+    """Gateway pool stand-in returning one tenants row."""
+
+    def __init__(self, row):
+        self.row = row
+        self.queries = 0
+
+    @asynccontextmanager
+    async def acquire(self):
+        yield self
+
+    @asynccontextmanager
+    async def cursor(self, *args):
+        yield self
+
+    async def execute(self, *args):
+        self.queries += 1
+
+    async def fetchone(self):
+        return self.row
+
+
+@pytest.fixture
+def gateway(manager, monkeypatch):
+    gateway = _Gateway({
+        "id": TENANT, "name": "School", "db_host": "db1:3307", "port": 3306,
+        "db_name": "school_1", "db_user": "app", "db_pass": "secret", "status": "active",
+    })
+    monkeypatch.setattr(manager, "_gateway_pool", gateway)
+    return gateway
+
+
+def test_cached_config_keeps_the_layout_older_releases_read(manager, gateway):
+    async def scenario():
+        await manager._load_tenant_config(TENANT)
+        return await manager._redis.get(f"tenant:config:{TENANT}"), await manager._read_cached_config(TENANT)
+
+    raw, (config, fresh_until) = asyncio.run(scenario())
+    # What a replica still on the previous release does with the entry
+    assert TenantConfig(**json.loads(raw)) == config
+    assert config.db_host == "db1" and config.db_server_port == 3307
+    assert time.time() < fresh_until <= time.time() + settings.TENANT_CACHE_TTL
+
+
+def test_config_without_a_stamp_counts_as_fresh(manager, gateway):
+    async def scenario():
+        # Written by a replica still on the previous release
+        await manager._redis.set(
+            f"tenant:config:{TENANT}",
+            json.dumps({
+                "id": TENANT, "name": "School", "db_host": "db1", "db_port": 3306, "db_name": "school_1",
+                "db_user": "app", "db_pass": "secret", "status": "active",
+            }),
+            ex=300,
+        )
+        return await manager.get_tenant_config(TENANT)
+
+    assert asyncio.run(scenario()).db_name == "school_1"
+    assert gateway.queries == 0
+
+
+def test_stale_config_is_served_while_refreshing(manager, gateway):
+    async def scenario():
+        await manager._load_tenant_config(TENANT)
+        manager._l1.clear()
+        await manager._redis.set(f"tenant:config:{TENANT}:fresh_until", str(time.time() - 1))
+        served = await manager.get_tenant_config(TENANT)
+        await asyncio.sleep(0.01)
+        return served, (await manager._read_cached_config(TENANT))[1]
+
+    served, fresh_until = asyncio.run(scenario())
+    assert served.db_name == "school_1"
+    assert gateway.queries == 2
+    assert fresh_until > time.time()